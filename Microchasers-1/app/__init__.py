@@ -1,12 +1,10 @@
 import os
-import logging
-from logging.handlers import RotatingFileHandler
 from flask import Flask
 from flask_migrate import Migrate
 from flask_login import LoginManager
 from .database import db
 
-def create_app():
+def create_app(test_config=None):
     app = Flask(__name__, instance_relative_config=True)
 
     # Load the default configuration
@@ -14,8 +12,55 @@ def create_app():
         SECRET_KEY='dev',
         SQLALCHEMY_DATABASE_URI='sqlite:///microchasers.db',
         SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        SOCKETIO_MESSAGE_QUEUE=os.environ.get('SOCKETIO_MESSAGE_QUEUE'),
+        # Overlays are rendered on request and kept in a bounded in-memory cache
+        ANNOTATION_FORMAT='webp',  # webp, jpeg or png
+        ANNOTATION_QUALITY=80,  # webp/jpeg quality, 0-100
+        ANNOTATION_PNG_COMPRESSION=3,  # png zlib level, 0-9
+        ANNOTATION_CACHE_BYTES=64 * 1024 * 1024,
+        ANNOTATION_WORKERS=2,
+        # Processes per web worker that run detection; 0 runs it inline
+        DETECTION_PROCESSES=int(os.environ.get('DETECTION_PROCESSES', 2)),
+        DETECTION_QUEUE_LIMIT=8,
+        DETECTION_TIMEOUT=120,
+        # Uploads within this many bits of perceptual hash of an analysed image
+        # in the same sample 'reuse' its detections or are 'mark'ed as
+        # duplicates; 'off' analyses every upload
+        NEAR_DUPLICATE_POLICY=os.environ.get('NEAR_DUPLICATE_POLICY', 'mark'),
+        NEAR_DUPLICATE_DISTANCE=3,
+        # Estimated analysis memory each web worker admits at once; uploads
+        # beyond it queue, and are refused with 503 once the queue is full
+        # or they have waited too long (see app.admission)
+        ANALYSIS_MEMORY_BUDGET=int(os.environ.get('ANALYSIS_MEMORY_BUDGET', 1024 * 1024 * 1024)),
+        ANALYSIS_QUEUE_LIMIT=16,
+        ANALYSIS_QUEUE_TIMEOUT=30,
+        ANALYSIS_USER_LIMIT=4,  # uploads in flight per user before 429
+        # Rendered fragments and export payloads kept per process, and
+        # optionally in a directory shared by all workers (see app.caching)
+        FRAGMENT_CACHE_BYTES=int(os.environ.get('FRAGMENT_CACHE_BYTES', 32 * 1024 * 1024)),
+        FRAGMENT_CACHE_DIR=os.environ.get('FRAGMENT_CACHE_DIR'),
+        FRAGMENT_CACHE_DISK_BYTES=int(os.environ.get('FRAGMENT_CACHE_DISK_BYTES', 512 * 1024 * 1024)),
+        LOG_FILE='logs/microchasers.log',
+        LOG_MAX_BYTES=10 * 1024 * 1024,
+        LOG_BACKUP_COUNT=10,
+        LOG_FORMAT=os.environ.get('LOG_FORMAT', 'json'),  # json or text
+        LOG_REQUESTS=True,
+        ADMIN_USERS_PER_PAGE=50,
+        # Samples per page of the sample list, and shown on the home page
+        SAMPLES_PER_PAGE=20,
+        # Log requests slower than this many milliseconds with their SQL; None disables
+        SLOW_REQUEST_MS=int(os.environ['SLOW_REQUEST_MS']) if os.environ.get('SLOW_REQUEST_MS') else None,
     )
 
+    if test_config is not None:
+        # Overrides for tests and benchmarks, e.g. a throwaway database
+        app.config.from_mapping(test_config)
+
+    app.config.setdefault('UPLOAD_URL_PREFIX', 'uploads')
+    # Uploads in progress, not served; on the filesystem of the static folder
+    app.config.setdefault('UPLOAD_TEMP_FOLDER', os.path.join(app.instance_path, 'tmp'))
+    app.config.setdefault('DERIVATIVES_FOLDER', os.path.join(app.instance_path, 'derivatives'))
+
     # ensure the instance folder exists
     try:
         os.makedirs(app.instance_path)
@@ -29,6 +74,17 @@ def create_app():
     login.login_view = 'auth.login'
 
     from . import models
+    from . import realtime
+    realtime.init_app(app)
+
+    from . import tracing
+    tracing.init_app(app)
+
+    from . import admission
+    admission.init_app(app)
+
+    from . import caching
+    caching.init_app(app)
 
     from .auth import bp as auth_bp
     app.register_blueprint(auth_bp, url_prefix='/auth')
@@ -39,28 +95,36 @@ def create_app():
     from .api import bp as api_bp
     app.register_blueprint(api_bp, url_prefix='/api')
 
+    from .media import bp as media_bp
+    app.register_blueprint(media_bp, url_prefix='/media')
+
     from .admin import bp as admin_bp
     app.register_blueprint(admin_bp, url_prefix='/admin')
 
     # Register CLI commands
-    from .cli import clear_db_command
+    from .cli import (clear_db_command, compare_tiers_command, generate_derivatives_command,
+                      generate_fixtures_command, hash_images_command, import_images_command,
+                      import_video_command, migrate_uploads_command, recount_command, reprocess_command,
+                      watch_folder_command)
     app.cli.add_command(clear_db_command)
+    app.cli.add_command(generate_derivatives_command)
+    app.cli.add_command(migrate_uploads_command)
+    app.cli.add_command(recount_command)
+    app.cli.add_command(generate_fixtures_command)
+    app.cli.add_command(reprocess_command)
+    app.cli.add_command(import_images_command)
+    app.cli.add_command(watch_folder_command)
+    app.cli.add_command(compare_tiers_command)
+    app.cli.add_command(hash_images_command)
+    app.cli.add_command(import_video_command)
 
     @login.user_loader
     def load_user(id):
         return models.User.query.get(int(id))
 
     if not app.debug:
-        if not os.path.exists('logs'):
-            os.mkdir('logs')
-        file_handler = RotatingFileHandler('logs/microchasers.log', maxBytes=10240,
-                                       backupCount=10)
-        file_handler.setFormatter(logging.Formatter(
-            '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'))
-        file_handler.setLevel(logging.INFO)
-        app.logger.addHandler(file_handler)
-
-        app.logger.setLevel(logging.INFO)
+        from . import logging_config
+        logging_config.init_app(app)
         app.logger.info('MicroChasers startup')
 
     return app
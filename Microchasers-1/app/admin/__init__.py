@@ -1,3 +1,5 @@
 from flask import Blueprint
 
-bp = Blueprint('admin', __name__, url_prefix='/admin')
\ No newline at end of file
+bp = Blueprint('admin', __name__, url_prefix='/admin')
+
+from app.admin import routes
@@ -1,13 +1,13 @@
-from flask import Blueprint, render_template, flash, redirect, url_for, request, jsonify, current_app
+from flask import render_template, flash, redirect, url_for, request, jsonify, current_app
 from flask_login import login_required, current_user
-from app.models import User, Sample, Image, Detection
+from app.models import User, Sample, Image, Detection, Track
 from app.database import db
+from app.admin import bp
+from app.services import counters, storage
 from app.auth.forms import ADMIN_CREDENTIALS
 from functools import wraps
 import os
 
-bp = Blueprint('admin', __name__, url_prefix='/admin')
-
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -24,20 +24,22 @@ def admin_required(f):
 @login_required
 @admin_required
 def index():
-    stats = {
-        'users': User.query.count(),
-        'samples': Sample.query.count(),
-        'images': Image.query.count(),
-        'detections': Detection.query.count(),
-    }
-    
-    users = User.query.all()
+    stats = counters.snapshot()
+
+    page = request.args.get('page', 1, type=int)
+    users = User.query.order_by(User.id).paginate(page=page, per_page=current_app.config['ADMIN_USERS_PER_PAGE'],
+                                                  error_out=False)
+    # Sample counts of the listed users, in one grouped query
+    sample_counts = dict(db.session.query(Sample.user_id, db.func.count(Sample.id))
+                         .filter(Sample.user_id.in_([user.id for user in users.items]))
+                         .group_by(Sample.user_id))
     recent_samples = Sample.query.order_by(Sample.timestamp.desc()).limit(5).all()
     recent_images = Image.query.order_by(Image.timestamp.desc()).limit(5).all()
     
     return render_template('admin/dashboard.html',
                          stats=stats,
                          users=users,
+                         sample_counts=sample_counts,
                          recent_samples=recent_samples,
                          recent_images=recent_images,
                          admin_email=ADMIN_CREDENTIALS['email'])
@@ -52,23 +54,22 @@ def delete_user(id):
         return redirect(url_for('admin.index'))
     
     # Delete all associated data
+    removed = {'samples': 0, 'images': 0, 'detections': 0}
     for sample in user.samples:
         for image in sample.images:
-            # Delete image files
-            if image.filepath:
-                try:
-                    file_path = os.path.join(current_app.root_path, 'static', image.filepath)
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
-                except Exception as e:
-                    flash(f'Error deleting image file: {str(e)}', 'warning')
+            # Release image files and derivatives, they are removed once nothing references them
+            storage.release_image(image)
             
             # Delete database records
-            Detection.query.filter_by(image_id=image.id).delete()
+            Track.query.filter_by(image_id=image.id).delete()
+            removed['detections'] += Detection.query.filter_by(image_id=image.id).delete()
             db.session.delete(image)
+            removed['images'] += 1
         db.session.delete(sample)
+        removed['samples'] += 1
     
     db.session.delete(user)
+    counters.adjust(users=-1, **{name: -count for name, count in removed.items()})
     db.session.commit()
     flash(f'User {user.username} and all associated data have been deleted.', 'success')
     return redirect(url_for('admin.index'))
@@ -78,10 +79,15 @@ def delete_user(id):
 @admin_required
 def delete_sample(id):
     sample = Sample.query.get_or_404(id)
+    images = detections = 0
     for image in sample.images:
-        Detection.query.filter_by(image_id=image.id).delete()
+        storage.release_image(image)
+        Track.query.filter_by(image_id=image.id).delete()
+        detections += Detection.query.filter_by(image_id=image.id).delete()
         db.session.delete(image)
+        images += 1
     db.session.delete(sample)
+    counters.adjust(samples=-1, images=-images, detections=-detections)
     db.session.commit()
     flash(f'Sample and all associated data have been deleted.', 'success')
     return redirect(url_for('admin.index'))
@@ -93,11 +99,36 @@ def clear_all():
     # Don't delete admin user
     admin = User.query.filter_by(username=ADMIN_CREDENTIALS['username']).first()
     
+    # Every file goes, once the deletes below have committed
+    storage.release_all()
+    Track.query.delete()
     Detection.query.delete()
     Image.query.delete()
     Sample.query.delete()
     User.query.filter(User.id != admin.id).delete()
+    # The tables are (nearly) empty now, so counting them again is cheap
+    counters.recount()
     
     db.session.commit()
     flash('All data has been cleared except admin account.', 'success')
-    return redirect(url_for('admin.index'))
\ No newline at end of file
+    return redirect(url_for('admin.index'))
+
+@bp.route('/metrics')
+@login_required
+@admin_required
+def metrics():
+    """Request statistics of this process, as JSON or (?format=prometheus) Prometheus text."""
+    request_metrics = current_app.extensions['request_metrics']
+    admission = current_app.extensions['admission']
+    fragment_cache = current_app.extensions['fragment_cache']
+    if request.args.get('format') == 'prometheus':
+        return current_app.response_class(request_metrics.prometheus() + admission.prometheus()
+                                          + fragment_cache.prometheus(),
+                                          mimetype='text/plain; version=0.0.4')
+    return jsonify({
+        'pid': os.getpid(),
+        'since': request_metrics.started,
+        'endpoints': request_metrics.snapshot(),
+        'analysis': admission.snapshot(),
+        'fragment_cache': fragment_cache.snapshot(),
+    })
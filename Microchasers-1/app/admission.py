@@ -0,0 +1,226 @@
+import math
+import struct
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from flask import current_app
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+from app.services.tiff_stack import first_page_dimensions
+
+# Admission control for image analysis. Each upload's peak memory is
+# estimated from its pixel dimensions, read from the file header without
+# decoding it, and analyses only start while their estimates fit within
+# ANALYSIS_MEMORY_BUDGET together. Uploads that do not fit wait in a FIFO
+# queue of at most ANALYSIS_QUEUE_LIMIT entries for up to
+# ANALYSIS_QUEUE_TIMEOUT seconds; beyond that they are turned away with 503,
+# and users with ANALYSIS_USER_LIMIT uploads in flight with 429, both with a
+# Retry-After estimate. The budget is per web worker process.
+
+# Peak resident memory growth of one analysis (detection and derivatives)
+# per decoded pixel, measured on a 3000x2000 JPEG and rounded up
+BYTES_PER_PIXEL = {'fast': 8, 'standard': 12, 'precise': 14}
+# Assumed when the header cannot be parsed
+FALLBACK_PIXELS = 4000 * 3000
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _jpeg_dimensions(stream):
+    while True:
+        byte = stream.read(1)
+        while byte and byte != b'\xff':
+            byte = stream.read(1)
+        while byte == b'\xff':  # fill bytes
+            byte = stream.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            continue  # markers without a length
+        header = stream.read(2)
+        if len(header) < 2:
+            return None
+        length = struct.unpack('>H', header)[0]
+        if marker in _JPEG_SOF:
+            frame = stream.read(5)
+            if len(frame) < 5:
+                return None
+            height, width = struct.unpack('>xHH', frame)
+            return width, height
+        stream.seek(length - 2, 1)
+
+
+def image_dimensions(stream):
+    """
+    Reads the (width, height) of a PNG, JPEG or TIFF from its header, leaving
+    the stream position where it was. For a multi-page TIFF this is the first
+    page: pages are analysed one at a time, so one page is the peak.
+
+    Returns:
+        tuple: Width and height in pixels, or None if they cannot be read.
+    """
+    position = stream.tell()
+    try:
+        head = stream.read(24)
+        if head.startswith(_PNG_SIGNATURE) and head[12:16] == b'IHDR':
+            return struct.unpack('>II', head[16:24])
+        if head.startswith(b'\xff\xd8'):
+            stream.seek(position + 2)
+            return _jpeg_dimensions(stream)
+        if head[:2] in (b'II', b'MM'):
+            stream.seek(position)
+            return first_page_dimensions(stream)
+        return None
+    except (OSError, struct.error):
+        return None
+    finally:
+        stream.seek(position)
+
+
+def estimate_cost(dimensions, tier):
+    """Estimated peak memory in bytes of analysing an image of the given dimensions."""
+    pixels = dimensions[0] * dimensions[1] if dimensions else FALLBACK_PIXELS
+    return pixels * BYTES_PER_PIXEL.get(tier, BYTES_PER_PIXEL['precise'])
+
+
+class AdmissionController:
+    """
+    Grants analyses a share of a memory budget, first come first served.
+
+    A job larger than the whole budget is admitted once nothing else is
+    running, so big images are slow rather than impossible.
+    """
+
+    def __init__(self, budget, queue_limit, queue_timeout, user_limit=None):
+        self.budget = budget
+        self.queue_limit = queue_limit
+        self.queue_timeout = queue_timeout
+        self.user_limit = user_limit
+        self.in_use = 0
+        self.running = 0
+        self.admitted = 0
+        self.rejected = Counter()
+        self._queue = deque()
+        self._users = Counter()
+        self._job_seconds = None  # moving average
+        self._condition = threading.Condition()
+
+    def retry_after(self):
+        """Seconds until a rejected request is worth retrying, from recent job durations."""
+        per_job = self._job_seconds or 5.0
+        return max(1, min(60, math.ceil(per_job * (len(self._queue) + 1) / max(1, self.running))))
+
+    def _reject(self, reason, user):
+        self.rejected[reason] += 1
+        if user is not None:
+            self._users[user] -= 1
+            if not self._users[user]:
+                del self._users[user]
+        if reason == 'user_limit':
+            raise TooManyRequests('You have too many images being analysed, please retry shortly.',
+                                  retry_after=self.retry_after())
+        raise ServiceUnavailable('The server is busy analysing other images, please retry shortly.',
+                                 retry_after=self.retry_after())
+
+    def acquire(self, cost, user=None):
+        """
+        Waits until ``cost`` bytes of the budget are free and takes them.
+
+        Raises:
+            TooManyRequests: ``user`` already has user_limit jobs in flight.
+            ServiceUnavailable: The queue is full, or the wait timed out.
+        """
+        cost = min(cost, self.budget)
+        with self._condition:
+            if user is not None:
+                if self.user_limit is not None and self._users[user] >= self.user_limit:
+                    self._reject('user_limit', None)
+                self._users[user] += 1
+            if self._queue or self.in_use + cost > self.budget:
+                if len(self._queue) >= self.queue_limit:
+                    self._reject('queue_full', user)
+                ticket = object()
+                self._queue.append(ticket)
+                deadline = time.monotonic() + self.queue_timeout
+                while self._queue[0] is not ticket or self.in_use + cost > self.budget:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._queue.remove(ticket)
+                        self._condition.notify_all()
+                        self._reject('timeout', user)
+                    self._condition.wait(remaining)
+                self._queue.popleft()
+                # The next in line may fit as well
+                self._condition.notify_all()
+            self.in_use += cost
+            self.running += 1
+            self.admitted += 1
+        return cost
+
+    def release(self, cost, user=None, seconds=None):
+        with self._condition:
+            self.in_use -= cost
+            self.running -= 1
+            if user is not None:
+                self._users[user] -= 1
+                if not self._users[user]:
+                    del self._users[user]
+            if seconds is not None:
+                self._job_seconds = seconds if self._job_seconds is None else 0.8 * self._job_seconds + 0.2 * seconds
+            self._condition.notify_all()
+
+    @contextmanager
+    def admit(self, cost, user=None):
+        """Holds ``cost`` bytes of the budget for the duration of the block."""
+        granted = self.acquire(cost, user)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(granted, user, time.monotonic() - started)
+
+    def snapshot(self):
+        with self._condition:
+            return {
+                'budget_bytes': self.budget,
+                'in_use_bytes': self.in_use,
+                'running': self.running,
+                'queue_depth': len(self._queue),
+                'queue_limit': self.queue_limit,
+                'admitted': self.admitted,
+                'rejected': dict(self.rejected),
+                'job_seconds_avg': round(self._job_seconds, 3) if self._job_seconds is not None else None,
+            }
+
+    def prometheus(self):
+        """Renders the controller state in the Prometheus text exposition format."""
+        state = self.snapshot()
+        lines = []
+        for name, kind, help_text, value in (
+            ('microchasers_analysis_queue_depth', 'gauge', 'Uploads waiting for analysis memory.',
+             state['queue_depth']),
+            ('microchasers_analysis_running', 'gauge', 'Analyses holding analysis memory.', state['running']),
+            ('microchasers_analysis_memory_bytes', 'gauge', 'Estimated memory held by running analyses.',
+             state['in_use_bytes']),
+            ('microchasers_analysis_memory_budget_bytes', 'gauge', 'Analysis memory budget.', state['budget_bytes']),
+            ('microchasers_analysis_admitted_total', 'counter', 'Analyses admitted.', state['admitted']),
+        ):
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', f'{name} {value}']
+        lines += ['# HELP microchasers_analysis_rejected_total Uploads turned away, by reason.',
+                  '# TYPE microchasers_analysis_rejected_total counter']
+        for reason in ('queue_full', 'timeout', 'user_limit'):
+            lines.append(f'microchasers_analysis_rejected_total{{reason="{reason}"}} {state["rejected"].get(reason, 0)}')
+        return '\n'.join(lines) + '\n'
+
+
+def admit_upload(stream, tier, user=None):
+    """Admission for analysing an uploaded file, sized from its header."""
+    controller = current_app.extensions['admission']
+    return controller.admit(estimate_cost(image_dimensions(stream), tier), user)
+
+
+def init_app(app):
+    app.extensions['admission'] = AdmissionController(
+        app.config['ANALYSIS_MEMORY_BUDGET'], app.config['ANALYSIS_QUEUE_LIMIT'],
+        app.config['ANALYSIS_QUEUE_TIMEOUT'], app.config['ANALYSIS_USER_LIMIT'])
@@ -1,8 +1,12 @@
 from app.api import bp
-from app.models import Sample
-from flask import jsonify, Response, request
+from app.models import Sample, Image, Detection, SensorReading, Track, User
+from app.database import db
+from app import caching
+from app.services import palette
+from flask import current_app, jsonify, Response, request, stream_with_context
 from flask_login import current_user, login_required
 import json
+import os
 import csv
 import io
 
@@ -13,6 +17,12 @@ def export_sample_json(id):
     if sample.author != current_user:
         return jsonify({'error': 'unauthorized'}), 403
 
+    # The payload only changes with the sample's version stamp
+    key = ('export-json', sample.id, sample.version)
+    return caching.conditional(key, lambda: current_app.response_class(
+        caching.payload(key, lambda: _export_json(sample)), mimetype='application/json'))
+
+def _export_json(sample):
     images_data = []
     for image in sample.images:
         detections_data = []
@@ -21,7 +31,10 @@ def export_sample_json(id):
                 'id': detection.id,
                 'x_coordinate': detection.x_coordinate,
                 'y_coordinate': detection.y_coordinate,
-                'confidence': detection.confidence,
+                'size': detection.size,
+                'shape': detection.shape,
+                'color': detection.color,
+                'color_class': palette.color_name(detection.color_code),
             })
         images_data.append({
             'id': image.id,
@@ -48,7 +61,137 @@ def export_sample_json(id):
         'sensor_readings': readings_data,
     }
 
-    return jsonify(data)
+    return current_app.json.dumps(data)
+
+@bp.route('/sample/<int:id>/colors')
+@login_required
+def sample_colors(id):
+    sample = Sample.query.get_or_404(id)
+    if sample.author != current_user:
+        return jsonify({'error': 'unauthorized'}), 403
+
+    # Counted per palette class with a GROUP BY on the indexed code column
+    rows = (db.session.query(Detection.color_code, db.func.count(Detection.id))
+            .join(Image, Detection.image_id == Image.id)
+            .filter(Image.sample_id == sample.id)
+            .group_by(Detection.color_code).order_by(Detection.color_code))
+    colors = [{'code': code, 'name': palette.color_name(code), 'swatch': palette.color_swatch(code), 'count': count}
+              for code, count in rows]
+    return jsonify({'sample_id': sample.id, 'colors': colors})
+
+@bp.route('/sizes')
+@login_required
+def size_distribution():
+    """
+    Particle size percentiles and a logarithmic histogram over a selection
+    of images, merged from their size sketches without reading detections.
+
+    Query parameters: any number of ``sample`` and ``image`` ids to narrow
+    the selection (default: all images of the user), ``user`` for an admin
+    to query another user's images, ``percentiles`` as comma-separated
+    values from 0 to 100 (default 10,50,90) and ``bins_per_octave`` for the
+    histogram (default 1).
+    """
+    from app.services.size_sketch import BINS_PER_OCTAVE, merge_encoded
+
+    owner = current_user
+    username = request.args.get('user')
+    if username and username != current_user.username:
+        if not current_user.is_administrator:
+            return jsonify({'error': 'unauthorized'}), 403
+        owner = User.query.filter_by(username=username).first()
+        if owner is None:
+            return jsonify({'error': 'no such user'}), 404
+    try:
+        percentiles = [float(value) for value in request.args.get('percentiles', '10,50,90').split(',')]
+    except ValueError:
+        return jsonify({'error': 'percentiles must be numbers'}), 400
+    bins_per_octave = request.args.get('bins_per_octave', 1, type=int)
+    if not all(0 <= value <= 100 for value in percentiles) or bins_per_octave < 1 \
+            or BINS_PER_OCTAVE % bins_per_octave:
+        return jsonify({'error': f'percentiles must be within 0-100 and bins_per_octave divide {BINS_PER_OCTAVE}'}), 400
+
+    query = (db.session.query(Image.size_sketch).join(Sample, Image.sample_id == Sample.id)
+             .filter(Sample.user_id == owner.id))
+    sample_ids = request.args.getlist('sample', type=int)
+    if sample_ids:
+        query = query.filter(Image.sample_id.in_(sample_ids))
+    image_ids = request.args.getlist('image', type=int)
+    if image_ids:
+        query = query.filter(Image.id.in_(image_ids))
+    blobs = [blob for (blob,) in query]
+    sketch = merge_encoded(blobs)
+
+    return jsonify({
+        'images': sum(1 for blob in blobs if blob),
+        'images_without_sketch': sum(1 for blob in blobs if not blob),
+        'count': sketch.count,
+        'mean': sketch.mean,
+        'min': sketch.min,
+        'max': sketch.max,
+        'percentiles': {f'p{value:g}': sketch.quantile(value / 100) for value in percentiles},
+        'bins_per_octave': bins_per_octave,
+        'histogram': [{'lower': lower, 'upper': upper, 'count': count}
+                      for lower, upper, count in sketch.histogram(bins_per_octave)],
+    })
+
+@bp.route('/image/<int:id>/geometry')
+@login_required
+def image_geometry(id):
+    image = Image.query.get_or_404(id)
+    if image.sample.author != current_user:
+        return jsonify({'error': 'unauthorized'}), 403
+
+    from app.services.geometry import decode_contours, shape_metrics
+
+    # Shape metrics are measured from the stored polygons, the image itself is never decoded
+    detection_ids = [d for (d,) in db.session.query(Detection.id)
+                     .filter(Detection.image_id == image.id).order_by(Detection.id)]
+    points, offsets = decode_contours(image.contours)
+    metrics = shape_metrics(points, offsets)
+    if len(offsets) - 1 != len(detection_ids):
+        return jsonify({'error': 'no contour geometry stored for this image'}), 404
+
+    detections_data = []
+    for i, detection_id in enumerate(detection_ids):
+        row = {name: round(float(values[i]), 3) for name, values in metrics.items()}
+        row['id'] = detection_id
+        row['vertices'] = int(offsets[i + 1] - offsets[i])
+        detections_data.append(row)
+
+    return jsonify({'image_id': image.id, 'detections': detections_data})
+
+@bp.route('/image/<int:id>/tracks')
+@login_required
+def image_tracks(id):
+    image = Image.query.get_or_404(id)
+    if image.sample.author != current_user:
+        return jsonify({'error': 'unauthorized'}), 403
+    if image.frame_count is None:
+        return jsonify({'error': 'this image is not a video'}), 404
+
+    from app.services.tracking import decode_points
+
+    # ?points=1 adds every observation; otherwise only the summary of each track is sent
+    with_points = request.args.get('points', type=int) == 1
+    query = Track.query.filter(Track.image_id == image.id).order_by(Track.detection_id)
+    if with_points:
+        query = query.options(db.undefer(Track.points))
+    tracks_data = []
+    for track in query:
+        row = {
+            'detection_id': track.detection_id,
+            'first_frame': track.first_frame,
+            'last_frame': track.last_frame,
+            'frames': track.frame_count,
+            'path_length': round(track.path_length, 2),
+        }
+        if with_points:
+            row['points'] = [[int(p['frame']), round(float(p['x']), 1), round(float(p['y']), 1),
+                              round(float(p['size']), 1)] for p in decode_points(track.points)]
+        tracks_data.append(row)
+
+    return jsonify({'image_id': image.id, 'frame_count': image.frame_count, 'tracks': tracks_data})
 
 @bp.route('/sample/<int:id>/export/csv')
 @login_required
@@ -61,7 +204,7 @@ def export_sample_csv(id):
     output = io.StringIO()
     writer = csv.writer(output)
 
-    writer.writerow(['image_id', 'detection_id', 'x_coordinate', 'y_coordinate', 'confidence'])
+    writer.writerow(['image_id', 'detection_id', 'x_coordinate', 'y_coordinate', 'size', 'shape', 'color'])
 
     for image in sample.images:
         for detection in image.detections:
@@ -70,7 +213,9 @@ def export_sample_csv(id):
                 detection.id,
                 detection.x_coordinate,
                 detection.y_coordinate,
-                detection.confidence
+                detection.size,
+                detection.shape,
+                detection.color
             ])
 
     output.seek(0)
@@ -80,3 +225,66 @@ def export_sample_csv(id):
         mimetype="text/csv",
         headers={"Content-Disposition": f"attachment;filename=sample_{sample.id}_detections.csv"}
     )
+
+def _csv_rows(header, rows):
+    """Encodes CSV rows a batch at a time, for streaming."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % 1000 == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+@bp.route('/sample/<int:id>/export/zip')
+@login_required
+def export_sample_zip(id):
+    sample = Sample.query.get_or_404(id)
+    if sample.author != current_user:
+        return jsonify({'error': 'unauthorized'}), 403
+
+    from app.media.routes import overlay
+    from app.services import storage
+    from app.services.zipstream import stream_zip
+
+    processed_ext = '.jpg' if current_app.config['ANNOTATION_FORMAT'] == 'jpeg' \
+        else '.' + current_app.config['ANNOTATION_FORMAT']
+    sample_id = sample.id
+
+    def members():
+        # Everything is read only as the archive reaches it, rows in batches
+        images = Image.query.filter_by(sample_id=sample_id).order_by(Image.id).all()
+        for image in images:
+            if image.original_filepath:
+                ext = os.path.splitext(image.original_filepath)[1].lower()
+                source = storage.resolve(image.original_filepath)
+                yield f'originals/{image.id}{ext}', source if os.path.exists(source) else None
+                yield f'processed/{image.id}{processed_ext}', overlay(image, 'full')
+            else:
+                # Stored before annotation became lazy, with the overlay burnt in
+                source = storage.resolve(image.filepath)
+                ext = os.path.splitext(image.filepath)[1].lower()
+                yield f'processed/{image.id}{ext}', source if os.path.exists(source) else None
+            db.session.expunge(image)
+
+        detections = (db.session.query(Detection.image_id, Detection.id, Detection.x_coordinate,
+                                       Detection.y_coordinate, Detection.size, Detection.shape, Detection.color)
+                      .join(Image, Detection.image_id == Image.id).filter(Image.sample_id == sample_id)
+                      .order_by(Detection.image_id, Detection.id).yield_per(1000))
+        yield 'detections.csv', _csv_rows(
+            ['image_id', 'detection_id', 'x_coordinate', 'y_coordinate', 'size', 'shape', 'color'], detections)
+
+        readings = (db.session.query(SensorReading.id, SensorReading.temperature, SensorReading.ph,
+                                     SensorReading.timestamp)
+                    .filter(SensorReading.sample_id == sample_id).order_by(SensorReading.timestamp).yield_per(1000))
+        yield 'readings.csv', _csv_rows(['reading_id', 'temperature', 'ph', 'timestamp'],
+                                        ((r.id, r.temperature, r.ph, r.timestamp.isoformat()) for r in readings))
+
+    return Response(
+        stream_with_context(stream_zip(members())),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment;filename=sample_{sample.id}.zip'}
+    )
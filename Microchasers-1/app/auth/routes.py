@@ -5,6 +5,7 @@ from app.database import db
 from app.auth import bp
 from app.auth.forms import LoginForm, RegistrationForm
 from app.models import User
+from app.services import counters
 
 @bp.route('/login', methods=['GET', 'POST'])
 def login():
@@ -37,6 +38,7 @@ def register():
         user = User(username=form.username.data, email=form.email.data)
         user.set_password(form.password.data)
         db.session.add(user)
+        counters.adjust(users=1)
         db.session.commit()
         flash('Congratulations, you are now a registered user!')
         return redirect(url_for('auth.login'))
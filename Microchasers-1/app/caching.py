@@ -0,0 +1,277 @@
+import hashlib
+import os
+import threading
+import uuid
+from collections import Counter, OrderedDict
+from flask import current_app, request, session
+from markupsafe import Markup
+from sqlalchemy import event, select, update
+from .database import db
+from .models import Sample, Image, Detection, SensorReading
+
+# Caching of rendered fragments and export payloads. Samples and images
+# carry a version stamp that is bumped whenever they, or the images,
+# detections and sensor readings under them, are written, and every cache
+# key includes the stamps it depends on: a write never has to find and
+# invalidate entries, it simply makes them unreachable. Stamps are bumped
+# by a flush listener for ORM writes; code writing in bulk SQL calls
+# bump_versions itself.
+#
+# Entries live in a per-process LRU bounded by FRAGMENT_CACHE_BYTES and,
+# with FRAGMENT_CACHE_DIR set, in a directory shared by every worker and
+# bounded by FRAGMENT_CACHE_DISK_BYTES (oldest files pruned first). The
+# same keys give ETags, so a client holding the current version gets 304
+# Not Modified without the page being rendered at all.
+
+# Disk usage is checked after this many writes
+_PRUNE_EVERY = 64
+
+
+class FragmentCache:
+    def __init__(self, max_bytes, directory=None, disk_max_bytes=None, namespace=''):
+        self.max_bytes = max_bytes
+        # Larger values are not worth the memory, they go to disk only
+        self.max_entry_bytes = max_bytes // 8
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+        self.namespace = namespace
+        self.bytes = 0
+        self.stats = Counter()
+        self._entries = OrderedDict()
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def digest(self, key):
+        return hashlib.sha256(repr((self.namespace, key)).encode()).hexdigest()
+
+    def etag(self, key):
+        return self.digest(('etag', key))[:32]
+
+    def _path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def get(self, key):
+        digest = self.digest(key)
+        with self._lock:
+            value = self._entries.get(digest)
+            if value is not None:
+                self._entries.move_to_end(digest)
+                self.stats['memory_hits'] += 1
+                return value
+        if self.directory:
+            path = self._path(digest)
+            try:
+                with open(path, 'rb') as f:
+                    value = f.read()
+                os.utime(path)  # pruning goes by last use
+            except OSError:
+                value = None
+            if value is not None:
+                self.stats['disk_hits'] += 1
+                self._remember(digest, value)
+                return value
+        self.stats['misses'] += 1
+        return None
+
+    def _remember(self, digest, value):
+        if len(value) > self.max_entry_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(digest, None)
+            if previous is not None:
+                self.bytes -= len(previous)
+            self._entries[digest] = value
+            self.bytes += len(value)
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= len(evicted)
+                self.stats['evictions'] += 1
+
+    def set(self, key, value):
+        digest = self.digest(key)
+        self._remember(digest, value)
+        if not self.directory:
+            return
+        path = self._path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written to the side and renamed, so readers never see half a file
+        temp = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(temp, 'wb') as f:
+            f.write(value)
+        os.replace(temp, path)
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % _PRUNE_EVERY == 0
+        if prune and self.disk_max_bytes:
+            self.prune()
+
+    def prune(self):
+        """Deletes the least recently used files until the directory fits in disk_max_bytes."""
+        files = []
+        for dirpath, _, filenames in os.walk(self.directory):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def fetch(self, key, render):
+        """The cached bytes for ``key``, or ``render()``'s result, which is cached."""
+        value = self.get(key)
+        if value is None:
+            value = render()
+            if isinstance(value, str):
+                value = value.encode()
+            self.set(key, value)
+        return value
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'directory': self.directory,
+                **{name: self.stats[name] for name in ('memory_hits', 'disk_hits', 'misses', 'evictions',
+                                                       'not_modified')},
+            }
+
+    def prometheus(self):
+        """Renders the cache state in the Prometheus text exposition format."""
+        state = self.snapshot()
+        lines = []
+        for name, kind, help_text, value in (
+            ('microchasers_fragment_cache_entries', 'gauge', 'Fragments held in memory.', state['entries']),
+            ('microchasers_fragment_cache_bytes', 'gauge', 'Bytes of fragments held in memory.', state['bytes']),
+            ('microchasers_fragment_cache_misses_total', 'counter', 'Fragments rendered.', state['misses']),
+            ('microchasers_fragment_cache_evictions_total', 'counter', 'Fragments evicted from memory.',
+             state['evictions']),
+            ('microchasers_not_modified_total', 'counter', 'Responses answered with 304 Not Modified.',
+             state['not_modified']),
+        ):
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', f'{name} {value}']
+        lines += ['# HELP microchasers_fragment_cache_hits_total Fragments served from the cache, by tier.',
+                  '# TYPE microchasers_fragment_cache_hits_total counter',
+                  f'microchasers_fragment_cache_hits_total{{tier="memory"}} {state["memory_hits"]}',
+                  f'microchasers_fragment_cache_hits_total{{tier="disk"}} {state["disk_hits"]}']
+        return '\n'.join(lines) + '\n'
+
+
+def fragment(key, render):
+    """Rendered HTML for ``key``, from the cache or ``render()``, ready to insert into a template."""
+    return Markup(current_app.extensions['fragment_cache'].fetch(key, render).decode())
+
+
+def payload(key, render):
+    """Bytes for ``key``, from the cache or ``render()``."""
+    return current_app.extensions['fragment_cache'].fetch(key, render)
+
+
+def conditional(key, respond):
+    """
+    Answers a GET with 304 Not Modified if the client already holds the
+    response for ``key``, otherwise with ``respond()`` tagged with its ETag.
+
+    ``key`` must include the version stamps and the user the response
+    depends on. Pages with flashed messages pending are never tagged, as
+    they show more than the key describes.
+    """
+    if session.get('_flashes'):
+        return respond()
+    cache = current_app.extensions['fragment_cache']
+    etag = cache.etag(key)
+    if request.if_none_match.contains(etag):
+        cache.stats['not_modified'] += 1
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.make_response(respond())
+    response.set_etag(etag)
+    # Cached by the browser, but revalidated on every use
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def bump_versions(image_ids):
+    """Bumps the stamps of images written with bulk SQL, and of their samples."""
+    if not image_ids:
+        return
+    db.session.execute(update(Sample).where(Sample.id.in_(
+        select(Image.sample_id).where(Image.id.in_(image_ids)).scalar_subquery()))
+        .values(version=Sample.version + 1).execution_options(synchronize_session=False))
+    db.session.execute(update(Image).where(Image.id.in_(image_ids)).values(version=Image.version + 1)
+                       .execution_options(synchronize_session=False))
+
+
+@event.listens_for(db.session, 'before_flush')
+def _bump_written(session, flush_context, instances):
+    samples = session.info.setdefault('bump_samples', set())
+    images = session.info.setdefault('bump_images', set())
+    for obj in session.dirty:
+        if not session.is_modified(obj, include_collections=False):
+            continue
+        if isinstance(obj, Image):
+            obj.version = Image.version + 1
+            samples.add(obj.sample_id)
+        elif isinstance(obj, Sample):
+            obj.version = Sample.version + 1
+        elif isinstance(obj, SensorReading):
+            samples.add(obj.sample_id)
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, Detection):
+            image = obj.image
+            if image is None:
+                # Only the key was set, the image is bumped by id
+                images.add(obj.image_id)
+            elif image not in session.new:
+                image.version = Image.version + 1
+                samples.add(image.sample_id)
+        elif isinstance(obj, Image):
+            samples.add(obj.sample_id if obj.sample_id is not None else getattr(obj.sample, 'id', None))
+        elif isinstance(obj, SensorReading):
+            # The sample page and exports list the readings too
+            samples.add(obj.sample_id if obj.sample_id is not None else getattr(obj.sample, 'id', None))
+
+
+@event.listens_for(db.session, 'after_flush')
+def _bump_samples(session, flush_context):
+    ids = session.info.pop('bump_samples', set()) - {None}
+    image_ids = session.info.pop('bump_images', set()) - {None}
+    if image_ids:
+        images = Image.__table__
+        session.connection().execute(update(images).where(images.c.id.in_(image_ids))
+                                     .values(version=images.c.version + 1))
+        ids |= set(session.connection().execute(select(images.c.sample_id)
+                                                 .where(images.c.id.in_(image_ids))).scalars())
+    if ids:
+        session.connection().execute(update(Sample.__table__).where(Sample.__table__.c.id.in_(ids))
+                                     .values(version=Sample.__table__.c.version + 1))
+
+
+def _code_stamp(app):
+    # Entries and ETags of an older deployment must not be served by a newer
+    # one, so the namespace follows the application's code and templates
+    digest = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(app.root_path):
+        dirnames[:] = sorted(name for name in dirnames if name not in ('__pycache__', 'static'))
+        for name in sorted(filenames):
+            if name.endswith(('.py', '.html')):
+                stat = os.stat(os.path.join(dirpath, name))
+                digest.update(f'{dirpath}/{name}:{stat.st_size}:{stat.st_mtime_ns}'.encode())
+    return digest.hexdigest()[:16]
+
+
+def init_app(app):
+    app.extensions['fragment_cache'] = FragmentCache(
+        app.config['FRAGMENT_CACHE_BYTES'], app.config['FRAGMENT_CACHE_DIR'],
+        app.config['FRAGMENT_CACHE_DISK_BYTES'], namespace=_code_stamp(app))
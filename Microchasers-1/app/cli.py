@@ -1,15 +1,339 @@
+from flask import current_app
 from flask.cli import with_appcontext
 import click
+import os
+import time
 from app import db
-from app.models import User, Sample, Image, Detection
+from app.models import DETECTOR_TIERS, User, Sample, Image, Detection, Track
+from app.services.derivatives import generate_derivatives
+from app.services import counters, storage
 
 @click.command('clear-db')
 @with_appcontext
 def clear_db_command():
     """Clear all data from database."""
+    # Every file goes, once the deletes below have committed
+    storage.release_all()
+    db.session.query(Track).delete()
     db.session.query(Detection).delete()
     db.session.query(Image).delete()
     db.session.query(Sample).delete()
     db.session.query(User).delete()
+    counters.recount()
     db.session.commit()
-    click.echo('Cleared all database data.')
\ No newline at end of file
+    click.echo('Cleared all database data.')
+
+@click.command('recount')
+@with_appcontext
+def recount_command():
+    """Rebuild the dashboard counters and the per-sample counts from the tables."""
+    values = counters.recount()
+    counters.recount_samples()
+    db.session.commit()
+    for name, value in values.items():
+        click.echo(f'{name}: {value}')
+
+@click.command('generate-derivatives')
+@with_appcontext
+def generate_derivatives_command():
+    """Generate thumbnails and previews for images that have none."""
+    root = current_app.config['DERIVATIVES_FOLDER']
+    generated = 0
+    for image in Image.query.filter(Image.content_hash.is_(None)):
+        source = storage.resolve(image.filepath)
+        image.content_hash = generate_derivatives(source, root)
+        if image.content_hash:
+            generated += 1
+    db.session.commit()
+    click.echo(f'Generated derivatives for {generated} image(s).')
+
+@click.command('hash-images')
+@with_appcontext
+def hash_images_command():
+    """Compute perceptual hashes for images that have none, for near-duplicate lookup."""
+    from app.services.perceptual import band_columns, phash as perceptual_hash
+
+    hashed = 0
+    for image in Image.query.filter(Image.phash.is_(None)):
+        source = storage.analysis_source(image.original_filepath, image.filepath)
+        phash = perceptual_hash(storage.resolve(source)) if source else None
+        if phash is not None:
+            for column, value in band_columns(phash).items():
+                setattr(image, column, value)
+            hashed += 1
+    db.session.commit()
+    click.echo(f'Hashed {hashed} image(s).')
+
+@click.command('migrate-uploads')
+@click.option('--keep', is_flag=True, help='Leave the flat files in place after migrating.')
+@with_appcontext
+def migrate_uploads_command(keep):
+    """Move flat static/uploads files into the content-addressed store."""
+    flat_prefix = current_app.config['UPLOAD_URL_PREFIX'] + '/'
+    migrated = set()
+    moved = 0
+    for image in Image.query:
+        # Images stored before the original was kept only reference the
+        # annotated copy; recover the original from its naming convention.
+        if image.original_filepath is None and image.filepath.count('/') == 1:
+            original = storage.analysis_source(None, image.filepath)
+            if original not in (None, image.filepath):
+                image.original_filepath = original
+
+        for attr in ('original_filepath', 'filepath'):
+            old = getattr(image, attr)
+            # Sharded paths contain directories below the upload prefix.
+            if not old or not old.startswith(flat_prefix) or old.count('/') != 1:
+                continue
+            source = storage.resolve(old)
+            if not os.path.exists(source):
+                continue
+            setattr(image, attr, storage.store_file(source, move=False))
+            migrated.add(source)
+            moved += 1
+    db.session.commit()
+
+    if not keep:
+        for source in migrated:
+            os.remove(source)
+    click.echo(f'Migrated {moved} file reference(s) from {len(migrated)} flat file(s).')
+
+@click.command('generate-fixtures')
+@click.option('--users', default=20, show_default=True)
+@click.option('--samples', default=5, show_default=True, help='Samples per user.')
+@click.option('--images', default=10, show_default=True, help='Images per sample.')
+@click.option('--detections', default=200, show_default=True, help='Detections per image.')
+@click.option('--readings', default=20, show_default=True, help='Sensor readings per sample.')
+@click.option('--seed', default=0, show_default=True)
+@with_appcontext
+def generate_fixtures_command(users, samples, images, detections, readings, seed):
+    """Bulk-generate synthetic users, samples, images, detections and readings."""
+    # numpy is only needed here, keep it out of app startup
+    from app.services import fixtures
+
+    def progress(done, total):
+        click.echo(f'\r{done:,} / {total:,} detections', nl=False)
+
+    written = fixtures.generate(users, samples, images, detections, readings, seed=seed, progress=progress)
+    click.echo()
+    seconds = written.pop('seconds')
+    rows = sum(written.values())
+    click.echo(', '.join(f'{count:,} {name}' for name, count in written.items()))
+    click.echo(f'{rows:,} rows in {seconds:.1f} s ({rows / seconds:,.0f} rows/s). '
+               f'Fixture users log in as fixture_<id> / {fixtures.FIXTURE_PASSWORD}.')
+
+@click.command('reprocess')
+@click.option('--sample', 'sample_id', type=int, help='Only images of this sample.')
+@click.option('--user', 'username', help='Only images of this user.')
+@click.option('--since', type=click.DateTime(), help='Only images uploaded on or after this date.')
+@click.option('--until', type=click.DateTime(), help='Only images uploaded before this date.')
+@click.option('--chunk', 'chunk_size', default=100, show_default=True, help='Images per transaction.')
+@click.option('--processes', type=int, default=os.cpu_count(), show_default=True)
+@click.option('--tier', type=click.Choice(DETECTOR_TIERS),
+              help='Detector tier to use, defaults to the one each image was analysed with.')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint of an interrupted run.')
+@with_appcontext
+def reprocess_command(sample_id, username, since, until, chunk_size, processes, tier, restart):
+    """Re-run detection on stored images and replace their detections."""
+    from app.services import reprocessing
+    from app.services.detection_pool import ProcessPool
+
+    filters = {'sample': sample_id, 'user': username, 'tier': tier,
+               'since': since.isoformat() if since else None, 'until': until.isoformat() if until else None}
+    query = reprocessing.image_query(sample_id, username, since, until)
+    checkpoint_path = os.path.join(current_app.instance_path, 'reprocess-checkpoint.json')
+    started = time.perf_counter()
+
+    def progress(totals):
+        elapsed = time.perf_counter() - started
+        done = totals['processed'] + totals['failed']
+        click.echo(f'{done} image(s), {done / elapsed:.1f}/s, {totals["failed"]} unreadable')
+
+    executor = ProcessPool(processes)
+    try:
+        totals = reprocessing.reprocess(executor, current_app.config['DERIVATIVES_FOLDER'], query,
+                                        checkpoint_path, filters, chunk_size=chunk_size,
+                                        resume=not restart, progress=progress, tier=tier)
+    finally:
+        executor.shutdown(cancel_futures=True)
+    if totals['resumed_after']:
+        click.echo(f'Resumed after image {totals["resumed_after"]}.')
+    click.echo(f'Reprocessed {totals["processed"]} image(s), {totals["failed"]} could not be read.')
+
+@click.command('import-images')
+@click.argument('root', type=click.Path(exists=True, file_okay=False))
+@click.option('--user', 'username', required=True, help='Owner of the imported samples.')
+@click.option('--sample', 'sample_name', help='Import everything into this sample instead of one per directory.')
+@click.option('--batch', 'batch_size', default=50, show_default=True, help='Images per transaction.')
+@click.option('--processes', type=int, default=os.cpu_count(), show_default=True)
+@with_appcontext
+def import_images_command(root, username, sample_name, batch_size, processes):
+    """Import a directory tree of images, one sample per directory."""
+    from app.services.importer import Importer, plan_import
+    from app.services.detection_pool import ProcessPool
+
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.BadParameter(f'No user named {username}', param_hint='--user')
+
+    def progress(totals, elapsed):
+        click.echo(f'{totals["imported"]} imported, {totals["skipped"]} skipped, '
+                   f'{totals["imported"] / elapsed:.1f} images/s')
+
+    executor = ProcessPool(processes)
+    try:
+        importer = Importer(executor, user, current_app.config['DERIVATIVES_FOLDER'], batch_size=batch_size,
+                            in_flight=processes * 2, progress=progress)
+        for name, path in plan_import(root, sample_name):
+            importer.add(name, path)
+        totals, elapsed = importer.finish()
+    finally:
+        executor.shutdown(cancel_futures=True)
+    click.echo(f'Imported {totals["imported"]} image(s) with {totals["detections"]} detection(s) in '
+               f'{elapsed:.1f} s: {totals["imported"] / elapsed:.1f} images/s, '
+               f'{totals["bytes"] / elapsed / 1e6:.1f} MB/s. '
+               f'{totals["skipped"]} already imported, {totals["failed"]} unreadable.')
+
+@click.command('watch-folder')
+@click.argument('folder', type=click.Path(exists=True, file_okay=False))
+@click.option('--sample', 'sample_id', type=int, required=True, help='Sample the images are added to.')
+@click.option('--processes', type=int, default=2, show_default=True)
+@click.option('--in-flight', type=int, default=4, show_default=True,
+              help='Images analysed or waiting for analysis at any time.')
+@click.option('--settle', type=float, default=2.0, show_default=True,
+              help='Seconds a file must stay unchanged before it is read.')
+@click.option('--poll-interval', type=float, default=2.0, show_default=True,
+              help='Rescan interval when inotify is not available.')
+@click.option('--poll', 'force_poll', is_flag=True, help='Rescan the folder instead of using inotify.')
+@click.option('--state', 'state_path', type=click.Path(dir_okay=False),
+              help='State file, defaults to .microchasers-watch.json in the folder.')
+@with_appcontext
+def watch_folder_command(folder, sample_id, processes, in_flight, settle, poll_interval, force_poll, state_path):
+    """Import images written into FOLDER as they arrive, until interrupted."""
+    import signal
+    from app.realtime import notify_image
+    from app.services.detection_pool import ProcessPool
+    from app.services.importer import Importer
+    from app.services.watcher import FolderWatcher, WatchState
+
+    sample = db.session.get(Sample, sample_id)
+    if sample is None:
+        raise click.BadParameter(f'No sample with id {sample_id}', param_hint='--sample')
+
+    state = WatchState(state_path or os.path.join(folder, '.microchasers-watch.json'), sample_id)
+    watcher = FolderWatcher(folder, state, settle=settle, poll_interval=poll_interval, use_inotify=not force_poll)
+
+    def on_commit(committed):
+        for image, path in committed:
+            notify_image(image)
+            click.echo(f'{os.path.basename(path)}: image {image.id}, {image.status}')
+
+    def on_done(path):
+        # Only once every page of a stack is stored, so a restart picks up the rest
+        watcher.done(os.path.basename(path))
+
+    stopping = []
+    def stop(signum, frame):
+        stopping.append(signum)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    executor = ProcessPool(processes)
+    try:
+        importer = Importer(executor, sample.author, current_app.config['DERIVATIVES_FOLDER'], batch_size=1,
+                            in_flight=in_flight, on_commit=on_commit, on_done=on_done)
+        importer.attach(sample)
+        click.echo(f'Watching {folder} for sample {sample.name} '
+                   f'({"inotify" if watcher.inotify else "polling"}), Ctrl+C to stop.')
+        watcher.run(importer, sample.name, lambda: bool(stopping))
+    finally:
+        executor.shutdown(cancel_futures=True)
+        watcher.close()
+    click.echo(f'Stopped after importing {importer.totals["imported"]} image(s).')
+
+@click.command('import-video')
+@click.argument('source', type=click.Path(exists=True))
+@click.option('--sample', 'sample_id', type=int, required=True, help='Sample the video is added to.')
+@click.option('--processes', type=int, default=os.cpu_count(), show_default=True)
+@click.option('--step', default=1, show_default=True, help='Analyse every n-th frame only.')
+@click.option('--max-distance', default=20.0, show_default=True,
+              help='Pixels a particle may move between frames and keep its track.')
+@click.option('--max-gap', default=2, show_default=True,
+              help='Analysed frames a particle may be missed and keep its track.')
+@click.option('--min-frames', default=2, show_default=True, help='Drop particles seen in fewer frames as noise.')
+@click.option('--tier', type=click.Choice(DETECTOR_TIERS), help="Detector tier, defaults to the sample's.")
+@with_appcontext
+def import_video_command(source, sample_id, processes, step, max_distance, max_gap, min_frames, tier):
+    """Import a video, or a directory of frames, tracking each particle across frames."""
+    from app.realtime import notify_image
+    from app.services.detection_pool import create_executor
+    from app.services.video import VideoIngest
+
+    sample = db.session.get(Sample, sample_id)
+    if sample is None:
+        raise click.BadParameter(f'No sample with id {sample_id}', param_hint='--sample')
+
+    def progress(totals, elapsed):
+        click.echo(f'{totals["frames"]} frames, {totals["frames"] / elapsed:.1f} frames/s, '
+                   f'{totals["particles"]} particle(s) stored')
+
+    executor = create_executor(processes)
+    ingest = VideoIngest(executor, sample, current_app.config['DERIVATIVES_FOLDER'], tier=tier,
+                         in_flight=processes * 2, step=step, max_distance=max_distance, max_gap=max_gap,
+                         min_frames=min_frames, progress=progress)
+    try:
+        totals = ingest.run(source)
+    except Exception as exc:
+        if ingest.image is not None:
+            notify_image(ingest.image)  # now 'failed'
+        raise click.ClickException(f'Import of {source} failed: {exc}')
+    finally:
+        executor.shutdown(cancel_futures=True)
+    if totals is None:
+        click.echo('This video is already an image of the sample.')
+        return
+    if totals['image'] is None:
+        raise click.ClickException(f'No frames could be decoded from {source}')
+    notify_image(totals['image'])
+    click.echo(f'Image {totals["image"].id}: {totals["frames"]} frames in {totals["seconds"]:.1f} s '
+               f'({totals["frames"] / totals["seconds"]:.1f} frames/s), {totals["observations"]} detection(s) '
+               f'linked into {totals["particles"]} particle(s), {totals["dropped"]} dropped as noise.')
+
+@click.command('compare-tiers')
+@click.argument('paths', nargs=-1, type=click.Path(exists=True))
+@click.option('--limit', default=20, show_default=True,
+              help='Without PATHS, compare on the originals of this many recent images.')
+@click.option('--repeat', default=3, show_default=True, help='Timed runs per image and tier.')
+@click.option('--tolerance', default=5.0, show_default=True,
+              help='Pixels between centroids for two detections to count as the same particle.')
+@with_appcontext
+def compare_tiers_command(paths, limit, repeat, tolerance):
+    """Report the speed and agreement of each detector tier against standard."""
+    from app.services.image_processing import TIER_SETTINGS
+    from app.services.importer import IMAGE_EXTENSIONS
+    from app.services.tier_comparison import compare_tiers
+
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, name) for name in os.listdir(path)
+                            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS)
+        else:
+            files.append(path)
+    if not paths:
+        recent = (Image.query.filter(Image.status == 'processed')
+                  .order_by(Image.id.desc()).limit(limit))
+        sources = [storage.analysis_source(image.original_filepath, image.filepath) for image in recent]
+        files = [storage.resolve(source) for source in sources if source]
+
+    report = compare_tiers(files, repeat=repeat, tolerance=tolerance)
+    click.echo(f'{report["images"]} reference image(s), agreement measured against standard\n')
+    click.echo(f"{'tier':>9} {'seconds':>8} {'speedup':>8} {'found':>7} {'precision':>9} {'recall':>7} "
+               f"{'F1':>6} {'shape':>6} {'size err':>8}")
+    for tier in TIER_SETTINGS:
+        r = report[tier]
+        click.echo(f"{tier:>9} {r['seconds']:8.3f} {r['speedup']:7.2f}x {r['detections']:7d} "
+                   f"{r['precision']:9.3f} {r['recall']:7.3f} {r['f1']:6.3f} {r['shape_agreement']:6.3f} "
+                   f"{r['size_error']:8.3f}")
+        if r['failed']:
+            click.echo(f"{tier:>9} could not read {r['failed']} image(s), left out of its figures")
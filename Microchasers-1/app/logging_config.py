@@ -0,0 +1,179 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import time
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from flask import g, has_request_context, request
+from flask.logging import default_handler
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
+
+# Attributes every LogRecord has; anything else was passed through ``extra``
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'request_id'}
+
+# Listeners started and not yet stopped in this process, and whether the
+# fork and exit hooks serving them are installed
+_running = set()
+_hooks_installed = False
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, including ``extra`` fields."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RequestIdFilter(logging.Filter):
+    """Tags records with the id of the request they were logged from."""
+
+    def filter(self, record):
+        record.request_id = g.get('request_id') if has_request_context() else None
+        return True
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Enqueues records as they are. The stock QueueHandler formats the message
+    on the calling thread; here all formatting is left to the listener.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class LogListener:
+    """
+    Drains a queue handler's queue into the given handlers on one thread.
+
+    A thread doesn't survive fork (e.g. gunicorn workers forked from a
+    preloaded master), so the child of a running listener restarts it on a
+    fresh queue of its own.
+    """
+
+    def __init__(self, queue_handler, *handlers):
+        self.queue_handler = queue_handler
+        self.handlers = handlers
+        self.running = False
+        self._listener = None
+
+    def start(self):
+        self._listener = QueueListener(self.queue_handler.queue, *self.handlers, respect_handler_level=True)
+        self._listener.start()
+        self.running = True
+        _running.add(self)
+
+    def stop(self):
+        """Flushes and stops the listener; safe to call more than once."""
+        if self.running:
+            self.running = False
+            _running.discard(self)
+            self._listener.stop()
+
+    def restart_in_child(self):
+        self.queue_handler.queue = queue.SimpleQueue()
+        self.start()
+
+
+def _restart_in_child():
+    for listener in list(_running):
+        listener.restart_in_child()
+
+
+def _stop_all():
+    for listener in list(_running):
+        listener.stop()
+
+
+def _install_hooks():
+    # Once per process, however many apps are created in it
+    global _hooks_installed
+    if not _hooks_installed:
+        os.register_at_fork(after_in_child=_restart_in_child)
+        atexit.register(_stop_all)
+        _hooks_installed = True
+
+
+def init_app(app):
+    """
+    Routes app logging through a queue drained by a single listener thread.
+
+    Request threads only put records on the queue; the listener formats them
+    and writes the rotating log file. With LOG_FORMAT='json' each line is a
+    JSON object carrying the request id, and LOG_REQUESTS adds one access
+    line per request with its duration and response size.
+    """
+    log_file = app.config['LOG_FILE']
+    os.makedirs(os.path.dirname(log_file) or '.', exist_ok=True)
+    file_handler = RotatingFileHandler(log_file, maxBytes=app.config['LOG_MAX_BYTES'],
+                                       backupCount=app.config['LOG_BACKUP_COUNT'])
+    if app.config['LOG_FORMAT'] == 'json':
+        file_handler.setFormatter(JSONFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    file_handler.setLevel(logging.INFO)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+    listener = LogListener(queue_handler, file_handler)
+    listener.start()
+    _install_hooks()
+
+    # The queue is the only sink: Flask's stderr handler, or a handler on
+    # the root logger, would write every record on the request thread again.
+    # The queue of an earlier app on the same logger is replaced too.
+    for handler in list(app.logger.handlers):
+        if handler is default_handler or isinstance(handler, DeferredQueueHandler):
+            app.logger.removeHandler(handler)
+    app.logger.propagate = False
+    app.logger.addHandler(queue_handler)
+    app.logger.setLevel(logging.INFO)
+    app.extensions['log_listener'] = listener
+
+    if app.config['LOG_REQUESTS']:
+        register_request_logging(app)
+
+
+def stop_listener(listener):
+    """Flushes and stops the listener; safe to call more than once."""
+    listener.stop()
+
+
+def register_request_logging(app):
+    @app.before_request
+    def start_request_timer():
+        g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def log_request(response):
+        if 'request_start' not in g:
+            return response
+        duration_ms = (time.perf_counter() - g.request_start) * 1000
+        app.logger.info('%s %s %s', request.method, request.path, response.status_code, extra={
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'duration_ms': round(duration_ms, 2),
+            'response_bytes': response.calculate_content_length(),
+        })
+        response.headers['X-Request-ID'] = g.request_id
+        return response
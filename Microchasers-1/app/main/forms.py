@@ -1,15 +1,32 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, SubmitField
-from wtforms.validators import DataRequired
+from wtforms import StringField, SelectField, SubmitField, DateField, IntegerField
+from wtforms.validators import DataRequired, Optional, NumberRange
 from flask_wtf.file import FileField, FileAllowed, FileRequired
+from app.models import DETECTOR_TIERS
+
+TIER_CHOICES = [(tier, tier.capitalize()) for tier in DETECTOR_TIERS]
 
 class SampleForm(FlaskForm):
     name = StringField('Sample Name', validators=[DataRequired()])
+    detector_tier = SelectField('Detector', choices=TIER_CHOICES, default='standard')
     submit = SubmitField('Create Sample')
 
 class ImageUploadForm(FlaskForm):
     image = FileField('Image', validators=[
         FileRequired(),
-        FileAllowed(['jpg', 'png', 'jpeg'], 'Images only!')
+        FileAllowed(['jpg', 'png', 'jpeg', 'tif', 'tiff'], 'Images only!')
     ])
+    # Empty uses the sample's detector tier
+    detector_tier = SelectField('Detector', choices=[('', 'Sample default')] + TIER_CHOICES, default='')
     submit = SubmitField('Upload')
+
+class SampleSearchForm(FlaskForm):
+    # Submitted with GET, so result pages can be linked and bookmarked
+    class Meta:
+        csrf = False
+
+    q = StringField('Name contains', validators=[Optional()])
+    start = DateField('From', validators=[Optional()])
+    end = DateField('To', validators=[Optional()])
+    min_particles = IntegerField('Min. particles', validators=[Optional(), NumberRange(min=0)])
+    max_particles = IntegerField('Max. particles', validators=[Optional(), NumberRange(min=0)])
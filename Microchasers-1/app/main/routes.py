@@ -1,36 +1,164 @@
 from flask import render_template, flash, redirect, url_for, request, current_app
 from flask_login import login_required, current_user, login_user
-from werkzeug.utils import secure_filename
 import os
 import json
 from collections import Counter
-import numpy as np
 from app.main import bp
-from app.main.forms import SampleForm, ImageUploadForm
+from app.main.forms import SampleForm, ImageUploadForm, SampleSearchForm
 from app.models import Sample, Image, Detection, User
 from app.database import db
-from app.services.image_processing import detect_microplastics
+from app.services import counters, palette, perceptual, sample_search, storage
+from app.services.size_sketch import SizeSketch
+from app.services.tiff_stack import TIFF_EXTENSIONS
+from app.services.detection_pool import run_analysis, run_in_pool, fingerprint_image, derive_image
+from app.realtime import notify_image
+from app import admission, caching
 
 @bp.route('/')
 @bp.route('/index')
 def index():
-    samples = []
+    samples, reading_counts, more = [], {}, False
     if current_user.is_authenticated:
-        samples = current_user.samples.order_by(Sample.timestamp.desc()).all()
-    return render_template('index.html', title='Home', samples=samples)
+        # The most recent samples only, the full list is paginated
+        per_page = current_app.config['SAMPLES_PER_PAGE']
+        samples = sample_search.search_samples(current_user).limit(per_page + 1).all()
+        more = len(samples) > per_page
+        samples = samples[:per_page]
+        reading_counts = sample_search.reading_counts(samples)
+    return render_template('index.html', title='Home', samples=samples, reading_counts=reading_counts, more=more)
 
 @bp.route('/create_sample', methods=['GET', 'POST'])
 @login_required
 def create_sample():
     form = SampleForm()
     if form.validate_on_submit():
-        sample = Sample(name=form.name.data, author=current_user)
+        sample = Sample(name=form.name.data, author=current_user, detector_tier=form.detector_tier.data)
         db.session.add(sample)
+        counters.adjust(samples=1)
         db.session.commit()
         flash('Your sample has been created!')
         return redirect(url_for('main.index'))
     return render_template('create_sample.html', title='Create Sample', form=form)
 
+def _process_stack(sample, upload, tier):
+    """Imports every page of an admitted TIFF upload as an image, then redirects back to the sample."""
+    from app.services.detection_pool import InlineExecutor
+    from app.services.importer import Importer
+
+    stack_filepath = storage.save_upload(upload)
+    importer = Importer(InlineExecutor(current_app.config['DETECTION_TIMEOUT']), current_user,
+                        current_app.config['DERIVATIVES_FOLDER'], batch_size=1, in_flight=1,
+                        on_commit=lambda committed: [notify_image(image) for image, _ in committed])
+    importer.attach(sample)
+    added = importer.add_stack(sample.name, storage.resolve(stack_filepath), tier)
+    # The pages hold their own references on the stack
+    storage.release(stack_filepath)
+    totals, _ = importer.finish()
+
+    if added is False:
+        flash('This stack was already uploaded to the sample.')
+    elif not totals['imported']:
+        flash('The stack could not be read.')
+    else:
+        flash(f'Stack uploaded: {totals["imported"]} page(s) processed with {totals["detections"]} detection(s).')
+    return redirect(url_for('main.sample', id=sample.id))
+
+def _process_upload(sample, upload, tier):
+    """Stores and analyses an admitted upload, then redirects back to the sample."""
+    if os.path.splitext(upload.filename or '')[1].lower() in TIFF_EXTENSIONS:
+        return _process_stack(sample, upload, tier)
+
+    # Store the upload under its content hash so equal names never collide
+    original_filepath = storage.save_upload(upload)
+
+    # Create a new image record
+    new_image = Image(filepath=original_filepath, original_filepath=original_filepath,
+                      sample=sample, status='processing', detector_tier=tier)
+    db.session.add(new_image)
+    counters.adjust(sample=sample, images=1)
+    db.session.commit()
+    notify_image(new_image)
+
+    try:
+        return _analyse_upload(sample, new_image, tier)
+    except Exception:
+        # The image must not stay 'processing', or its card never resolves
+        current_app.logger.exception('Processing of image %s failed', new_image.id)
+        db.session.rollback()
+        new_image.status = 'failed'
+        db.session.commit()
+        notify_image(new_image)
+        flash('The image was uploaded but could not be analysed.')
+        return redirect(url_for('main.sample', id=sample.id))
+
+def _analyse_upload(sample, new_image, tier):
+    """Analyses a stored upload, or settles it as a near duplicate, and records the result."""
+    source = storage.resolve(new_image.original_filepath)
+    timeout = current_app.config['DETECTION_TIMEOUT']
+    policy = current_app.config['NEAR_DUPLICATE_POLICY']
+    if policy in ('reuse', 'mark'):
+        phash = run_in_pool(fingerprint_image, source, timeout=timeout)
+        for column, value in perceptual.band_columns(phash).items():
+            setattr(new_image, column, value)
+        match = None
+        if phash is not None:
+            match = perceptual.find_near_duplicate(sample.id, phash, current_app.config['NEAR_DUPLICATE_DISTANCE'],
+                                                   tier=tier, exclude_id=new_image.id)
+        if match is not None:
+            # A near-identical image of this sample was analysed already,
+            # only the derivatives of this one are rendered
+            original, distance = match
+            new_image.content_hash = run_in_pool(derive_image, source, current_app.config['DERIVATIVES_FOLDER'],
+                                                 timeout=timeout)
+            counters.adjust(sample=sample, detections=perceptual.apply_policy(new_image, original, policy))
+            db.session.commit()
+            notify_image(new_image)
+            current_app.logger.info('Image %s is a near duplicate of image %s (distance %d, policy %s)',
+                                    new_image.id, original.id, distance, policy)
+            flash('Image uploaded. It is nearly identical to an earlier image of this sample, '
+                  + ('whose results were reused.' if policy == 'reuse' else 'so it was marked as a duplicate.'))
+            return redirect(url_for('main.sample', id=sample.id))
+
+    # Process the image in the detection pool, overlays are rendered later
+    # from the detections
+    analysis = run_analysis(source, timeout=timeout, tier=tier)
+    detections = analysis['detections']
+
+    if detections is not None:
+        new_image.status = 'processed'
+        new_image.content_hash = analysis['content_hash']
+        new_image.contours = analysis['contours']
+        new_image.size_sketch = analysis['size_sketch']
+        for column, value in perceptual.band_columns(analysis['phash']).items():
+            setattr(new_image, column, value)
+    else:
+        new_image.status = 'failed'
+        detections = []
+    db.session.add(new_image) # Ensure the change is staged for commit
+
+    # Save detections
+    for det in detections:
+        detection = Detection(
+            x_coordinate=det['x_coordinate'],
+            y_coordinate=det['y_coordinate'],
+            size=det['size'],
+            shape=det['shape'],
+            color=det['color'],
+            color_code=det['color_code'],
+            image=new_image
+        )
+        db.session.add(detection)
+    counters.adjust(sample=sample, detections=len(detections))
+
+    db.session.commit()
+    notify_image(new_image)
+
+    if new_image.status == 'failed':
+        flash('The image was uploaded but could not be analysed.')
+    else:
+        flash('Image uploaded and processed successfully!')
+    return redirect(url_for('main.sample', id=sample.id))
+
 @bp.route('/sample/<int:id>', methods=['GET', 'POST'])
 @login_required
 def sample(id):
@@ -44,64 +172,55 @@ def sample(id):
     # Pass Detection model to template for access to its properties
     Detection_model = Detection
     if form.validate_on_submit():
-        f = form.image.data
-        filename = secure_filename(f.filename)
-        upload_path = os.path.join(current_app.root_path, 'static/uploads', filename)
-        f.save(upload_path)
-
-        # Create a new image record
-        new_image = Image(filepath=f'uploads/{filename}', sample=sample)
-        db.session.add(new_image)
-        db.session.commit()
+        tier = form.detector_tier.data or sample.detector_tier or 'standard'
+        # Waits for its share of the analysis memory budget, or answers
+        # 429/503 with Retry-After when the server is saturated
+        with admission.admit_upload(form.image.data.stream, tier, current_user.id):
+            return _process_upload(sample, form.image.data, tier)
 
-        # Process the image
-        detections, processed_image_path = detect_microplastics(upload_path)
-
-        # Update image record with the path to the processed image
-        if processed_image_path:
-            processed_filename = os.path.basename(processed_image_path)
-            new_image.filepath = f'uploads/{processed_filename}'
-            db.session.add(new_image) # Ensure the change is staged for commit
-
-        # Save detections
-        for det in detections:
-            detection = Detection(
-                x_coordinate=det['x_coordinate'],
-                y_coordinate=det['y_coordinate'],
-                size=det['size'],
-                shape=det['shape'],
-                color=det['color'],
-                image=new_image
-            )
-            db.session.add(detection)
+    def render_images():
+        images = sample.images.options(db.undefer(Image.size_sketch)).order_by(Image.timestamp.desc()).all()
+        images_with_stats = []
+        for image in images:
+            if image.size_sketch:
+                # From the header of the size sketch, without loading the detections
+                _, avg, smallest, largest = SizeSketch.summary(image.size_sketch)
+                images_with_stats.append({'image': image, 'stats': {'min': smallest or 0, 'max': largest or 0,
+                                                                    'avg': avg or 0}})
+                continue
+            detections = image.detections.all()
+            if detections:
+                sizes = [d.size for d in detections]
+                size_stats = {
+                    'min': min(sizes),
+                    'max': max(sizes),
+                    'avg': sum(sizes) / len(sizes)
+                }
+            else:
+                size_stats = {'min': 0, 'max': 0, 'avg': 0}
+            images_with_stats.append({'image': image, 'stats': size_stats})
+        return render_template('_sample_images.html', images_with_stats=images_with_stats, Detection=Detection_model)
 
-        db.session.commit()
-
-        flash('Image uploaded and processed successfully!')
-        return redirect(url_for('main.sample', id=id))
-
-    images = sample.images.order_by(Image.timestamp.desc()).all()
-    images_with_stats = []
-    for image in images:
-        detections = image.detections.all()
-        if detections:
-            sizes = [d.size for d in detections]
-            size_stats = {
-                'min': min(sizes),
-                'max': max(sizes),
-                'avg': np.mean(sizes)
-            }
-        else:
-            size_stats = {'min': 0, 'max': 0, 'avg': 0}
-        images_with_stats.append({'image': image, 'stats': size_stats})
-
-    return render_template('sample.html', title=sample.name, sample=sample, form=form, images_with_stats=images_with_stats, Detection=Detection_model)
+    # The image cards are rendered once per version of the sample; the page
+    # around them carries the upload form's CSRF token, so it is always fresh
+    images_html = caching.fragment(('sample-images', sample.id, sample.version), render_images)
+    return render_template('sample.html', title=sample.name, sample=sample, form=form, images_html=images_html)
 
 @bp.route('/samples')
 @login_required
 def samples():
-    samples = current_user.samples.order_by(Sample.timestamp.desc()).all()
-    return render_template('samples.html', title='My Samples', samples=samples)
+    form = SampleSearchForm(request.args)
+    filters = {}
+    if form.validate():
+        filters = {name: form[name].data for name in ('start', 'end', 'min_particles', 'max_particles')}
+        filters['text'] = form.q.data
+    page = request.args.get('page', 1, type=int)
+    samples = sample_search.search_samples(current_user, **filters).paginate(
+        page=page, per_page=current_app.config['SAMPLES_PER_PAGE'], error_out=False)
+    # Links to other pages keep the filters
+    args = {key: value for key, value in request.args.items() if key != 'page' and value}
+    return render_template('samples.html', title='My Samples', samples=samples, form=form, args=args,
+                           reading_counts=sample_search.reading_counts(samples.items))
 
 @bp.route('/dashboard/<int:image_id>')
 @login_required
@@ -111,6 +230,12 @@ def dashboard(image_id):
         flash('You are not authorized to view this dashboard.')
         return redirect(url_for('main.index'))
 
+    version = (image.id, image.version)
+    return caching.conditional(('dashboard', version, current_user.id), lambda: render_template(
+        'dashboard.html', title='Analysis Dashboard',
+        content=caching.fragment(('dashboard', version), lambda: _render_dashboard(image))))
+
+def _render_dashboard(image):
     detections = image.detections.all()
 
     # Prepare data for tables
@@ -125,21 +250,27 @@ def dashboard(image_id):
     size_stats = {
         'min': min(sizes) if sizes else 0,
         'max': max(sizes) if sizes else 0,
-        'avg': np.mean(sizes) if sizes else 0
+        'avg': sum(sizes) / len(sizes) if sizes else 0
     }
+    percentiles = []
+    if image.size_sketch and sizes:
+        sketch = SizeSketch.decode(image.size_sketch)
+        percentiles = [(value, sketch.quantile(value / 100)) for value in (10, 50, 90)]
 
 
-    # Color analysis
-    colors = [d.color for d in detections]
-    color_counts = Counter(colors)
+    # Color analysis, grouped by palette class in the database
+    rows = (db.session.query(Detection.color_code, db.func.count(Detection.id))
+            .filter(Detection.image_id == image.id)
+            .group_by(Detection.color_code).order_by(db.func.count(Detection.id).desc()))
+    color_counts = [(palette.color_name(code), palette.color_swatch(code), count) for code, count in rows]
 
 
-    return render_template('dashboard.html',
-                           title='Analysis Dashboard',
+    return render_template('_dashboard.html',
                            image=image,
                            total_particles=total_particles,
                            shape_counts=shape_counts,
                            size_stats=size_stats,
+                           percentiles=percentiles,
                            color_counts=color_counts,
                            detections=detections)
 
@@ -151,6 +282,7 @@ def demo():
         demo_user = User(username='demo_user', email='demo@example.com')
         demo_user.set_password('demo123')  # Set a secure password even though it won't be used directly
         db.session.add(demo_user)
+        counters.adjust(users=1)
         db.session.commit()
     
     # Log in as demo user
@@ -0,0 +1,117 @@
+import hashlib
+import os
+import threading
+from functools import partial
+from flask import abort, current_app, make_response, redirect, request, send_from_directory, url_for
+from flask_login import current_user, login_required
+from sqlalchemy import func
+from app.database import db
+from app.media import bp
+from app.models import Image, Detection
+from app.services import storage
+from app.services.annotation import AnnotationCache, ENCODER_MIMETYPES, render_annotated
+from app.services.derivatives import DERIVATIVE_SIZES, derivative_dir, derivative_filename
+
+# Derivative URLs embed the content digest, so a given URL can never change.
+CACHE_MAX_AGE = 365 * 24 * 3600
+
+_cache_lock = threading.Lock()
+
+
+def annotation_cache():
+    with _cache_lock:
+        cache = current_app.extensions.get('annotation_cache')
+        if cache is None:
+            cache = AnnotationCache(max_bytes=current_app.config['ANNOTATION_CACHE_BYTES'],
+                                    workers=current_app.config['ANNOTATION_WORKERS'])
+            current_app.extensions['annotation_cache'] = cache
+        return cache
+
+
+@bp.app_template_global()
+def image_url(image, size='thumb'):
+    """URL of an image derivative, falling back to the plain static file."""
+    if not image.content_hash:
+        return url_for('static', filename=image.filepath)
+    ext = os.path.splitext(image.filepath)[1]
+    return url_for('media.derivative', digest=image.content_hash,
+                   filename=derivative_filename(size, ext))
+
+
+@bp.route('/<digest>/<filename>')
+def derivative(digest, filename):
+    size = os.path.splitext(filename)[0]
+    if size not in DERIVATIVE_SIZES or len(digest) != 64 or not digest.isalnum():
+        abort(404)
+
+    root = current_app.config['DERIVATIVES_FOLDER']
+    response = send_from_directory(derivative_dir(root, digest), filename,
+                                   max_age=CACHE_MAX_AGE, etag=f'{digest}-{size}')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def overlay_key(image, size):
+    """Identifies an overlay rendering; changes whenever the detections or encoder settings do."""
+    config = current_app.config
+    last_id, count = db.session.query(func.max(Detection.id), func.count(Detection.id)) \
+        .filter(Detection.image_id == image.id).one()
+    return (f'{image.id}:{image.original_filepath}:{last_id}:{count}:{size}:{config["ANNOTATION_FORMAT"]}:'
+            f'{config["ANNOTATION_QUALITY"]}:{config["ANNOTATION_PNG_COMPRESSION"]}')
+
+
+def overlay(image, size, key=None):
+    """
+    The encoded overlay of an image's detections at a derivative size,
+    rendered on the annotation cache's workers unless already cached.
+
+    Returns:
+        bytes: The encoded image, or None if the original cannot be read.
+    """
+    config = current_app.config
+    key = key or overlay_key(image, size)
+    cache = annotation_cache()
+    data = cache.lookup(key)
+    if data is None:
+        detections = [row._asdict() for row in db.session.query(
+            Detection.x_coordinate, Detection.y_coordinate, Detection.size, Detection.shape
+        ).filter(Detection.image_id == image.id).order_by(Detection.id)]
+        from app.services.geometry import decode_contours, split_contours
+        contours = split_contours(*decode_contours(image.contours)) if image.contours else None
+        render = partial(render_annotated, storage.resolve(image.original_filepath), detections,
+                         contours=contours, max_edge=DERIVATIVE_SIZES[size], fmt=config['ANNOTATION_FORMAT'],
+                         quality=config['ANNOTATION_QUALITY'],
+                         png_compression=config['ANNOTATION_PNG_COMPRESSION'])
+        data = cache.get(key, render)
+    return data
+
+
+@bp.route('/annotated/<int:image_id>/<size>')
+@login_required
+def annotated(image_id, size):
+    image = Image.query.get_or_404(image_id)
+    if image.sample.author != current_user:
+        abort(403)
+    if size not in ('preview', 'full'):
+        abort(404)
+    # Images stored before annotation became lazy already have overlays burnt in
+    if not image.original_filepath:
+        return redirect(image_url(image, size))
+
+    key = overlay_key(image, size)
+    etag = hashlib.sha1(key.encode()).hexdigest()
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+    else:
+        data = overlay(image, size, key)
+        if data is None:
+            abort(404)
+        response = make_response(data)
+        response.mimetype = ENCODER_MIMETYPES[current_app.config['ANNOTATION_FORMAT']]
+
+    # Detections can be replaced, so browsers revalidate with the ETag each time
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
@@ -3,6 +3,9 @@ from datetime import datetime
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 
+# Detector tiers, fastest first (see app.services.image_processing.TIER_SETTINGS)
+DETECTOR_TIERS = ('fast', 'standard', 'precise')
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), index=True, unique=True, nullable=False)
@@ -16,6 +19,11 @@ class User(UserMixin, db.Model):
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+    @property
+    def is_administrator(self):
+        from .auth.forms import ADMIN_CREDENTIALS
+        return self.username == ADMIN_CREDENTIALS['username']
+
     def __repr__(self):
         return f'<User {self.username}>'
 
@@ -24,9 +32,19 @@ class Sample(db.Model):
     name = db.Column(db.String(140), nullable=False)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    detector_tier = db.Column(db.String(20), default='standard', server_default='standard')  # default for uploads
+    # Denormalised counts of the sample's images and detections, kept up by counters.adjust
+    image_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    detection_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Bumped on every write to the sample or its images; keys cached fragments (see app.caching)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     readings = db.relationship('SensorReading', backref='sample', lazy='dynamic')
     images = db.relationship('Image', backref='sample', lazy='dynamic')
 
+    # Listing and filtering one user's samples (see app.services.sample_search)
+    __table_args__ = (db.Index('ix_sample_user_timestamp', 'user_id', 'timestamp'),
+                      db.Index('ix_sample_user_detection_count', 'user_id', 'detection_count'))
+
     def __repr__(self):
         return f'<Sample {self.name}>'
 
@@ -43,9 +61,38 @@ class SensorReading(db.Model):
 class Image(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     filepath = db.Column(db.String(200), nullable=False)
+    original_filepath = db.Column(db.String(200))
+    # For a page of a multi-page TIFF: the stored stack and the page's index in
+    # it. For a video: the stored video, if it was a file (no page index)
+    stack_filepath = db.Column(db.String(200), index=True)
+    stack_page = db.Column(db.Integer)
+    # Frames analysed, for an image standing for a video or image sequence;
+    # its detections are then particles tracked across frames (see Track)
+    frame_count = db.Column(db.Integer)
+    # Bumped on every write to the image or its detections (see app.caching)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    status = db.Column(db.String(20), default='pending')  # pending, processing, processed, duplicate, failed
+    detector_tier = db.Column(db.String(20), default='standard', server_default='standard')  # tier that made the detections
+    content_hash = db.Column(db.String(64), index=True)  # digest of the displayed image, keys its derivatives
+    # Contour polygons of the detections, in detection id order (see app.services.geometry)
+    contours = db.deferred(db.Column(db.LargeBinary))
+    # Mergeable summary of the detection sizes (see app.services.size_sketch)
+    size_sketch = db.deferred(db.Column(db.LargeBinary))
+    # Difference hash of the upload and its 16-bit bands (see app.services.perceptual)
+    phash = db.Column(db.BigInteger)
+    phash_band0 = db.Column(db.Integer)
+    phash_band1 = db.Column(db.Integer)
+    phash_band2 = db.Column(db.Integer)
+    phash_band3 = db.Column(db.Integer)
+    # The near-identical image whose detections this one reuses or duplicates
+    duplicate_of_id = db.Column(db.Integer, db.ForeignKey('image.id'))
     sample_id = db.Column(db.Integer, db.ForeignKey('sample.id'))
     detections = db.relationship('Detection', backref='image', lazy='dynamic')
+    duplicate_of = db.relationship('Image', remote_side=[id])
+
+    __table_args__ = tuple(db.Index(f'ix_image_sample_phash_band{i}', 'sample_id', f'phash_band{i}')
+                           for i in range(4))
 
     def __repr__(self):
         return f'<Image {self.filepath}>'
@@ -57,8 +104,48 @@ class Detection(db.Model):
     size = db.Column(db.Float, nullable=True)
     shape = db.Column(db.String(50), nullable=True)
     color = db.Column(db.String(7), nullable=True)
+    color_code = db.Column(db.SmallInteger, index=True, nullable=True)  # index into palette.PALETTE
     image_id = db.Column(db.Integer, db.ForeignKey('image.id'))
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
 
+    # Per-image colour distributions are answered from this index alone
+    __table_args__ = (db.Index('ix_detection_image_color', 'image_id', 'color_code'),)
+
     def __repr__(self):
         return f'<Detection {self.id} at ({self.x_coordinate}, {self.y_coordinate})>'
+
+class Track(db.Model):
+    """The path of a particle tracked across video frames, stored once as its Detection."""
+    id = db.Column(db.Integer, primary_key=True)
+    detection_id = db.Column(db.Integer, db.ForeignKey('detection.id'), index=True, unique=True)
+    image_id = db.Column(db.Integer, db.ForeignKey('image.id'), index=True)
+    first_frame = db.Column(db.Integer)
+    last_frame = db.Column(db.Integer)
+    frame_count = db.Column(db.Integer)  # frames the particle was detected in
+    path_length = db.Column(db.Float)  # pixels
+    # (frame, x, y, size) per observation (see app.services.tracking)
+    points = db.deferred(db.Column(db.LargeBinary))
+    detection = db.relationship('Detection', backref=db.backref('track', uselist=False))
+
+    def __repr__(self):
+        return f'<Track {self.id} frames {self.first_frame}-{self.last_frame}>'
+
+class StoredFile(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    path = db.Column(db.String(200), index=True, unique=True, nullable=False)
+    digest = db.Column(db.String(64), index=True, nullable=False)
+    size = db.Column(db.Integer)
+    refcount = db.Column(db.Integer, nullable=False, default=0)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<StoredFile {self.path} refs={self.refcount}>'
+
+class Counter(db.Model):
+    # Running row counts for the admin dashboard, kept by the write paths
+    # (see app.services.counters)
+    name = db.Column(db.String(32), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<Counter {self.name}={self.value}>'
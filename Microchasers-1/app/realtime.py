@@ -0,0 +1,174 @@
+import os
+import sqlite3
+import time
+from flask_login import current_user
+from flask_socketio import SocketIO, join_room, leave_room
+from socketio import PubSubManager
+from sqlalchemy import event, func
+from .database import db
+from .models import Sample, SensorReading, Detection
+
+socketio = SocketIO()
+
+
+def sample_room(sample_id):
+    return f'sample-{sample_id}'
+
+
+class SQLiteQueueManager(PubSubManager):
+    """Socket.IO client manager that relays messages through a SQLite file.
+
+    A stand-in for Redis when several workers run on one host: every worker
+    appends published messages to a shared table and tails it for messages
+    written by the others.
+    """
+    name = 'sqlite'
+
+    def __init__(self, path, channel='flask-socketio', write_only=False,
+                 logger=None, poll_interval=0.05, retention=60):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention = retention
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS socketio_queue ('
+                         'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                         'channel TEXT NOT NULL, '
+                         'created REAL NOT NULL, '
+                         'payload TEXT NOT NULL)')
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def _publish(self, data):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('INSERT INTO socketio_queue (channel, created, payload) '
+                         'VALUES (?, ?, ?)',
+                         (self.channel, now, self.json.dumps(data)))
+            conn.execute('DELETE FROM socketio_queue WHERE created < ?',
+                         (now - self.retention,))
+
+    def _listen(self):
+        conn = self._connect()
+        last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM socketio_queue').fetchone()[0]
+        while True:
+            rows = conn.execute('SELECT id, payload FROM socketio_queue '
+                                'WHERE id > ? AND channel = ? ORDER BY id',
+                                (last_id, self.channel)).fetchall()
+            for row_id, payload in rows:
+                last_id = row_id
+                yield payload
+            if not rows:
+                time.sleep(self.poll_interval)
+
+
+def init_app(app):
+    """Attach Socket.IO to the app, using a message queue if one is configured.
+
+    ``SOCKETIO_MESSAGE_QUEUE`` accepts any URL Flask-SocketIO understands
+    (``redis://``, ``amqp://``, ...) plus ``sqlite:///<path>`` for the local
+    stand-in above.
+    """
+    url = app.config.get('SOCKETIO_MESSAGE_QUEUE')
+    options = {}
+    if url and url.startswith('sqlite:///'):
+        path = url[len('sqlite:///'):]
+        if not os.path.isabs(path):
+            path = os.path.join(app.instance_path, path)
+        options['client_manager'] = SQLiteQueueManager(path)
+    elif url:
+        options['message_queue'] = url
+    socketio.init_app(app, **options)
+
+
+def image_payload(image):
+    count, size_min, size_max, size_avg = db.session.query(
+        func.count(Detection.id), func.min(Detection.size),
+        func.max(Detection.size), func.avg(Detection.size)
+    ).filter(Detection.image_id == image.id).one()
+    shapes = [s for (s,) in db.session.query(Detection.shape)
+              .filter(Detection.image_id == image.id).distinct()]
+    return {
+        'image_id': image.id,
+        'sample_id': image.sample_id,
+        'status': image.status,
+        'detector_tier': image.detector_tier,
+        'filepath': image.filepath,
+        'content_hash': image.content_hash,
+        'duplicate_of': image.duplicate_of_id,
+        'timestamp': image.timestamp.strftime('%Y-%m-%d %H:%M') if image.timestamp else None,
+        'detections': count,
+        'size_min': size_min or 0,
+        'size_max': size_max or 0,
+        'size_avg': size_avg or 0,
+        'shapes': shapes,
+    }
+
+
+def notify_image(image):
+    """Push the current processing state and detection stats of an image."""
+    socketio.emit('image_status', image_payload(image), to=sample_room(image.sample_id))
+
+
+def reading_payload(reading):
+    return {
+        'id': reading.id,
+        'sample_id': reading.sample_id,
+        'temperature': reading.temperature,
+        'ph': reading.ph,
+        'timestamp': reading.timestamp.strftime('%H:%M') if reading.timestamp else None,
+    }
+
+
+def _sample_id(data):
+    """The sample id a client sent, or None if there is no valid one."""
+    value = data.get('sample_id') if isinstance(data, dict) else None
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    return None
+
+
+@socketio.on('join_sample')
+def on_join_sample(data):
+    sample_id = _sample_id(data)
+    if sample_id is None or not current_user.is_authenticated:
+        return False
+    sample = db.session.get(Sample, sample_id)
+    if sample is None or sample.user_id != current_user.id:
+        return False
+    join_room(sample_room(sample.id))
+    return True
+
+
+@socketio.on('leave_sample')
+def on_leave_sample(data):
+    sample_id = _sample_id(data)
+    if sample_id is not None:
+        leave_room(sample_room(sample_id))
+
+
+# Sensor readings can be written from anywhere (routes, CLI, other workers), so
+# they are picked up at flush time and only broadcast once the commit succeeds.
+@event.listens_for(db.session, 'after_flush')
+def _collect_readings(session, flush_context):
+    pending = session.info.setdefault('realtime_readings', [])
+    for obj in session.new:
+        if isinstance(obj, SensorReading):
+            pending.append(reading_payload(obj))
+
+
+@event.listens_for(db.session, 'after_commit')
+def _emit_readings(session):
+    for payload in session.info.pop('realtime_readings', []):
+        socketio.emit('sensor_reading', payload, to=sample_room(payload['sample_id']))
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_readings(session):
+    session.info.pop('realtime_readings', None)
+
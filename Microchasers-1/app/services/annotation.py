@@ -0,0 +1,149 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# cv2 and numpy are imported inside the rendering functions: this module is
+# loaded with the media blueprint, and only a cache miss needs OpenCV.
+
+# Contour colour per shape, in BGR
+SHAPE_COLORS = {
+    'bead': (255, 0, 0),    # Blue for beads
+    'fiber': (0, 0, 255),   # Red for fibers
+    'fragment': (0, 255, 0)  # Green for fragments
+}
+
+ENCODER_MIMETYPES = {
+    'webp': 'image/webp',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+}
+
+
+def render_annotations(image, detections, scale=1.0, contours=None):
+    """
+    Draws stored detections on top of an image.
+
+    Args:
+        image (numpy.ndarray): The BGR image to draw on, modified in place.
+        detections (list): Dictionaries with 'x_coordinate', 'y_coordinate',
+                           'size' and 'shape', as stored on Detection rows.
+        scale (float): Factor between the detection coordinates and the image,
+                       for drawing on a downscaled copy.
+        contours (list): Optional polygon per detection, in the same order.
+
+    Returns:
+        numpy.ndarray: The annotated image.
+    """
+    import cv2
+    import numpy as np
+
+    for i, det in enumerate(detections):
+        cx = int(det['x_coordinate'] * scale)
+        cy = int(det['y_coordinate'] * scale)
+        size = det['size'] or 0
+        contour_color = SHAPE_COLORS.get(det['shape'], (0, 255, 0))
+
+        if contours is not None and i < len(contours):
+            polygon = np.round(contours[i] * scale).astype(np.int32)
+            cv2.drawContours(image, [polygon], -1, contour_color, 2)
+        else:
+            # No stored polygon, outline the particle with a circle of the same area
+            radius = max(2, int(np.sqrt(size / np.pi) * scale))
+            cv2.circle(image, (cx, cy), radius, contour_color, 2)
+
+        # Draw a marker at the centroid
+        cv2.drawMarker(image, (cx, cy), contour_color,
+                       markerType=cv2.MARKER_CROSS, markerSize=10, thickness=2)
+
+        # Add labels with more information
+        label = f"{det['shape']} ({int(size)}px)"
+        # Create a dark background for text for better visibility
+        (text_w, text_h), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 2)
+        cv2.rectangle(image, (cx - 2, cy - text_h - 10),
+                      (cx + text_w + 2, cy - 2), (0, 0, 0), -1)
+        cv2.putText(image, label, (cx, cy - 5),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2)
+    return image
+
+
+def encode_image(image, fmt='webp', quality=80, png_compression=3):
+    """Encodes an image with explicit encoder settings and returns the bytes."""
+    import cv2
+
+    if fmt == 'webp':
+        ext, params = '.webp', [cv2.IMWRITE_WEBP_QUALITY, quality]
+    elif fmt == 'jpeg':
+        ext, params = '.jpg', [cv2.IMWRITE_JPEG_QUALITY, quality, cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+    elif fmt == 'png':
+        ext, params = '.png', [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+    else:
+        raise ValueError(f'Unsupported annotation format: {fmt}')
+    ok, encoded = cv2.imencode(ext, image, params)
+    if not ok:
+        raise ValueError(f'Could not encode image as {fmt}')
+    return encoded.tobytes()
+
+
+def render_annotated(image_path, detections, contours=None, max_edge=None, fmt='webp', quality=80,
+                     png_compression=3):
+    """Reads an image, draws its detections and returns the encoded overlay, or None."""
+    import cv2
+
+    image = cv2.imread(image_path, cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    scale = 1.0
+    if max_edge:
+        scale = min(1.0, max_edge / max(image.shape[:2]))
+        if scale < 1.0:
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    render_annotations(image, detections, scale, contours)
+    return encode_image(image, fmt, quality, png_compression)
+
+
+class AnnotationCache:
+    """
+    Size-bounded LRU of encoded overlays, rendered on a small worker pool.
+
+    Concurrent requests for the same key share a single render, and the
+    request thread only waits for the result instead of doing the work.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, workers=2):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='annotate')
+
+    def lookup(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def get(self, key, render, timeout=30):
+        with self._lock:
+            data = self.lookup(key)
+            if data is not None:
+                return data
+            future = self._pending.get(key)
+            if future is None:
+                future = self._executor.submit(render)
+                self._pending[key] = future
+                future.add_done_callback(lambda f: self._store(key, f))
+        return future.result(timeout)
+
+    def _store(self, key, future):
+        with self._lock:
+            self._pending.pop(key, None)
+            data = None if future.exception() else future.result()
+            if data is None or len(data) > self.max_bytes:
+                return
+            self._entries[key] = data
+            self.total_bytes += len(data)
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
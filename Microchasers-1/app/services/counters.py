@@ -0,0 +1,78 @@
+from sqlalchemy import func, update
+from app.database import db
+from app.models import Counter, User, Sample, Image, Detection
+
+# Counted tables. The admin dashboard reads these rows instead of running
+# COUNT(*) over every table on each page load.
+COUNTED = {
+    'users': User,
+    'samples': Sample,
+    'images': Image,
+    'detections': Detection,
+}
+# Counters that are also kept per sample, and the Sample column holding them
+PER_SAMPLE = {
+    'images': 'image_count',
+    'detections': 'detection_count',
+}
+
+
+def adjust(sample=None, **deltas):
+    """
+    Adds to counters in the current transaction, e.g. ``adjust(images=1, detections=12)``.
+
+    Call it after the rows are added to or deleted from the session, so the
+    change commits or rolls back together with them. A missing counter row is
+    rebuilt from its table, which by then already includes the change.
+
+    With ``sample``, the sample's own image and detection counts change by
+    the same amounts.
+    """
+    values = {column: getattr(Sample, column) + deltas[name]
+              for name, column in PER_SAMPLE.items() if deltas.get(name)}
+    if sample is not None and values:
+        if sample.id is None:
+            db.session.flush()
+        db.session.execute(update(Sample).where(Sample.id == sample.id).values(**values))
+    for name, delta in deltas.items():
+        if not delta:
+            continue
+        result = db.session.execute(
+            update(Counter).where(Counter.name == name).values(value=Counter.value + delta))
+        if not result.rowcount:
+            recount([name])
+
+
+def recount(names=None):
+    """Rebuilds counters from their tables and returns the new values."""
+    values = {}
+    for name in names or COUNTED:
+        value = db.session.scalar(db.select(func.count()).select_from(COUNTED[name]))
+        counter = db.session.get(Counter, name)
+        if counter is None:
+            db.session.add(Counter(name=name, value=value))
+        else:
+            counter.value = value
+        values[name] = value
+    return values
+
+
+def recount_samples(sample_ids=None):
+    """Rebuilds the per-sample counts of the given samples (default all) from their tables."""
+    if sample_ids is not None and not sample_ids:
+        return
+    images = (db.select(func.count(Image.id)).where(Image.sample_id == Sample.id)
+              .correlate(Sample).scalar_subquery())
+    detections = (db.select(func.count(Detection.id)).join(Image, Detection.image_id == Image.id)
+                  .where(Image.sample_id == Sample.id).correlate(Sample).scalar_subquery())
+    statement = update(Sample).values(image_count=images, detection_count=detections)
+    if sample_ids is not None:
+        statement = statement.where(Sample.id.in_(sample_ids))
+    db.session.execute(statement.execution_options(synchronize_session=False))
+
+
+def snapshot():
+    """All counters, read in one query. Counters that do not exist yet read 0."""
+    values = dict.fromkeys(COUNTED, 0)
+    values.update(db.session.execute(db.select(Counter.name, Counter.value)).all())
+    return values
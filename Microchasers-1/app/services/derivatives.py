@@ -0,0 +1,88 @@
+import hashlib
+import os
+import shutil
+
+# Longest edge in pixels for each derivative; None keeps the source untouched.
+DERIVATIVE_SIZES = {
+    'thumb': 320,
+    'preview': 1280,
+    'full': None,
+}
+
+JPEG_QUALITY = 82
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """Returns the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def derivative_dir(root, digest):
+    return os.path.join(root, digest[:2], digest)
+
+
+def derivative_filename(size, source_ext):
+    """Thumbnails and previews are always JPEG; 'full' keeps the source format."""
+    if DERIVATIVE_SIZES[size] is None:
+        return f'full{source_ext.lower()}'
+    return f'{size}.jpg'
+
+
+def _write_atomic(path, write):
+    tmp_path = f'{path}.tmp'
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def generate_derivatives(source_path, root):
+    """
+    Generates every derivative size of an image, once per distinct content.
+
+    Args:
+        source_path (str): The image the derivatives are made from.
+        root (str): The directory derivatives are stored under.
+
+    Returns:
+        str: The content digest identifying the derivatives, or None if the
+             source could not be read.
+    """
+    if not os.path.exists(source_path):
+        return None
+
+    digest = file_digest(source_path)
+    ext = os.path.splitext(source_path)[1]
+    target = derivative_dir(root, digest)
+    wanted = {size: os.path.join(target, derivative_filename(size, ext)) for size in DERIVATIVE_SIZES}
+    if all(os.path.exists(path) for path in wanted.values()):
+        return digest
+
+    import cv2
+
+    image = cv2.imread(source_path, cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    os.makedirs(target, exist_ok=True)
+
+    height, width = image.shape[:2]
+    for size, path in wanted.items():
+        if os.path.exists(path):
+            continue
+        edge = DERIVATIVE_SIZES[size]
+        if edge is None:
+            _write_atomic(path, lambda tmp: shutil.copyfile(source_path, tmp))
+            continue
+        scale = min(1.0, edge / max(height, width))
+        resized = image
+        if scale < 1.0:
+            resized = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))),
+                                 interpolation=cv2.INTER_AREA)
+        ok, encoded = cv2.imencode('.jpg', resized, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        if not ok:
+            return None
+        _write_atomic(path, lambda tmp: encoded.tofile(tmp))
+
+    return digest
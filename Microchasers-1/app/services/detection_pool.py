@@ -0,0 +1,245 @@
+import multiprocessing
+import threading
+from concurrent import futures
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app
+
+# Detection runs in a small pool of worker processes so that web request
+# threads never execute OpenCV themselves: a request only waits on the
+# result, and the number of concurrent analyses is capped per web worker.
+# A pool whose process died (e.g. killed for memory) is replaced rather
+# than left to fail every later request of the worker.
+
+_executor = None
+_slots = None
+_lock = threading.Lock()
+
+
+def analyse_image(image_path, derivatives_root, tier='standard'):
+    """
+    Runs the CPU-heavy part of processing an upload with the given detector
+    tier. Executed in a pool process.
+
+    Returns:
+        dict: 'detections' (without contours, or None if the image could not
+              be read), the encoded 'contours' blob, the derivatives
+              'content_hash', the perceptual hash 'phash' and the encoded
+              'size_sketch'.
+    """
+    from app.services.image_processing import detect_microplastics
+
+    return _analysis(detect_microplastics(image_path, tier), image_path, derivatives_root)
+
+
+def analyse_stack_page(stack_path, page, page_path, derivatives_root, tier='standard'):
+    """
+    Analyses one page of a TIFF stack: the page is read on its own (mapped
+    where possible), normalised to 8 bits and written to ``page_path`` as
+    PNG, which becomes the page's image. Executed in a pool process.
+
+    Returns:
+        dict: As analyse_image.
+    """
+    import cv2
+    from app.services.image_processing import detect_in_image
+    from app.services.tiff_stack import read_page, to_8bit
+
+    pixels = read_page(stack_path, page)
+    if pixels is None:
+        return _analysis(None, page_path, derivatives_root)
+    image = to_8bit(pixels)
+    del pixels
+    if not cv2.imwrite(page_path, image):
+        return _analysis(None, page_path, derivatives_root)
+    return _analysis(detect_in_image(image, tier), page_path, derivatives_root)
+
+
+def _failed_analysis():
+    return {'detections': None, 'contours': None, 'content_hash': None, 'phash': None, 'size_sketch': None}
+
+
+def _analysis(detections, image_path, derivatives_root):
+    from app.services.derivatives import generate_derivatives
+    from app.services.geometry import encode_contours
+    from app.services.perceptual import phash
+    from app.services.size_sketch import sketch_sizes
+
+    if detections is None:
+        return _failed_analysis()
+    contours = encode_contours([det.pop('contour') for det in detections])
+    return {
+        'detections': detections,
+        'contours': contours,
+        'content_hash': generate_derivatives(image_path, derivatives_root),
+        'phash': phash(image_path),
+        'size_sketch': sketch_sizes([det['size'] for det in detections]),
+    }
+
+
+def detect_frame(frame, tier='standard'):
+    """The detections of one decoded video frame, contours included. Executed in a pool process."""
+    from app.services.image_processing import detect_in_image
+
+    return detect_in_image(frame, tier)
+
+
+def fingerprint_image(image_path):
+    """The perceptual hash of an image, or None if it cannot be read. Executed in a pool process."""
+    from app.services.perceptual import phash
+
+    return phash(image_path)
+
+
+def derive_image(image_path, derivatives_root):
+    """Renders only the derivatives of an image whose detections come from elsewhere."""
+    from app.services.derivatives import generate_derivatives
+
+    return generate_derivatives(image_path, derivatives_root)
+
+
+def create_executor(processes):
+    """A new pool of detection processes, for callers that manage its lifetime themselves."""
+    # forkserver children are forked from a clean server process that has
+    # the CV stack preloaded, not from a threaded web worker
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(['app.services.image_processing'])
+    return ProcessPoolExecutor(max_workers=processes, mp_context=context)
+
+
+class ProcessPool:
+    """
+    A pool of detection processes for the commands that manage its lifetime
+    themselves (imports, the folder watcher, reprocessing). Once one of its
+    processes has died the pool is broken; it is then replaced on the next
+    submit, so one file that kills its process never stops a long run.
+    """
+
+    def __init__(self, processes):
+        self.processes = processes
+        self._executor = create_executor(processes)
+
+    def submit(self, function, *args):
+        try:
+            return self._executor.submit(function, *args)
+        except BrokenProcessPool:
+            current_app.logger.warning('Detection pool broken, starting a new one')
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = create_executor(self.processes)
+            return self._executor.submit(function, *args)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self._executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+
+class DetectionFailed(RuntimeError):
+    """An analysis timed out, or the pool broke while running it."""
+
+
+def get_executor():
+    """The shared process pool of the current (web or CLI) process, created on first use."""
+    return _pool()[0]
+
+
+def _pool():
+    global _executor, _slots
+    with _lock:
+        if _executor is None:
+            processes = current_app.config['DETECTION_PROCESSES']
+            _executor = create_executor(processes)
+            _slots = threading.BoundedSemaphore(processes + current_app.config['DETECTION_QUEUE_LIMIT'])
+        return _executor, _slots
+
+
+def _discard(executor):
+    """Drops a broken pool, so the next caller starts a new one."""
+    global _executor, _slots
+    with _lock:
+        if _executor is executor:
+            _executor = None
+            _slots = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def run_in_pool(function, *args, timeout=None):
+    """
+    Runs ``function(*args)`` in the detection pool and waits for the result.
+
+    With DETECTION_PROCESSES set to 0 it runs inline instead, which is what
+    tests and one-off scripts usually want.
+
+    Raises:
+        DetectionFailed: The result did not arrive within ``timeout``
+            seconds, or the pool broke twice in a row.
+    """
+    if not current_app.config['DETECTION_PROCESSES']:
+        return function(*args)
+
+    for attempt in range(2):
+        executor, slots = _pool()
+        # Bound the backlog: callers block here once every slot is taken
+        slots.acquire()
+        try:
+            future = executor.submit(function, *args)
+        except BrokenProcessPool:
+            slots.release()
+            future = None
+        except Exception:
+            slots.release()
+            raise
+        if future is not None:
+            # Released on the semaphore of this pool, even once it is replaced
+            future.add_done_callback(lambda f: slots.release())
+            try:
+                return future.result(timeout)
+            except futures.TimeoutError:  # only an alias of the builtin from Python 3.11
+                # The task keeps its process, and its slot, until it ends
+                future.cancel()
+                raise DetectionFailed(f'{function.__name__} did not finish within {timeout} s')
+            except BrokenProcessPool:
+                pass
+        current_app.logger.warning('Detection pool broken, starting a new one (attempt %d)', attempt + 1)
+        _discard(executor)
+    raise DetectionFailed(f'{function.__name__} failed, the detection pool broke twice')
+
+
+class InlineExecutor:
+    """
+    Executor interface over run_in_pool for the Importer within a request:
+    every task is run (in the pool, or inline) as it is submitted, so the
+    pages of an uploaded stack are analysed one at a time.
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+
+    def submit(self, function, *args):
+        future = Future()
+        try:
+            future.set_result(run_in_pool(function, *args, timeout=self.timeout))
+        except Exception as exc:
+            future.set_exception(exc)
+        return future
+
+
+def run_analysis(image_path, timeout=None, tier='standard'):
+    """
+    Analyses an image in the detection pool and waits for the result. An
+    analysis that times out or loses its pool process counts as failed,
+    like one of an unreadable image.
+    """
+    try:
+        return run_in_pool(analyse_image, image_path, current_app.config['DERIVATIVES_FOLDER'], tier,
+                           timeout=timeout)
+    except DetectionFailed as exc:
+        current_app.logger.error('Analysis of %s failed: %s', image_path, exc)
+        return _failed_analysis()
+
+
+def shutdown():
+    global _executor, _slots
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True, cancel_futures=True)
+            _executor = None
+            _slots = None
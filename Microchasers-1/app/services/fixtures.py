@@ -0,0 +1,176 @@
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from flask import current_app
+from sqlalchemy import func, insert, update
+from werkzeug.security import generate_password_hash
+from app.database import db
+from app.models import User, Sample, SensorReading, Image, Detection
+from app.services import counters, palette, storage
+from app.services.derivatives import generate_derivatives
+from app.services.size_sketch import sketch_sizes
+
+# Bulk-generated data for exercising the read paths at production volume.
+# Rows are written as plain tuples through the driver's executemany, with
+# explicit primary keys, so nothing goes through the ORM, SQLAlchemy's
+# per-row parameter processing or RETURNING.
+
+FIXTURE_PASSWORD = 'fixture123'
+# Detections are placed within a frame of this size
+FIXTURE_WIDTH, FIXTURE_HEIGHT = 1920, 1080
+
+SHAPES = np.array(['fragment', 'fiber', 'bead'])
+SHAPE_WEIGHTS = [0.55, 0.3, 0.15]
+# Typical particle colours, as stored by detection
+COLORS = np.array(['#f2f2f2', '#1f3fbf', '#d93025', '#2e9e44', '#f4c20d', '#202020', '#8e44ad', '#e67e22'])
+
+
+def _next_id(model):
+    return (db.session.scalar(db.select(func.max(model.id))) or 0) + 1
+
+
+def _insert(model, columns, rows):
+    statement = insert(model.__table__).compile(dialect=db.engine.dialect, column_keys=list(columns))
+    # Columns with a Python-side scalar default are compiled in as well
+    defaults = {column.name: column.default.arg for column in model.__table__.columns
+                if column.name not in columns and column.default is not None and column.default.is_scalar}
+    if not statement.positional:
+        params = [dict(defaults, **dict(zip(columns, row))) for row in rows]
+    elif list(statement.positiontup) == list(columns):
+        params = list(rows)
+    else:
+        order = [columns.index(name) if name in columns else name for name in statement.positiontup]
+        params = [tuple(row[i] if isinstance(i, int) else defaults[i] for i in order) for row in rows]
+    db.session.connection().exec_driver_sql(str(statement), params)
+
+
+def _timestamps(rng, count, since):
+    seconds = rng.integers(0, int((datetime.utcnow() - since).total_seconds()), count)
+    stamps = [since + timedelta(seconds=int(s)) for s in seconds]
+    if db.engine.dialect.name == 'sqlite':
+        # SQLAlchemy stores SQLite datetimes as ISO strings; other drivers take datetime objects
+        return [str(stamp) for stamp in stamps]
+    return stamps
+
+
+def _placeholder():
+    """
+    Stores the image every fixture image shows: a synthetic field of
+    particles, drawn the same each time so it is stored only once.
+
+    Returns:
+        tuple: Its static-relative path and derivatives content hash.
+    """
+    import cv2
+
+    rng = np.random.default_rng(0)
+    image = np.full((FIXTURE_HEIGHT, FIXTURE_WIDTH, 3), 35, np.uint8)
+    for x, y, radius, shade in zip(rng.integers(0, FIXTURE_WIDTH, 400), rng.integers(0, FIXTURE_HEIGHT, 400),
+                                   rng.integers(3, 30, 400), rng.integers(150, 256, 400)):
+        cv2.circle(image, (int(x), int(y)), int(radius), (int(shade),) * 3, -1)
+    path = storage.temp_path('.png')
+    cv2.imwrite(path, image)
+    filepath = storage.store_file(path)
+    return filepath, generate_derivatives(storage.resolve(filepath), current_app.config['DERIVATIVES_FOLDER'])
+
+
+def generate(users, samples_per_user, images_per_sample, detections_per_image, readings_per_sample,
+             seed=0, batch_rows=100_000, progress=None):
+    """
+    Writes a synthetic dataset on top of whatever the database holds.
+
+    Every fixture user can log in as fixture_<id> with FIXTURE_PASSWORD;
+    images all show one stored placeholder, each holding a reference on
+    it, and have no stored contours.
+
+    Returns:
+        dict: Number of rows written per counter name, plus 'seconds'.
+    """
+    rng = np.random.default_rng(seed)
+    started = time.perf_counter()
+    since = datetime.utcnow() - timedelta(days=365)
+    written = {'users': 0, 'samples': 0, 'images': 0, 'detections': 0, 'readings': 0}
+
+    if db.engine.dialect.name == 'sqlite':
+        # Trade durability for speed while loading throwaway data
+        db.session.execute(db.text('PRAGMA synchronous = OFF'))
+
+    user_id, sample_id, image_id = _next_id(User), _next_id(Sample), _next_id(Image)
+    detection_id, reading_id = _next_id(Detection), _next_id(SensorReading)
+
+    # Hashing is deliberately slow, so every fixture user shares one hash
+    password_hash = generate_password_hash(FIXTURE_PASSWORD)
+    user_ids = list(range(user_id, user_id + users))
+    _insert(User, ('id', 'username', 'email', 'password_hash'),
+            [(i, f'fixture_{i}', f'fixture_{i}@example.com', password_hash) for i in user_ids])
+    written['users'] = users
+
+    image_total = users * samples_per_user * images_per_sample
+    if image_total:
+        image_filepath, content_hash = _placeholder()
+        storage.retain(image_filepath, image_total - 1)
+
+    sample_rows, image_rows, reading_rows = [], [], []
+    for owner in user_ids:
+        for stamp in _timestamps(rng, samples_per_user, since):
+            sample_rows.append((sample_id, f'Fixture sample {sample_id}', stamp, owner, images_per_sample,
+                                images_per_sample * detections_per_image))
+            created = datetime.fromisoformat(stamp) if isinstance(stamp, str) else stamp
+            for image_stamp in _timestamps(rng, images_per_sample, created):
+                image_rows.append((image_id, image_filepath, image_filepath, content_hash, image_stamp, 'processed',
+                                   sample_id))
+                image_id += 1
+            temperatures = rng.normal(20, 3, readings_per_sample).round(2)
+            phs = rng.normal(7, 0.5, readings_per_sample).round(2)
+            for temperature, ph, reading_stamp in zip(temperatures, phs,
+                                                      _timestamps(rng, readings_per_sample, created)):
+                reading_rows.append((reading_id, float(temperature), float(ph), reading_stamp, sample_id))
+                reading_id += 1
+            sample_id += 1
+
+    _insert(Sample, ('id', 'name', 'timestamp', 'user_id', 'image_count', 'detection_count'), sample_rows)
+    written['samples'] = len(sample_rows)
+    for start in range(0, len(reading_rows), batch_rows):
+        _insert(SensorReading, ('id', 'temperature', 'ph', 'timestamp', 'sample_id'),
+                reading_rows[start:start + batch_rows])
+    written['readings'] = len(reading_rows)
+    for start in range(0, len(image_rows), batch_rows):
+        _insert(Image, ('id', 'filepath', 'original_filepath', 'content_hash', 'timestamp', 'status', 'sample_id'),
+                image_rows[start:start + batch_rows])
+    written['images'] = len(image_rows)
+    counters.adjust(users=users, samples=len(sample_rows), images=len(image_rows))
+    db.session.commit()
+
+    # Detections dominate, so they are generated column-wise in batches of
+    # whole images and committed as they go
+    columns = ('id', 'x_coordinate', 'y_coordinate', 'size', 'shape', 'color', 'color_code', 'image_id', 'timestamp')
+    color_codes = np.array(palette.classify_hex(COLORS.tolist()))
+    images_per_batch = max(1, batch_rows // max(1, detections_per_image))
+    for first in range(0, len(image_rows), images_per_batch):
+        batch = image_rows[first:first + images_per_batch]
+        count = len(batch) * detections_per_image
+        if not count:
+            break
+        ids = range(detection_id, detection_id + count)
+        xs = rng.integers(0, FIXTURE_WIDTH, count).tolist()
+        ys = rng.integers(0, FIXTURE_HEIGHT, count).tolist()
+        sizes = rng.lognormal(4.5, 1.0, count).round(1)
+        shapes = rng.choice(SHAPES, count, p=SHAPE_WEIGHTS).tolist()
+        picks = rng.integers(0, len(COLORS), count)
+        colors = COLORS[picks].tolist()
+        codes = color_codes[picks].tolist()
+        owners = [row[0] for row in batch for _ in range(detections_per_image)]
+        stamps = [row[4] for row in batch for _ in range(detections_per_image)]
+        _insert(Detection, columns, zip(ids, xs, ys, sizes.tolist(), shapes, colors, codes, owners, stamps))
+        db.session.execute(update(Image), [
+            {'id': row[0], 'size_sketch': sketch_sizes(sizes[i * detections_per_image:(i + 1) * detections_per_image])}
+            for i, row in enumerate(batch)])
+        counters.adjust(detections=count)
+        db.session.commit()
+        detection_id += count
+        written['detections'] += count
+        if progress:
+            progress(written['detections'], len(image_rows) * detections_per_image)
+
+    written['seconds'] = time.perf_counter() - started
+    return written
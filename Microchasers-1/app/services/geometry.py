@@ -0,0 +1,172 @@
+import numpy as np
+
+# Contour polygons of an image are stored as one blob:
+#
+#   MAGIC, varint(n_contours), varint(n_points) * n_contours,
+#   zigzag-varint(dx, dy) for every point of every contour
+#
+# Points are delta-encoded against the previous point across the whole
+# stream, so neighbouring vertices (at most a few pixels apart with
+# CHAIN_APPROX_SIMPLE) take one byte per coordinate.
+MAGIC = b'CTR1'
+
+# Directions the caliper diameters are measured along, 0.5 degree apart
+_FERET_ANGLES = np.deg2rad(np.arange(0, 180, 0.5))
+_FERET_DIRECTIONS = np.stack([np.cos(_FERET_ANGLES), np.sin(_FERET_ANGLES)])
+
+
+def _varint_encode(values):
+    values = np.asarray(values, dtype=np.uint64)
+    nbytes = np.ones(len(values), dtype=np.int64)
+    for k in range(1, 10):
+        nbytes += values >= (1 << (7 * k))
+    ends = np.cumsum(nbytes)
+    starts = ends - nbytes
+    out = np.zeros(int(ends[-1]) if len(values) else 0, dtype=np.uint8)
+    for k in range(int(nbytes.max()) if len(values) else 0):
+        has = nbytes > k
+        byte = (values[has] >> np.uint64(7 * k)) & np.uint64(0x7f)
+        more = (nbytes[has] > k + 1).astype(np.uint64) << np.uint64(7)
+        out[starts[has] + k] = (byte | more).astype(np.uint8)
+    return out.tobytes()
+
+
+def _varint_decode(data):
+    raw = np.frombuffer(data, dtype=np.uint8)
+    if not len(raw):
+        return np.zeros(0, dtype=np.uint64)
+    ends = np.flatnonzero((raw & 0x80) == 0)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    # Position of each byte within its varint gives its shift
+    group = np.repeat(np.arange(len(starts)), ends - starts + 1)
+    shift = (np.arange(len(raw)) - starts[group]) * 7
+    parts = (raw & 0x7f).astype(np.uint64) << shift.astype(np.uint64)
+    return np.add.reduceat(parts, starts)
+
+
+def _zigzag(values):
+    values = values.astype(np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def _unzigzag(values):
+    values = values.astype(np.int64)
+    return (values >> 1) ^ -(values & 1)
+
+
+def encode_contours(contours):
+    """
+    Packs contour polygons into the compact binary format.
+
+    Args:
+        contours (list): Arrays of (x, y) vertices, in any shape that reshapes
+                         to (n, 2), e.g. as returned by cv2.findContours.
+
+    Returns:
+        bytes: The encoded blob.
+    """
+    polygons = [np.asarray(c, dtype=np.int64).reshape(-1, 2) for c in contours]
+    lengths = np.array([len(p) for p in polygons], dtype=np.int64)
+    header = _varint_encode(np.concatenate(([len(polygons)], lengths)))
+    if not lengths.sum():
+        return MAGIC + header
+    points = np.concatenate(polygons)
+    deltas = np.diff(points, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    return MAGIC + header + _varint_encode(_zigzag(deltas.ravel()))
+
+
+def decode_contours(blob):
+    """
+    Unpacks a contour blob into a flat vertex array.
+
+    Returns:
+        tuple: A tuple containing:
+            - numpy.ndarray: (N, 2) int32 vertices of all contours, concatenated.
+            - numpy.ndarray: Start offset of each contour in the vertex array,
+                             with a final entry equal to N.
+    """
+    if not blob:
+        return np.zeros((0, 2), dtype=np.int32), np.zeros(1, dtype=np.int64)
+    if blob[:len(MAGIC)] != MAGIC:
+        raise ValueError('Not a contour blob')
+    values = _varint_decode(blob[len(MAGIC):])
+    count = int(values[0])
+    lengths = values[1:count + 1].astype(np.int64)
+    deltas = _unzigzag(values[count + 1:]).reshape(-1, 2)
+    points = np.cumsum(deltas, axis=0).astype(np.int32)
+    offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+    return points, offsets
+
+
+def split_contours(points, offsets):
+    """Splits a flat vertex array back into one (n, 1, 2) array per contour, as OpenCV draws them."""
+    return [points[start:end].reshape(-1, 1, 2) for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def shape_metrics(points, offsets):
+    """
+    Measures every stored contour at once, without touching the image.
+
+    All reductions are per-contour segment sums over the flat vertex array,
+    so the cost is a handful of numpy passes regardless of contour count.
+
+    Returns:
+        dict: Arrays with one entry per contour: 'area', 'perimeter',
+              'centroid_x', 'centroid_y', 'feret_max', 'feret_min',
+              'orientation' (degrees, of the major axis), 'circularity'
+              and 'aspect_ratio' (feret_max / feret_min).
+    """
+    lengths = np.diff(offsets)
+    keep = lengths > 0
+    starts = offsets[:-1][keep]
+    n = len(offsets) - 1
+    result = {name: np.zeros(n) for name in ('area', 'perimeter', 'centroid_x', 'centroid_y',
+                                              'feret_max', 'feret_min', 'orientation',
+                                              'circularity', 'aspect_ratio')}
+    if not len(starts):
+        return result
+
+    pts = points.astype(np.float64)
+    x, y = pts[:, 0], pts[:, 1]
+    # Index of the next vertex, wrapping around at the end of each contour
+    nxt = np.arange(len(pts)) + 1
+    nxt[offsets[1:][keep] - 1] = starts
+    x1, y1 = x[nxt], y[nxt]
+
+    def segment_sum(values):
+        return np.add.reduceat(values, starts)
+
+    cross = x * y1 - x1 * y
+    signed_area = segment_sum(cross) / 2
+    perimeter = segment_sum(np.hypot(x1 - x, y1 - y))
+
+    # Polygon moments by Green's theorem, matching cv2.moments on the contour
+    safe_area = np.where(signed_area == 0, 1, signed_area)
+    cx = segment_sum((x + x1) * cross) / (6 * safe_area)
+    cy = segment_sum((y + y1) * cross) / (6 * safe_area)
+    m20 = segment_sum((x * x + x * x1 + x1 * x1) * cross) / 12
+    m02 = segment_sum((y * y + y * y1 + y1 * y1) * cross) / 12
+    m11 = segment_sum((x * y1 + 2 * x * y + 2 * x1 * y1 + x1 * y) * cross) / 24
+    mu20 = m20 - signed_area * cx * cx
+    mu02 = m02 - signed_area * cy * cy
+    mu11 = m11 - signed_area * cx * cy
+    sign = np.sign(safe_area)
+    orientation = np.degrees(0.5 * np.arctan2(2 * mu11 * sign, (mu20 - mu02) * sign))
+
+    # Caliper diameters: extent of the projections onto each direction
+    projections = pts @ _FERET_DIRECTIONS
+    extent = np.maximum.reduceat(projections, starts) - np.minimum.reduceat(projections, starts)
+    feret_max = extent.max(axis=1)
+    feret_min = extent.min(axis=1)
+
+    area = np.abs(signed_area)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        circularity = np.where(perimeter > 0, 4 * np.pi * area / (perimeter * perimeter), 0)
+        aspect_ratio = np.where(feret_min > 0, feret_max / feret_min, 0)
+
+    for name, values in (('area', area), ('perimeter', perimeter), ('centroid_x', cx),
+                         ('centroid_y', cy), ('feret_max', feret_max), ('feret_min', feret_min),
+                         ('orientation', orientation), ('circularity', circularity),
+                         ('aspect_ratio', aspect_ratio)):
+        result[name][keep] = values
+    return result
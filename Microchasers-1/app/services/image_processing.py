@@ -1,45 +1,72 @@
 import cv2
 import numpy as np
 import os
-
-def detect_microplastics(image_path):
+from app.services import palette
+
+# Settings of each detector tier (names in app.models.DETECTOR_TIERS):
+#   max_edge:   analyse a copy downscaled so its longest edge is at most
+#               this many pixels (INTER_AREA, which also smooths), None
+#               for full resolution; results are scaled back
+#   bilateral:  edge-preserving denoise before the colour masks
+#   morphology: clean-up passes over the mask, with a 3x3 kernel
+#   approx:     contour approximation, NONE keeps every boundary pixel
+TIER_SETTINGS = {
+    'fast': {'max_edge': 1024, 'bilateral': False, 'morphology': (cv2.MORPH_OPEN,),
+             'approx': cv2.CHAIN_APPROX_SIMPLE},
+    'standard': {'max_edge': None, 'bilateral': False, 'morphology': (cv2.MORPH_OPEN, cv2.MORPH_CLOSE),
+                 'approx': cv2.CHAIN_APPROX_SIMPLE},
+    'precise': {'max_edge': None, 'bilateral': True, 'morphology': (cv2.MORPH_OPEN, cv2.MORPH_CLOSE),
+                'approx': cv2.CHAIN_APPROX_NONE},
+}
+
+def detect_microplastics(image_path, tier='standard'):
     """
-    Detects microplastics in an image, extracts their features, and annotates the image.
+    Detects microplastics in an image and extracts their features.
+
+    Annotation is not done here; overlays are rendered on demand from the
+    stored detections by app.services.annotation.
 
     Args:
         image_path (str): The path to the image file.
+        tier (str): Detector tier, trading speed against precision
+                    (see TIER_SETTINGS).
 
     Returns:
-        tuple: A tuple containing:
-            - list: A list of dictionaries, where each dictionary represents a
-                    detection and contains 'x', 'y', 'size', 'shape', and 'color'.
-            - str: The path to the output image with detections drawn on it.
+        list: A list of dictionaries, where each dictionary represents a
+              detection and contains 'x_coordinate', 'y_coordinate', 'size',
+              'shape', 'color' and its 'contour' polygon, or None if the
+              image could not be read.
     """
     if not os.path.exists(image_path):
         print(f"Image not found at {image_path}")
-        return [], None
+        return None
 
     # Read the image
     image = cv2.imread(image_path, cv2.IMREAD_COLOR)
     if image is None:
         print(f"Could not read image from {image_path}")
-        return [], None
+        return None
+    return detect_in_image(image, tier)
+
+def detect_in_image(image, tier='standard'):
+    """
+    Detects microplastics in an already decoded 8-bit BGR image, e.g. one
+    page of a TIFF stack. Returns the detections like detect_microplastics.
+    """
+    settings = TIER_SETTINGS[tier]
+
+    scale = 1.0
+    if settings['max_edge'] and max(image.shape[:2]) > settings['max_edge']:
+        scale = settings['max_edge'] / max(image.shape[:2])
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
 
-    output_image = image.copy()
+    if settings['bilateral']:
+        # Reduce noise while preserving edges before thresholding
+        image = cv2.bilateralFilter(image, 9, 75, 75)
 
     # Convert image to HSV color space for better color thresholding
     hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-    
-    # Apply bilateral filter to reduce noise while preserving edges
-    bilateral = cv2.bilateralFilter(image, 9, 75, 75)
-    
-    # Convert to grayscale for additional processing
-    gray = cv2.cvtColor(bilateral, cv2.COLOR_BGR2GRAY)
-    
-    # Apply adaptive thresholding to handle varying lighting conditions
-    thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-                                 cv2.THRESH_BINARY_INV, 11, 2)
-    
+
     # Define multiple color ranges to catch different types of microplastics
     color_ranges = [
         # Bright/white particles
@@ -49,24 +76,27 @@ def detect_microplastics(image_path):
     ]
     
     # Combine masks from different color ranges
-    mask = np.zeros(gray.shape, dtype=np.uint8)
+    mask = np.zeros(image.shape[:2], dtype=np.uint8)
     for lower, upper in color_ranges:
         color_mask = cv2.inRange(hsv, lower, upper)
         mask = cv2.bitwise_or(mask, color_mask)
     
     # Apply morphological operations to clean up the mask
     kernel = np.ones((3,3), np.uint8)
-    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
-    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+    for operation in settings['morphology']:
+        mask = cv2.morphologyEx(mask, operation, kernel)
 
     # Find contours in the mask
-    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, settings['approx'])
 
+    # Areas are measured on the analysed copy, thresholds apply at full size
+    area_scale = scale * scale
     detections = []
+    mean_colors = []
     for contour in contours:
         # Filter out contours based on area and perimeter
         area = cv2.contourArea(contour)
-        if area < 50 or area > 10000:  # Adjust these thresholds based on your images
+        if area < 50 * area_scale or area > 10000 * area_scale:  # Adjust these thresholds based on your images
             continue
             
         # Calculate solidity to filter out noise
@@ -104,51 +134,31 @@ def detect_microplastics(image_path):
         elif aspect_ratio > 3 or aspect_ratio < 0.3:
             shape = "fiber"
 
-        # 4. Color
-        mask_i = np.zeros(image.shape[:2], dtype="uint8")
-        cv2.drawContours(mask_i, [contour], -1, 255, -1)
-        mean_color_bgr = cv2.mean(image, mask=mask_i)
+        # 4. Color, averaged over the particle within its bounding box only
+        mask_i = np.zeros((h, w), dtype="uint8")
+        cv2.drawContours(mask_i, [contour], -1, 255, -1, offset=(-x, -y))
+        mean_color_bgr = cv2.mean(image[y:y + h, x:x + w], mask=mask_i)
+        mean_colors.append(mean_color_bgr[:3])
         # Convert BGR to a hex string for easier display
         mean_color_hex = '#%02x%02x%02x' % (int(mean_color_bgr[2]), int(mean_color_bgr[1]), int(mean_color_bgr[0]))
 
+        if scale != 1.0:
+            # Report position, size and outline in full-resolution pixels
+            cx, cy = int(cx / scale), int(cy / scale)
+            size = size / area_scale
+            contour = np.round(contour / scale).astype(np.int32)
 
         detections.append({
             'x_coordinate': cx,
             'y_coordinate': cy,
             'size': size,
             'shape': shape,
-            'color': mean_color_hex
+            'color': mean_color_hex,
+            'contour': contour
         })
 
-        # --- Annotation ---
-        # Draw contour with color based on shape
-        color_map = {
-            'bead': (255, 0, 0),    # Blue for beads
-            'fiber': (0, 0, 255),   # Red for fibers
-            'fragment': (0, 255, 0)  # Green for fragments
-        }
-        contour_color = color_map.get(shape, (0, 255, 0))
-        cv2.drawContours(output_image, [contour], -1, contour_color, 2)
-        
-        # Draw a marker at the centroid
-        cv2.drawMarker(output_image, (cx, cy), contour_color, 
-                      markerType=cv2.MARKER_CROSS, markerSize=10, thickness=2)
-        
-        # Add labels with more information
-        label = f"{shape} ({int(size)}px)"
-        # Create a dark background for text for better visibility
-        (text_w, text_h), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 2)
-        cv2.rectangle(output_image, (cx - 2, cy - text_h - 10), 
-                     (cx + text_w + 2, cy - 2), (0, 0, 0), -1)
-        cv2.putText(output_image, label, (cx, cy - 5), 
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2)
-
-
-    # Save the output image
-    directory, filename = os.path.split(image_path)
-    name, ext = os.path.splitext(filename)
-    output_filename = f"{name}_processed{ext}"
-    output_path = os.path.join(directory, output_filename)
-    cv2.imwrite(output_path, output_image)
-
-    return detections, output_path
+    # Palette classes for all particles in one table lookup
+    for det, code in zip(detections, palette.classify(mean_colors).tolist()):
+        det['color_code'] = code
+
+    return detections
@@ -0,0 +1,241 @@
+import os
+import time
+from collections import deque
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app
+from app.database import db
+from app.models import Sample, Image, Detection
+from app.services import counters, perceptual, storage
+from app.services.derivatives import file_digest
+from app.services.detection_pool import analyse_image, analyse_stack_page
+from app.services.tiff_stack import TIFF_EXTENSIONS, list_pages
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png'} | TIFF_EXTENSIONS
+
+
+def plan_import(root, sample_name=None):
+    """
+    Maps a directory tree onto samples.
+
+    Every directory becomes a sample named after its path relative to
+    ``root`` (files directly in ``root`` go to a sample named after it),
+    unless ``sample_name`` puts everything into one sample.
+
+    Yields:
+        tuple: (sample name, file path), in a stable order.
+    """
+    root = os.path.abspath(root)
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        relative = os.path.relpath(dirpath, root)
+        name = sample_name or (os.path.basename(root) if relative == '.' else relative.replace(os.sep, '/'))
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS:
+                yield name, os.path.join(dirpath, filename)
+
+
+class Importer:
+    """
+    Imports files for one user: analyses them in a process pool with at most
+    ``in_flight`` files outstanding, and commits every ``batch_size`` images.
+
+    A file whose content is already an image of the target sample is skipped,
+    so re-running an import only picks up what is new. A TIFF file is
+    imported as a stack: every page becomes an image of its own. A file
+    whose analysis raises is imported as a failed image, and the import
+    carries on.
+    """
+
+    def __init__(self, executor, user, derivatives_root, batch_size=50, in_flight=8, progress=None,
+                 on_commit=None, on_done=None):
+        self.executor = executor
+        self.user = user
+        self.derivatives_root = derivatives_root
+        self.batch_size = batch_size
+        self.in_flight = in_flight
+        self.progress = progress
+        # Called with the (image, source path) pairs of every committed batch
+        self.on_commit = on_commit
+        # Called with the source path of every file once all its images are committed
+        self.on_done = on_done
+        self._samples = {}
+        self._imported = {}
+        self._pending = deque()
+        self._remaining = {}  # source path: its images not committed yet
+        self._uncommitted = []
+        self._batch = {'samples': 0}
+        self._batch_samples = {}  # sample name: image and detection counts of this batch
+        self.totals = {'imported': 0, 'skipped': 0, 'failed': 0, 'detections': 0, 'bytes': 0}
+        self.started = time.perf_counter()
+
+    def attach(self, sample):
+        """Imports files for ``sample.name`` into this existing sample."""
+        self._samples[sample.name] = sample
+        # Whole files by path, stack pages by (stack path, page index)
+        self._imported[sample.name] = {(stack_filepath, page) if stack_filepath else original_filepath
+                                       for original_filepath, stack_filepath, page in
+                                       db.session.query(Image.original_filepath, Image.stack_filepath,
+                                                        Image.stack_page).filter(Image.sample_id == sample.id)}
+
+    def _sample(self, name):
+        if name not in self._samples:
+            sample = self.user.samples.filter_by(name=name).first()
+            if sample is not None:
+                self.attach(sample)
+            else:
+                self._samples[name] = Sample(name=name, author=self.user)
+                db.session.add(self._samples[name])
+                self._batch['samples'] += 1
+                self._imported[name] = set()
+        return self._samples[name]
+
+    @property
+    def busy(self):
+        """Whether as many analyses as allowed are outstanding."""
+        return len(self._pending) >= self.in_flight
+
+    def add(self, sample_name, path, tier=None):
+        """
+        Queues a file for import, with the sample's detector tier unless
+        ``tier`` is given. Returns False if it was imported before, and None
+        for a stack without pages, which there is nothing to import of.
+        """
+        ext = os.path.splitext(path)[1]
+        if ext.lower() in TIFF_EXTENSIONS:
+            return self.add_stack(sample_name, path, tier)
+        self._sample(sample_name)
+        filepath = storage.relative_path(file_digest(path), ext)
+        if filepath in self._imported[sample_name]:
+            self.totals['skipped'] += 1
+            return False
+        self._imported[sample_name].add(filepath)
+
+        tier = tier or self._samples[sample_name].detector_tier or 'standard'
+        self._remaining[path] = 1
+        self._submit(sample_name, path, tier, None, analyse_image, path, self.derivatives_root, tier)
+        self.totals['bytes'] += os.path.getsize(path)
+        return True
+
+    def add_stack(self, sample_name, path, tier=None):
+        """
+        Queues every page of a TIFF stack for import. Pages are submitted as
+        the in-flight limit allows and each is read on its own by the
+        analysis, so a long stack never needs more memory than a short one.
+        Pages imported before are left out, so a stack whose import was cut
+        short is completed by adding it again.
+
+        Returns:
+            bool: False if every page was imported before, or None if the
+                  stack has no pages.
+        """
+        self._sample(sample_name)
+        stack_filepath = storage.relative_path(file_digest(path), os.path.splitext(path)[1])
+        pages = list_pages(path)
+        if not pages:
+            self.totals['failed'] += 1
+            return None
+        imported = self._imported[sample_name]
+        pages = [page for page in pages if (stack_filepath, getattr(page, 'index', page)) not in imported]
+        if not pages:
+            self.totals['skipped'] += 1
+            return False
+        imported.update((stack_filepath, getattr(page, 'index', page)) for page in pages)
+
+        # Every page image holds a reference on the stack
+        storage.store_file(path, move=False)
+        storage.retain(stack_filepath, len(pages) - 1)
+        self.totals['bytes'] += os.path.getsize(path)
+        tier = tier or self._samples[sample_name].detector_tier or 'standard'
+        self._remaining[path] = len(pages)
+        for page in pages:
+            page_path = storage.temp_path('.png')
+            self._submit(sample_name, path, tier, (stack_filepath, page_path, getattr(page, 'index', page)),
+                         analyse_stack_page, path, page, page_path, self.derivatives_root, tier)
+        return True
+
+    def _submit(self, sample_name, path, tier, page, function, *args):
+        # Backpressure: never hold more than in_flight analyses
+        while self.busy:
+            self._record(*self._pending.popleft())
+        future = self.executor.submit(function, *args)
+        self._pending.append((sample_name, path, tier, page, future, (function, args)))
+
+    def collect(self):
+        """Records the analyses that have finished so far, in submission order, without waiting."""
+        while self._pending and self._pending[0][4].done():
+            self._record(*self._pending.popleft())
+
+    def _result(self, path, future, call):
+        try:
+            try:
+                return future.result()
+            except BrokenProcessPool:
+                # A process died, of this file or of another one in flight:
+                # tried once more, in the pool that replaces the broken one
+                function, args = call
+                return self.executor.submit(function, *args).result()
+        except Exception as exc:
+            current_app.logger.error('Analysis of %s failed: %r', path, exc)
+            return {'detections': None}
+
+    def _record(self, sample_name, path, tier, page, future, call):
+        analysis = self._result(path, future, call)
+        batch = self._batch_samples.setdefault(sample_name, {'images': 0, 'detections': 0})
+        if page is None:
+            filepath = storage.store_file(path, move=False)
+            image = Image(filepath=filepath, original_filepath=filepath, sample=self._samples[sample_name],
+                          status='failed', detector_tier=tier)
+        else:
+            stack_filepath, page_path, index = page
+            # The page as written by the analysis, or the stack itself if the
+            # page could not be read at all
+            filepath = storage.store_file(page_path) if os.path.exists(page_path) else stack_filepath
+            image = Image(filepath=filepath, original_filepath=filepath, stack_filepath=stack_filepath,
+                          stack_page=index, sample=self._samples[sample_name], status='failed', detector_tier=tier)
+        detections = analysis['detections']
+        if detections is not None:
+            image.status = 'processed'
+            image.content_hash = analysis['content_hash']
+            image.contours = analysis['contours']
+            image.size_sketch = analysis['size_sketch']
+            for column, value in perceptual.band_columns(analysis['phash']).items():
+                setattr(image, column, value)
+            db.session.add_all([Detection(image=image, **det) for det in detections])
+            self.totals['detections'] += len(detections)
+            batch['detections'] += len(detections)
+        else:
+            self.totals['failed'] += 1
+        db.session.add(image)
+        self._uncommitted.append((image, path))
+        batch['images'] += 1
+        self.totals['imported'] += 1
+        if len(self._uncommitted) >= self.batch_size:
+            self._commit()
+
+    def _commit(self):
+        counters.adjust(**self._batch)
+        for name, deltas in self._batch_samples.items():
+            counters.adjust(sample=self._samples[name], **deltas)
+        db.session.commit()
+        self._batch = dict.fromkeys(self._batch, 0)
+        self._batch_samples = {}
+        committed, self._uncommitted = self._uncommitted, []
+        done = []
+        for _, path in committed:
+            self._remaining[path] -= 1
+            if not self._remaining[path]:
+                del self._remaining[path]
+                done.append(path)
+        if self.on_commit and committed:
+            self.on_commit(committed)
+        if self.on_done:
+            for path in done:
+                self.on_done(path)
+        if self.progress:
+            self.progress(self.totals, time.perf_counter() - self.started)
+
+    def finish(self):
+        while self._pending:
+            self._record(*self._pending.popleft())
+        self._commit()
+        return self.totals, time.perf_counter() - self.started
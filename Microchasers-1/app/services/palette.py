@@ -0,0 +1,77 @@
+# Named colour classes for detections. A detection's mean colour is classified
+# by hue, saturation and value through a lookup table over 5-bit RGB, and the
+# class index is stored in Detection.color_code. Entries may be appended but
+# never reordered or removed, since stored codes refer to them, and the
+# classification itself is pinned by test_palette.py: changing it means a
+# migration reclassifying the stored codes. The hex value is only the
+# swatch shown for the class.
+WHITE, GREY, BLACK, RED, ORANGE, YELLOW, GREEN, TEAL, BLUE, PURPLE, PINK, BROWN = range(12)
+PALETTE = (
+    ('white', '#f5f5f5'),
+    ('grey', '#8c8c8c'),
+    ('black', '#1a1a1a'),
+    ('red', '#d32f2f'),
+    ('orange', '#f57c00'),
+    ('yellow', '#fbc02d'),
+    ('green', '#388e3c'),
+    ('teal', '#00897b'),
+    ('blue', '#1976d2'),
+    ('purple', '#7b1fa2'),
+    ('pink', '#ec407a'),
+    ('brown', '#795548'),
+)
+
+_BITS = 5
+_lut = None
+
+
+def color_name(code):
+    return PALETTE[code][0] if code is not None and 0 <= code < len(PALETTE) else 'unclassified'
+
+
+def color_swatch(code):
+    return PALETTE[code][1] if code is not None and 0 <= code < len(PALETTE) else '#ffffff'
+
+
+# Upper hue bound in degrees of each chromatic class; hues from 355 wrap to red
+_HUES = ((15, RED), (40, ORANGE), (70, YELLOW), (160, GREEN), (195, TEAL), (255, BLUE), (320, PURPLE),
+         (355, PINK), (360, RED))
+
+
+def lookup_table():
+    """The (32, 32, 32) uint8 table of palette codes, indexed by 5-bit R, G, B. Built once."""
+    global _lut
+    if _lut is None:
+        import cv2
+        import numpy as np
+
+        levels = ((np.arange(1 << _BITS) << (8 - _BITS)) + (1 << (7 - _BITS))) / 255  # bin centres
+        r, g, b = np.meshgrid(levels, levels, levels, indexing='ij')
+        rgb = np.stack([r, g, b], axis=-1).reshape(-1, 1, 3).astype(np.float32)
+        hsv = cv2.cvtColor(rgb, cv2.COLOR_RGB2HSV).reshape(-1, 3)
+        hue, saturation, value = hsv[:, 0], hsv[:, 1], hsv[:, 2]
+
+        codes = np.full(len(hsv), RED, dtype=np.uint8)
+        for bound, code in reversed(_HUES):
+            codes[hue < bound] = code
+        codes[(hue >= 8) & (hue < 45) & (value < 0.6)] = BROWN
+        grey = saturation < 0.2
+        codes[grey] = GREY
+        codes[grey & (value > 0.8)] = WHITE
+        codes[(grey & (value < 0.25)) | (value < 0.15)] = BLACK
+        _lut = codes.reshape((1 << _BITS,) * 3)
+    return _lut
+
+
+def classify(bgr):
+    """Palette codes for an (N, 3) array of BGR colours, e.g. cv2.mean results, in one table lookup."""
+    import numpy as np
+
+    bins = np.clip(np.asarray(bgr, dtype=np.float64).reshape(-1, 3), 0, 255).astype(np.uint8) >> (8 - _BITS)
+    return lookup_table()[bins[:, 2], bins[:, 1], bins[:, 0]]
+
+
+def classify_hex(colors):
+    """Palette codes for '#rrggbb' strings, as stored in Detection.color."""
+    bgr = [[int(color[i:i + 2], 16) for i in (5, 3, 1)] for color in colors]
+    return classify(bgr).tolist() if bgr else []
@@ -0,0 +1,142 @@
+from datetime import datetime
+from sqlalchemy import insert
+from app.database import db
+from app.models import Image, Detection
+
+# Perceptual hashes for spotting near-identical uploads, e.g. consecutive
+# microscope frames that differ only by sensor noise. The 64-bit DCT hash
+# is stored as a signed integer together with its four 16-bit bands: two
+# hashes within Hamming distance 3 share at least one band exactly, so
+# candidates come from an indexed equality lookup and only those few are
+# compared bit by bit.
+
+HASH_BITS = 64
+BANDS = 4
+BAND_BITS = HASH_BITS // BANDS
+_MASK = (1 << HASH_BITS) - 1
+# Side of the contrast-normalised image whose DCT is hashed
+PHASH_SIZE = 32
+# Images flatter than this (standard deviation in grey levels after
+# reduction) carry no structure to hash
+PHASH_MIN_CONTRAST = 0.5
+# Hashes with fewer set or clear bits than this say too little about the
+# image to match on
+MIN_BIT_BALANCE = 16
+
+
+def phash(image_path):
+    """
+    The 64-bit perceptual hash of an image, or None if it cannot be read or
+    has too little structure to be told apart from other images.
+
+    The image is decoded in greyscale, reduced to 32x32 by area averaging,
+    which smooths away sensor noise, and normalised to zero mean and unit
+    variance, so a sparse particle field counts as much as a busy one. Each
+    bit says whether one of the 63 lowest DCT frequencies (the constant
+    term excluded) is above their median, i.e. it describes where the
+    particles are rather than how bright the background is.
+    """
+    import cv2
+    import numpy as np
+
+    image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return None
+    small = cv2.resize(image.astype(np.float32), (PHASH_SIZE, PHASH_SIZE), interpolation=cv2.INTER_AREA)
+    spread = float(small.std())
+    if spread < PHASH_MIN_CONTRAST:
+        return None
+    coefficients = cv2.dct((small - small.mean()) / spread)[:8, :8].flatten()
+    bits = coefficients > np.median(coefficients[1:])
+    bits[0] = False
+    value = int(np.packbits(bits).view('>u8')[0])
+    return to_signed(value) if is_informative(value) else None
+
+
+def is_informative(value):
+    """Whether a hash has enough set and clear bits to be matched on."""
+    ones = (value & _MASK).bit_count()
+    return MIN_BIT_BALANCE <= ones <= HASH_BITS - MIN_BIT_BALANCE
+
+
+def to_signed(value):
+    """Maps an unsigned 64-bit hash onto the range of a signed BIGINT column."""
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def hash_bands(value):
+    """The four 16-bit bands of a hash, lowest first."""
+    value &= _MASK
+    return [(value >> (BAND_BITS * i)) & ((1 << BAND_BITS) - 1) for i in range(BANDS)]
+
+
+def hamming(a, b):
+    return ((a ^ b) & _MASK).bit_count()
+
+
+def band_columns(value):
+    """Column values for Image.phash and its band columns."""
+    if value is None:
+        return dict(phash=None, **{f'phash_band{i}': None for i in range(BANDS)})
+    return dict(phash=value, **{f'phash_band{i}': band for i, band in enumerate(hash_bands(value))})
+
+
+def find_near_duplicate(sample_id, value, max_distance, tier=None, exclude_id=None):
+    """
+    Finds the closest processed image of a sample within ``max_distance``
+    bits of ``value``, analysed with detector ``tier`` if one is given.
+
+    Up to a distance of BANDS - 1 candidates are found through the band
+    indexes; larger distances compare every hashed image of the sample.
+
+    Returns:
+        tuple: (Image, Hamming distance), or None if there is no such image.
+    """
+    if value is None or not is_informative(value):
+        return None
+    query = (db.session.query(Image.id, Image.phash)
+             .filter(Image.sample_id == sample_id, Image.status == 'processed', Image.phash.isnot(None)))
+    if tier is not None:
+        query = query.filter(Image.detector_tier == tier)
+    if exclude_id is not None:
+        query = query.filter(Image.id != exclude_id)
+    if max_distance < BANDS:
+        query = query.filter(db.or_(*[getattr(Image, f'phash_band{i}') == band
+                                      for i, band in enumerate(hash_bands(value))]))
+    best = None
+    for image_id, other in query:
+        # Degenerate hashes never match anything
+        if not is_informative(other):
+            continue
+        distance = hamming(value, other)
+        if distance <= max_distance and (best is None or (distance, image_id) < best):
+            best = (distance, image_id)
+    return None if best is None else (db.session.get(Image, best[1]), best[0])
+
+
+def apply_policy(image, original, policy):
+    """
+    Settles an upload that is a near duplicate of ``original`` without
+    running detection on it. With the 'reuse' policy the image gets copies
+    of the original's detections and contours; with 'mark' it is flagged as
+    a duplicate and keeps no detections of its own.
+
+    Returns:
+        int: Number of detections added.
+    """
+    image.duplicate_of = original
+    image.detector_tier = original.detector_tier
+    if policy != 'reuse':
+        image.status = 'duplicate'
+        return 0
+
+    image.status = 'processed'
+    image.contours = original.contours
+    image.size_sketch = original.size_sketch
+    columns = ['x_coordinate', 'y_coordinate', 'size', 'shape', 'color', 'color_code']
+    # Copied in id order, so the contour blob still lines up with the detections
+    rows = (db.select(*[getattr(Detection, column) for column in columns],
+                      db.literal(image.id), db.literal(datetime.utcnow()))
+            .where(Detection.image_id == original.id).order_by(Detection.id))
+    result = db.session.execute(insert(Detection).from_select(columns + ['image_id', 'timestamp'], rows))
+    return result.rowcount
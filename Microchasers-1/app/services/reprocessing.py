@@ -0,0 +1,146 @@
+import json
+import os
+from concurrent.futures import Future
+from flask import current_app
+from sqlalchemy import insert, update
+from app import caching
+from app.database import db
+from app.models import Image, Detection, Sample, User
+from app.services import counters, perceptual, storage
+from app.services.detection_pool import analyse_image
+
+# Re-running detection over stored images. Images are walked in id order,
+# one chunk at a time: while the pool analyses the next chunk, the results
+# of the current one replace its detections in a single transaction, after
+# which the last id is written to a checkpoint file.
+
+
+def image_query(sample_id=None, username=None, since=None, until=None):
+    # Videos are left alone: their detections are tracks, not one frame's particles
+    query = Image.query.filter(Image.frame_count.is_(None))
+    if sample_id is not None:
+        query = query.filter(Image.sample_id == sample_id)
+    if username is not None:
+        query = query.join(Image.sample).join(Sample.author).filter(User.username == username)
+    if since is not None:
+        query = query.filter(Image.timestamp >= since)
+    if until is not None:
+        query = query.filter(Image.timestamp < until)
+    return query
+
+
+def load_checkpoint(path, filters):
+    """The last image id done by an earlier run with the same filters, or 0."""
+    try:
+        with open(path) as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    return checkpoint['last_id'] if checkpoint.get('filters') == filters else 0
+
+
+def save_checkpoint(path, filters, last_id):
+    # Written to the side and renamed, so a crash never leaves half a file
+    temp = path + '.tmp'
+    with open(temp, 'w') as f:
+        json.dump({'filters': filters, 'last_id': last_id}, f)
+    os.replace(temp, path)
+
+
+def _submit(executor, images, derivatives_root, tier):
+    submitted = []
+    for image_id, original_filepath, filepath, image_tier in images:
+        image_tier = tier or image_tier or 'standard'
+        # Never the copy with overlays drawn in, that would measure the drawing
+        source = storage.analysis_source(original_filepath, filepath)
+        if source is None:
+            future = Future()
+            future.set_result({'detections': None})
+        else:
+            future = executor.submit(analyse_image, storage.resolve(source), derivatives_root, image_tier)
+        submitted.append((image_id, image_tier, future))
+    return submitted
+
+
+def _result(image_id, future):
+    # An analysis that raised (a cv2 error, out of memory, a broken pool)
+    # counts as failed like an unreadable image, and the run carries on
+    try:
+        return future.result()
+    except Exception as exc:
+        current_app.logger.error('Reprocessing image %d failed: %r', image_id, exc)
+        return {'detections': None}
+
+
+def replace_detections(results):
+    """
+    Swaps in new detections for a chunk of images in the current transaction.
+
+    Args:
+        results (list): (image id, detector tier, analysis) triples, with the
+            analysis as returned by analyse_image. Images that could not be
+            read, or have no original, keep their existing detections.
+
+    Returns:
+        tuple: Number of images replaced and number that failed.
+    """
+    done = [result for result in results if result[2]['detections'] is not None]
+    if not done:
+        return 0, len(results)
+    ids = [image_id for image_id, _, _ in done]
+
+    removed = Detection.query.filter(Detection.image_id.in_(ids)).delete(synchronize_session=False)
+    rows = [dict(det, image_id=image_id) for image_id, _, analysis in done for det in analysis['detections']]
+    if rows:
+        db.session.execute(insert(Detection), rows)
+    db.session.execute(update(Image), [
+        dict(perceptual.band_columns(analysis['phash']), id=image_id, status='processed',
+             content_hash=analysis['content_hash'], contours=analysis['contours'],
+             size_sketch=analysis['size_sketch'], detector_tier=tier,
+             duplicate_of_id=None)
+        for image_id, tier, analysis in done])
+    counters.adjust(detections=len(rows) - removed)
+    caching.bump_versions(ids)
+    counters.recount_samples([sample_id for (sample_id,) in db.session.query(Image.sample_id)
+                              .filter(Image.id.in_(ids)).distinct()])
+    return len(done), len(results) - len(done)
+
+
+def reprocess(executor, derivatives_root, query, checkpoint_path, filters, chunk_size=100,
+              resume=True, progress=None, tier=None):
+    """
+    Re-analyses every image matched by ``query`` and replaces its detections,
+    with the detector tier each image was analysed with unless ``tier`` is given.
+
+    Returns:
+        dict: 'processed' and 'failed' image counts and the id 'resumed_after'.
+    """
+    last_id = load_checkpoint(checkpoint_path, filters) if resume else 0
+    totals = {'processed': 0, 'failed': 0, 'resumed_after': last_id}
+
+    def next_chunk(after):
+        rows = (query.with_entities(Image.id, Image.original_filepath, Image.filepath, Image.detector_tier)
+                .filter(Image.id > after).order_by(Image.id).limit(chunk_size).all())
+        return [tuple(row) for row in rows]
+
+    chunk = next_chunk(last_id)
+    pending = _submit(executor, chunk, derivatives_root, tier)
+    while pending:
+        # Queue up the next chunk before writing this one, so the pool stays busy
+        following = next_chunk(chunk[-1][0])
+        queued = _submit(executor, following, derivatives_root, tier)
+
+        results = [(image_id, image_tier, _result(image_id, future)) for image_id, image_tier, future in pending]
+        processed, failed = replace_detections(results)
+        db.session.commit()
+        save_checkpoint(checkpoint_path, filters, chunk[-1][0])
+        totals['processed'] += processed
+        totals['failed'] += failed
+        if progress:
+            progress(totals)
+
+        chunk, pending = following, queued
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return totals
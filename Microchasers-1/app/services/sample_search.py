@@ -0,0 +1,65 @@
+from datetime import datetime, time, timedelta
+import sqlalchemy as sa
+from app.database import db
+from app.models import Sample, SensorReading
+
+# Searching and filtering one user's samples. On SQLite, names are indexed
+# in an FTS5 table with the trigram tokenizer (created by migration
+# 5b8e2d4f1c70 and kept in step with the sample table by triggers), which
+# answers case-insensitive substring searches of three or more characters
+# without scanning every name. Shorter terms, and databases without the
+# table, fall back to LIKE over the user's samples. Particle counts are
+# filtered on Sample.detection_count, so no detection is ever touched.
+
+FTS_TABLE = 'sample_name_fts'
+_fts = sa.table(FTS_TABLE, sa.column('rowid'), sa.column(FTS_TABLE))
+
+
+def has_fts():
+    """Whether the name index exists in this database."""
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    return db.session.execute(sa.text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                              {'name': FTS_TABLE}).first() is not None
+
+
+def _escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def search_samples(user, text=None, start=None, end=None, min_particles=None, max_particles=None):
+    """
+    A query for ``user``'s samples matching every given filter, newest first.
+
+    Args:
+        text (str): Part of the sample name, matched case-insensitively.
+        start, end (date): First and last day the sample was created on.
+        min_particles, max_particles (int): Bounds on the sample's detections.
+    """
+    query = Sample.query.filter(Sample.user_id == user.id)
+    text = (text or '').strip()
+    if text:
+        if len(text) >= 3 and has_fts():
+            # A quoted phrase: the term's trigrams must all occur in order
+            phrase = '"' + text.replace('"', '""') + '"'
+            query = query.filter(Sample.id.in_(sa.select(_fts.c.rowid).where(_fts.c[FTS_TABLE].op('MATCH')(phrase))))
+        else:
+            query = query.filter(Sample.name.ilike(f'%{_escape_like(text)}%', escape='\\'))
+    if start is not None:
+        query = query.filter(Sample.timestamp >= datetime.combine(start, time.min))
+    if end is not None:
+        query = query.filter(Sample.timestamp < datetime.combine(end + timedelta(days=1), time.min))
+    if min_particles is not None:
+        query = query.filter(Sample.detection_count >= min_particles)
+    if max_particles is not None:
+        query = query.filter(Sample.detection_count <= max_particles)
+    return query.order_by(Sample.timestamp.desc(), Sample.id.desc())
+
+
+def reading_counts(samples):
+    """Sensor reading counts of the listed samples, in one grouped query."""
+    ids = [sample.id for sample in samples]
+    if not ids:
+        return {}
+    return dict(db.session.query(SensorReading.sample_id, db.func.count(SensorReading.id))
+                .filter(SensorReading.sample_id.in_(ids)).group_by(SensorReading.sample_id))
@@ -0,0 +1,202 @@
+import errno
+import hashlib
+import os
+import shutil
+import uuid
+from flask import current_app
+from sqlalchemy import event, update
+from app.database import db
+from app.models import Image, StoredFile
+from app.services.derivatives import derivative_dir
+
+# Files are stored as <root>/<aa>/<bb>/<sha256><ext>, so no directory ever
+# holds more than a few hundred entries and identical content shares a path.
+
+
+def resolve(filepath):
+    """Absolute path of a static-relative ``Image.filepath``."""
+    return os.path.join(current_app.static_folder, filepath)
+
+
+def analysis_source(original_filepath, filepath):
+    """
+    The static-relative path of the unannotated image to run detection on,
+    or None if there is none. Images stored before the original was kept
+    only reference the copy with overlays drawn in (``<name>_processed``);
+    their original is recovered from that naming convention if it exists.
+    """
+    if original_filepath:
+        return original_filepath
+    name, ext = os.path.splitext(filepath)
+    if not name.endswith('_processed'):
+        return filepath
+    original = name[:-len('_processed')] + ext
+    return original if os.path.exists(resolve(original)) else None
+
+
+def relative_path(digest, ext):
+    return '/'.join([current_app.config['UPLOAD_URL_PREFIX'], digest[:2], digest[2:4], digest + ext.lower()])
+
+
+def _hash_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def temp_path(ext=''):
+    """
+    A scratch location for a file on its way into the store. It is outside
+    the static folder, so partial or rejected uploads are never served; on
+    the store's filesystem files are moved in with a rename, elsewhere they
+    are copied.
+    """
+    tmp_dir = current_app.config['UPLOAD_TEMP_FOLDER']
+    os.makedirs(tmp_dir, exist_ok=True)
+    return os.path.join(tmp_dir, uuid.uuid4().hex + ext)
+
+
+def add_ref(filepath, digest, size):
+    # One upsert, so concurrent workers storing the same content never both insert
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+
+        statement = insert(StoredFile).values(path=filepath, digest=digest, size=size, refcount=1)
+        statement = statement.on_duplicate_key_update(refcount=StoredFile.refcount + 1)
+    else:
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+
+        statement = insert(StoredFile).values(path=filepath, digest=digest, size=size, refcount=1)
+        statement = statement.on_conflict_do_update(index_elements=[StoredFile.path],
+                                                    set_={'refcount': StoredFile.refcount + 1})
+    db.session.execute(statement)
+
+
+def retain(filepath, count=1):
+    """Takes ``count`` more references on a file that is already stored."""
+    if count:
+        StoredFile.query.filter_by(path=filepath).update(
+            {StoredFile.refcount: StoredFile.refcount + count}, synchronize_session=False)
+
+
+def _copy_into(path, target):
+    # Copied beside the target and renamed, so it appears complete or not at all
+    side = f'{target}.{uuid.uuid4().hex}.tmp'
+    shutil.copyfile(path, side)
+    os.replace(side, target)
+
+
+def store_file(path, ext=None, move=True):
+    """
+    Adds a file to the content-addressed store and takes a reference on it.
+
+    Args:
+        path (str): The file to store.
+        ext (str): Extension to store it under, defaults to the file's own.
+        move (bool): Move the file into the store instead of copying it.
+
+    Returns:
+        str: The static-relative path to record in ``Image.filepath``.
+    """
+    ext = ext if ext is not None else os.path.splitext(path)[1]
+    digest = _hash_file(path)
+    filepath = relative_path(digest, ext)
+    target = resolve(filepath)
+
+    if os.path.exists(target):
+        # Identical content is already stored, keep the existing copy.
+        if move:
+            os.remove(path)
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if not move:
+            _copy_into(path, target)
+        else:
+            try:
+                os.replace(path, target)
+            except OSError as exc:
+                if exc.errno != errno.EXDEV:
+                    raise
+                # The scratch directory is on another filesystem
+                _copy_into(path, target)
+                os.remove(path)
+
+    add_ref(filepath, digest, os.path.getsize(target))
+    return filepath
+
+
+def save_upload(file_storage):
+    """Stores an uploaded ``FileStorage`` and returns its static-relative path."""
+    ext = os.path.splitext(file_storage.filename or '')[1]
+    tmp = temp_path(ext)
+    file_storage.save(tmp)
+    return store_file(tmp, ext)
+
+
+def release(filepath):
+    """
+    Drops a reference to a stored file. The file is deleted once the last
+    reference is gone and the surrounding transaction has committed.
+    """
+    if not filepath:
+        return
+    # Decremented in SQL, never read and written back, so concurrent releases all count
+    db.session.execute(update(StoredFile).where(StoredFile.path == filepath)
+                       .values(refcount=StoredFile.refcount - 1))
+    if StoredFile.query.filter(StoredFile.path == filepath, StoredFile.refcount <= 0).delete(
+            synchronize_session=False):
+        db.session.info.setdefault('storage_unlink', []).append(resolve(filepath))
+
+
+def release_image(image):
+    """
+    Drops the references of an image that is about to be deleted. Once no
+    other image shows the same content, the derivatives rendered from it
+    are deleted too, after the commit like the files.
+    """
+    release(image.filepath)
+    if image.original_filepath != image.filepath:
+        release(image.original_filepath)
+    if image.stack_filepath not in (image.filepath, image.original_filepath):
+        release(image.stack_filepath)
+    if image.content_hash and db.session.query(Image.id).filter(
+            Image.content_hash == image.content_hash, Image.id != image.id).first() is None:
+        db.session.info.setdefault('storage_unlink', []).append(
+            derivative_dir(current_app.config['DERIVATIVES_FOLDER'], image.content_hash))
+
+
+def release_all():
+    """
+    Drops every stored file, and the derivatives rendered from the images,
+    when all data is cleared. Like release, nothing is deleted before the
+    surrounding transaction has committed; call it before deleting images.
+    """
+    root = current_app.config['DERIVATIVES_FOLDER']
+    paths = [resolve(filepath) for (filepath,) in db.session.query(StoredFile.path)]
+    paths += [derivative_dir(root, digest) for (digest,) in
+              db.session.query(Image.content_hash).filter(Image.content_hash.isnot(None)).distinct()]
+    StoredFile.query.delete()
+    db.session.info.setdefault('storage_unlink', []).extend(paths)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _unlink_released(session):
+    for path in session.info.pop('storage_unlink', []):
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _keep_released(session):
+    session.info.pop('storage_unlink', None)
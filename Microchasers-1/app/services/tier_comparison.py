@@ -0,0 +1,99 @@
+import statistics
+import time
+import numpy as np
+from app.models import DETECTOR_TIERS
+from app.services.image_processing import detect_microplastics
+
+# Compares every detector tier against 'standard' on a set of reference
+# images: how much faster it is, and how well its detections agree.
+
+
+def match_detections(reference, candidate, tolerance):
+    """
+    Pairs detections whose centroids are at most ``tolerance`` pixels apart,
+    closest pairs first, each detection used at most once.
+
+    Returns:
+        list: (reference index, candidate index) pairs.
+    """
+    if not reference or not candidate:
+        return []
+    ref = np.array([(d['x_coordinate'], d['y_coordinate']) for d in reference], dtype=np.float64)
+    cand = np.array([(d['x_coordinate'], d['y_coordinate']) for d in candidate], dtype=np.float64)
+    distances = np.hypot(ref[:, None, 0] - cand[None, :, 0], ref[:, None, 1] - cand[None, :, 1])
+    close_i, close_j = np.nonzero(distances <= tolerance)
+    order = np.argsort(distances[close_i, close_j], kind='stable')
+    used_ref, used_cand, pairs = set(), set(), []
+    for i, j in zip(close_i[order].tolist(), close_j[order].tolist()):
+        if i not in used_ref and j not in used_cand:
+            used_ref.add(i)
+            used_cand.add(j)
+            pairs.append((i, j))
+    return pairs
+
+
+def _timed(path, tier, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        detections = detect_microplastics(path, tier)
+        timings.append(time.perf_counter() - start)
+    return detections, statistics.median(timings)
+
+
+def compare_tiers(paths, repeat=3, tolerance=5.0):
+    """
+    Runs every tier over ``paths``.
+
+    Returns:
+        dict: Per tier: 'seconds' (sum of per-image medians), 'speedup' over
+              standard, 'detections', and against standard's detections:
+              'precision', 'recall', 'f1', 'shape_agreement' of matched pairs
+              and their 'size_error' (mean relative difference), and the
+              number of images the tier 'failed' to read. Images standard
+              cannot read are left out altogether.
+    """
+    totals = {tier: {'seconds': 0.0, 'detections': 0, 'matched': 0, 'same_shape': 0, 'size_errors': [], 'failed': 0}
+              for tier in DETECTOR_TIERS}
+    reference_count = 0
+    images = 0
+    for path in paths:
+        reference, seconds = _timed(path, 'standard', repeat)
+        if reference is None:
+            continue
+        images += 1
+        reference_count += len(reference)
+        totals['standard']['seconds'] += seconds
+        for tier in DETECTOR_TIERS:
+            if tier == 'standard':
+                detections = reference
+            else:
+                detections, seconds = _timed(path, tier, repeat)
+                if detections is None:
+                    totals[tier]['failed'] += 1
+                    continue
+                totals[tier]['seconds'] += seconds
+            pairs = match_detections(reference, detections, tolerance)
+            totals[tier]['detections'] += len(detections)
+            totals[tier]['matched'] += len(pairs)
+            totals[tier]['same_shape'] += sum(reference[i]['shape'] == detections[j]['shape'] for i, j in pairs)
+            totals[tier]['size_errors'] += [abs(detections[j]['size'] - reference[i]['size']) / reference[i]['size']
+                                            for i, j in pairs if reference[i]['size']]
+
+    report = {'images': images}
+    baseline = totals['standard']['seconds']
+    for tier, t in totals.items():
+        precision = t['matched'] / t['detections'] if t['detections'] else 1.0
+        recall = t['matched'] / reference_count if reference_count else 1.0
+        report[tier] = {
+            'seconds': t['seconds'],
+            'speedup': baseline / t['seconds'] if t['seconds'] else 0.0,
+            'detections': t['detections'],
+            'precision': precision,
+            'recall': recall,
+            'f1': 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+            'shape_agreement': t['same_shape'] / t['matched'] if t['matched'] else 1.0,
+            'size_error': statistics.mean(t['size_errors']) if t['size_errors'] else 0.0,
+            'failed': t['failed'],
+        }
+    return report
@@ -0,0 +1,199 @@
+import struct
+
+# Multi-page TIFF stacks (e.g. 16-bit microscope z-stacks), read one page at
+# a time. The page directory chain is parsed up front, which only touches
+# the small IFDs; an uncompressed page stored in contiguous strips is then
+# memory-mapped rather than read, and any other page (compressed, tiled,
+# palette) is decoded alone through OpenCV. Either way a page is only read
+# when asked for, so peak memory follows the page size, not the stack size.
+
+TIFF_EXTENSIONS = {'.tif', '.tiff'}
+
+_TYPES = {1: 'B', 3: 'H', 4: 'I', 16: 'Q'}  # BYTE, SHORT, LONG, LONG8
+_SAMPLE_FORMATS = {1: 'u', 2: 'i', 3: 'f'}
+IMAGE_WIDTH, IMAGE_LENGTH, BITS_PER_SAMPLE, COMPRESSION = 256, 257, 258, 259
+PHOTOMETRIC, STRIP_OFFSETS, SAMPLES_PER_PIXEL, STRIP_BYTE_COUNTS = 262, 273, 277, 279
+PLANAR_CONFIG, TILE_OFFSETS, SAMPLE_FORMAT = 284, 324, 339
+
+
+class TiffPage:
+    """Layout of one page, as needed to map it. Plain data, so it can be sent to pool processes."""
+
+    def __init__(self, index, byte_order, tags):
+        self.index = index
+        self.byte_order = byte_order
+        self.width = tags[IMAGE_WIDTH][0]
+        self.height = tags[IMAGE_LENGTH][0]
+        self.bits = tags.get(BITS_PER_SAMPLE, [1])[0]
+        self.samples = tags.get(SAMPLES_PER_PIXEL, [1])[0]
+        self.compression = tags.get(COMPRESSION, [1])[0]
+        self.photometric = tags.get(PHOTOMETRIC, [1])[0]
+        self.planar = tags.get(PLANAR_CONFIG, [1])[0]
+        self.sample_format = _SAMPLE_FORMATS.get(tags.get(SAMPLE_FORMAT, [1])[0])
+        self.tiled = TILE_OFFSETS in tags
+        self.offsets = tags.get(STRIP_OFFSETS, [])
+        self.byte_counts = tags.get(STRIP_BYTE_COUNTS, [])
+
+    @property
+    def dtype(self):
+        if self.sample_format is None or self.bits not in (8, 16, 32, 64):
+            return None
+        return f'{self.byte_order}{self.sample_format}{self.bits // 8}'
+
+    @property
+    def mappable(self):
+        """Whether the pixels lie uncompressed and contiguous in the file, in a layout numpy can view."""
+        if (self.compression != 1 or self.tiled or self.dtype is None or not self.offsets
+                or (self.samples > 1 and self.planar != 1) or self.photometric not in (1, 2)):
+            return False
+        for offset, count, following in zip(self.offsets, self.byte_counts, self.offsets[1:]):
+            if offset + count != following:
+                return False
+        size = self.width * self.height * self.samples * self.bits // 8
+        return sum(self.byte_counts) >= size
+
+
+def _read_tags(f, byte_order, offset):
+    f.seek(offset)
+    (count,) = struct.unpack(byte_order + 'H', f.read(2))
+    entries = f.read(12 * count + 4)
+    tags = {}
+    for i in range(count):
+        tag, kind, number, value = struct.unpack_from(byte_order + 'HHI4s', entries, 12 * i)
+        if kind not in _TYPES:
+            continue
+        fmt = byte_order + _TYPES[kind] * number
+        size = struct.calcsize(fmt)
+        if size <= 4:
+            tags[tag] = list(struct.unpack(fmt, value[:size]))
+        else:
+            position = f.tell()
+            f.seek(struct.unpack(byte_order + 'I', value)[0])
+            tags[tag] = list(struct.unpack(fmt, f.read(size)))
+            f.seek(position)
+    (following,) = struct.unpack_from(byte_order + 'I', entries, 12 * count)
+    return tags, following
+
+
+def read_pages(f):
+    """
+    Parses the page directory chain of a classic (not Big) TIFF file object.
+
+    Returns:
+        list: A TiffPage per page, or None if this is not a TIFF file this
+              parser understands.
+    """
+    f.seek(0)
+    header = f.read(8)
+    if len(header) < 8 or header[:2] not in (b'II', b'MM'):
+        return None
+    byte_order = '<' if header[:2] == b'II' else '>'
+    magic, offset = struct.unpack(byte_order + 'HI', header[2:])
+    if magic != 42:
+        return None
+    pages, seen = [], set()
+    try:
+        while offset and offset not in seen:
+            seen.add(offset)
+            tags, following = _read_tags(f, byte_order, offset)
+            pages.append(TiffPage(len(pages), byte_order, tags))
+            offset = following
+    except (struct.error, KeyError, IndexError):
+        return None
+    return pages
+
+
+def first_page_dimensions(stream):
+    """(width, height) of the first page of a TIFF stream, leaving its position unchanged, or None."""
+    position = stream.tell()
+    try:
+        header = stream.read(8)
+        if len(header) < 8 or header[:2] not in (b'II', b'MM'):
+            return None
+        byte_order = '<' if header[:2] == b'II' else '>'
+        magic, offset = struct.unpack(byte_order + 'HI', header[2:])
+        if magic != 42:
+            return None
+        tags, _ = _read_tags(stream, byte_order, offset)
+        return tags[IMAGE_WIDTH][0], tags[IMAGE_LENGTH][0]
+    except (OSError, struct.error, KeyError, IndexError):
+        return None
+    finally:
+        stream.seek(position)
+
+
+def list_pages(path):
+    """
+    The pages of a stack: TiffPage layouts where the directory chain could
+    be parsed, otherwise plain page indexes for OpenCV to decode.
+    """
+    with open(path, 'rb') as f:
+        pages = read_pages(f)
+    if pages is not None:
+        return pages
+    import cv2
+
+    return list(range(cv2.imcount(path)))
+
+
+def read_page(path, page):
+    """
+    One page of a stack, memory-mapped where its layout allows.
+
+    Args:
+        page: A TiffPage from list_pages, or a page index.
+
+    Returns:
+        numpy.ndarray: The page at its stored bit depth, greyscale or BGR
+            like OpenCV, or None if it cannot be read.
+    """
+    import numpy as np
+
+    if isinstance(page, TiffPage) and page.mappable:
+        shape = (page.height, page.width) if page.samples == 1 else (page.height, page.width, page.samples)
+        pixels = np.memmap(path, dtype=page.dtype, mode='r', offset=page.offsets[0], shape=shape)
+        if page.samples >= 3:
+            pixels = pixels[..., 2::-1]  # RGB(A) to BGR, still a view of the mapping
+        return pixels
+
+    import cv2
+
+    index = page.index if isinstance(page, TiffPage) else page
+    ok, images = cv2.imreadmulti(path, start=index, count=1, flags=cv2.IMREAD_ANYDEPTH | cv2.IMREAD_ANYCOLOR)
+    return images[0] if ok and images else None
+
+
+def to_8bit(pixels, low_percentile=0.1, high_percentile=99.9):
+    """
+    Normalises a page of any bit depth to 8-bit BGR for detection.
+
+    Deeper pages are stretched per page between two percentiles of their
+    values, estimated from a strided subsample, so a dim page and a bright
+    page of the same stack both use the full 8-bit range. 16-bit pages go
+    through a lookup table, which never materialises a float copy.
+    """
+    import cv2
+    import numpy as np
+
+    if pixels.dtype == np.uint8:
+        image = np.ascontiguousarray(pixels)
+    else:
+        step = max(1, int((pixels.shape[0] * pixels.shape[1] / 1e6) ** 0.5))
+        sample = np.asarray(pixels[::step, ::step], dtype=np.float64)
+        low, high = np.percentile(sample, [low_percentile, high_percentile])
+        if high <= low:
+            high = low + 1
+        if pixels.dtype.kind == 'u' and pixels.dtype.itemsize == 2:
+            levels = np.arange(65536, dtype=np.float64)
+            lut = np.clip((levels - low) * (255.0 / (high - low)), 0, 255).astype(np.uint8)
+            image = lut[pixels]
+        else:
+            image = np.empty(pixels.shape, dtype=np.uint8)
+            for start in range(0, pixels.shape[0], 256):  # a band of rows at a time
+                rows = np.asarray(pixels[start:start + 256], dtype=np.float32)
+                image[start:start + 256] = np.clip((rows - low) * (255.0 / (high - low)), 0, 255)
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    if image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+    return np.ascontiguousarray(image[..., :3])
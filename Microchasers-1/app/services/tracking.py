@@ -0,0 +1,139 @@
+import math
+
+# Linking detections across the frames of a video into tracks, one per
+# physical particle. Live tracks are kept in a spatial hash of square cells
+# at least MAX_DISTANCE wide, keyed by where each track is expected next
+# (its last position moved on by its last velocity), so a detection is only
+# compared against the tracks in its own and the eight neighbouring cells
+# rather than against every live track. Within a frame, candidate pairs are
+# taken nearest first, so each track and each detection is used once.
+#
+# Track points are stored as one blob (Track.points): little-endian
+# (frame uint32, x float32, y float32, size float32) records.
+
+_POINT_DTYPE = [('frame', '<u4'), ('x', '<f4'), ('y', '<f4'), ('size', '<f4')]
+
+
+class ParticleTrack:
+    """One particle followed over frames, with the detection seen in each."""
+
+    def __init__(self, frame, detection):
+        self.frames = [frame]
+        self.detections = [detection]
+        self.velocity = (0.0, 0.0)
+
+    @property
+    def first_frame(self):
+        return self.frames[0]
+
+    @property
+    def last_frame(self):
+        return self.frames[-1]
+
+    def predicted(self, frame):
+        """Where the particle is expected in ``frame``, moving at its last velocity."""
+        last = self.detections[-1]
+        steps = frame - self.frames[-1]
+        return last['x_coordinate'] + self.velocity[0] * steps, last['y_coordinate'] + self.velocity[1] * steps
+
+    def extend(self, frame, detection):
+        last = self.detections[-1]
+        steps = frame - self.frames[-1]
+        self.velocity = ((detection['x_coordinate'] - last['x_coordinate']) / steps,
+                         (detection['y_coordinate'] - last['y_coordinate']) / steps)
+        self.frames.append(frame)
+        self.detections.append(detection)
+
+    def representative(self):
+        """The observation of median size, which stands for the particle when it is stored."""
+        order = sorted(range(len(self.detections)), key=lambda i: self.detections[i]['size'])
+        return self.detections[order[len(order) // 2]]
+
+    def encode_points(self):
+        import numpy as np
+
+        points = np.empty(len(self.frames), dtype=_POINT_DTYPE)
+        points['frame'] = self.frames
+        points['x'] = [det['x_coordinate'] for det in self.detections]
+        points['y'] = [det['y_coordinate'] for det in self.detections]
+        points['size'] = [det['size'] for det in self.detections]
+        return points.tobytes()
+
+
+def decode_points(blob):
+    """The points of an encoded track, as a structured array with frame, x, y and size fields."""
+    import numpy as np
+
+    return np.frombuffer(blob or b'', dtype=_POINT_DTYPE)
+
+
+class SpatialHashTracker:
+    """
+    Nearest-neighbour tracker over a spatial hash.
+
+    Args:
+        max_distance (float): Furthest, in pixels, a particle may be from
+            where it was expected to be and still continue its track.
+        max_gap (int): Frames a track may go unseen before it is finished.
+    """
+
+    def __init__(self, max_distance=20.0, max_gap=2):
+        self.max_distance = max_distance
+        self.max_gap = max_gap
+        self.cell_size = max_distance
+        self._live = []
+
+    def _cell(self, x, y):
+        return int(x // self.cell_size), int(y // self.cell_size)
+
+    def update(self, frame, detections):
+        """
+        Adds the detections of the next frame.
+
+        Returns:
+            list: Tracks finished by this frame, i.e. unseen for more than
+                  ``max_gap`` frames. Their particles can be stored now.
+        """
+        grid = {}
+        for index, track in enumerate(self._live):
+            grid.setdefault(self._cell(*track.predicted(frame)), []).append(index)
+
+        pairs = []
+        limit = self.max_distance ** 2
+        for d, det in enumerate(detections):
+            cx, cy = self._cell(det['x_coordinate'], det['y_coordinate'])
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    for index in grid.get((cx + dx, cy + dy), ()):
+                        px, py = self._live[index].predicted(frame)
+                        distance = (det['x_coordinate'] - px) ** 2 + (det['y_coordinate'] - py) ** 2
+                        if distance <= limit:
+                            pairs.append((distance, index, d))
+
+        pairs.sort()
+        taken_tracks, taken_detections = set(), set()
+        for _, index, d in pairs:
+            if index in taken_tracks or d in taken_detections:
+                continue
+            self._live[index].extend(frame, detections[d])
+            taken_tracks.add(index)
+            taken_detections.add(d)
+
+        for d, det in enumerate(detections):
+            if d not in taken_detections:
+                self._live.append(ParticleTrack(frame, det))
+
+        finished = [track for track in self._live if frame - track.last_frame > self.max_gap]
+        self._live = [track for track in self._live if frame - track.last_frame <= self.max_gap]
+        return finished
+
+    def finish(self):
+        """Ends every live track, once the last frame has been added."""
+        finished, self._live = self._live, []
+        return finished
+
+
+def path_length(track):
+    """Distance in pixels a track covers from its first to its last point."""
+    return sum(math.dist((a['x_coordinate'], a['y_coordinate']), (b['x_coordinate'], b['y_coordinate']))
+               for a, b in zip(track.detections, track.detections[1:]))
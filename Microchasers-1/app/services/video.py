@@ -0,0 +1,223 @@
+import os
+import time
+from collections import deque
+from app.database import db
+from app.models import Image, Detection, Track
+from app.services import counters, perceptual, storage
+from app.services.detection_pool import detect_frame
+from app.services.tracking import SpatialHashTracker, path_length
+
+# Ingesting a flow-cell video, or a directory of frames, as one image of a
+# sample. The work is a chain of generators: frames are decoded one at a
+# time, detected in a process pool with at most ``in_flight`` frames
+# outstanding (results come back in frame order), and fed to a tracker
+# that links each particle's detections across frames. A particle is
+# stored once, as a Detection with its Track, as soon as its track ends,
+# so memory follows the number of particles in view rather than the length
+# of the video. The first frame is kept as the image shown for the video.
+
+VIDEO_EXTENSIONS = {'.mp4', '.avi', '.mov', '.mkv', '.m4v', '.webm'}
+SEQUENCE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff'}
+
+
+def iter_frames(source, step=1):
+    """
+    Decodes a video file, or the image files of a directory in name order.
+
+    Args:
+        step (int): Only every ``step``-th frame is yielded; the others
+            are skipped without being decoded where the format allows.
+
+    Yields:
+        tuple: (frame index, 8-bit BGR frame).
+    """
+    import cv2
+
+    if os.path.isdir(source):
+        from app.services.tiff_stack import to_8bit
+
+        names = sorted(name for name in os.listdir(source)
+                       if os.path.splitext(name)[1].lower() in SEQUENCE_EXTENSIONS)
+        for index in range(0, len(names), step):
+            frame = cv2.imread(os.path.join(source, names[index]), cv2.IMREAD_ANYDEPTH | cv2.IMREAD_ANYCOLOR)
+            if frame is not None:
+                yield index, to_8bit(frame)
+        return
+
+    capture = cv2.VideoCapture(source)
+    try:
+        index = 0
+        while True:
+            if index % step:
+                if not capture.grab():
+                    return
+            else:
+                ok, frame = capture.read()
+                if not ok:
+                    return
+                yield index, frame
+            index += 1
+    finally:
+        capture.release()
+
+
+def detect_frames(executor, frames, tier='standard', in_flight=8):
+    """
+    Runs detection on a stream of frames in ``executor``, several at once.
+
+    Yields:
+        tuple: (frame index, detections), in frame order.
+    """
+    pending = deque()
+    for index, frame in frames:
+        # Backpressure: never more than in_flight frames decoded ahead
+        while len(pending) >= in_flight:
+            done_index, future = pending.popleft()
+            yield done_index, future.result()
+        pending.append((index, executor.submit(detect_frame, frame, tier)))
+    while pending:
+        done_index, future = pending.popleft()
+        yield done_index, future.result()
+
+
+def _keep_first(frames, path):
+    """Passes frames through, writing the first one to ``path``."""
+    import cv2
+
+    for index, frame in frames:
+        if path is not None:
+            cv2.imwrite(path, frame)
+            path = None
+        yield index, frame
+
+
+class VideoIngest:
+    """
+    Ingests one video or frame directory into ``sample`` as a single image
+    whose detections are the tracked particles.
+
+    Args:
+        step (int): Analyse every ``step``-th frame only. Frame numbers
+            keep counting every frame, so the tracker's distance and gap
+            are scaled by it.
+        max_distance (float): See SpatialHashTracker, in pixels per frame.
+        max_gap (int): Analysed frames a particle may be missed and keep
+            its track.
+        min_frames (int): Tracks seen in fewer frames are dropped as noise.
+        batch_size (int): Particles per transaction.
+    """
+
+    def __init__(self, executor, sample, derivatives_root, tier=None, in_flight=8, step=1, max_distance=20.0,
+                 max_gap=2, min_frames=1, batch_size=500, progress=None):
+        self.executor = executor
+        self.sample = sample
+        self.derivatives_root = derivatives_root
+        self.tier = tier or sample.detector_tier or 'standard'
+        self.in_flight = in_flight
+        self.step = step
+        self.tracker = SpatialHashTracker(max_distance * step, max_gap * step)
+        self.min_frames = min_frames
+        self.batch_size = batch_size
+        # Called with the totals every 100 frames
+        self.progress = progress
+        self.image = None
+        self._contours = []
+        self._sizes = []
+        self._batch = 0
+        self.totals = {'frames': 0, 'particles': 0, 'observations': 0, 'dropped': 0}
+        self.started = time.perf_counter()
+
+    def run(self, source):
+        """
+        Ingests ``source``. Returns the totals, or None if the same video is
+        already an image of the sample.
+        """
+        stack_filepath = None
+        if os.path.isfile(source):
+            from app.services.derivatives import file_digest
+
+            stack_filepath = storage.relative_path(file_digest(source), os.path.splitext(source)[1])
+            if self.sample.images.filter(Image.stack_filepath == stack_filepath).first() is not None:
+                return None
+
+        poster = storage.temp_path('.png')
+        try:
+            frames = _keep_first(iter_frames(source, self.step), poster)
+            for index, detections in detect_frames(self.executor, frames, self.tier, self.in_flight):
+                if self.image is None:
+                    self._create_image(poster, source if stack_filepath else None)
+                self.totals['frames'] += 1
+                self.totals['observations'] += len(detections)
+                self._store(self.tracker.update(index, detections))
+                if self.progress and self.totals['frames'] % 100 == 0:
+                    self.progress(self.totals, time.perf_counter() - self.started)
+            self._store(self.tracker.finish())
+            if self.image is not None:
+                self._finish_image()
+        except BaseException:
+            # Interrupted or failed part way: the particles committed so far
+            # stay, but the image must not be left 'processing'
+            self._fail(poster)
+            raise
+        if self.image is None:
+            # Not a single frame could be decoded
+            return dict(self.totals, seconds=time.perf_counter() - self.started, image=None)
+        seconds = time.perf_counter() - self.started
+        return dict(self.totals, seconds=seconds, image=self.image)
+
+    def _fail(self, poster):
+        db.session.rollback()
+        if self.image is None:
+            if os.path.exists(poster):
+                os.remove(poster)
+            return
+        self.image.status = 'failed'
+        db.session.commit()
+
+    def _create_image(self, poster, video):
+        filepath = storage.store_file(poster)
+        stack_filepath = storage.store_file(video, move=False) if video is not None else None
+        self.image = Image(filepath=filepath, original_filepath=filepath, stack_filepath=stack_filepath,
+                           sample=self.sample, status='processing', detector_tier=self.tier, frame_count=0)
+        db.session.add(self.image)
+        counters.adjust(sample=self.sample, images=1)
+        db.session.commit()
+        self._poster = filepath
+
+    def _store(self, tracks):
+        for track in tracks:
+            if len(track.frames) < self.min_frames:
+                self.totals['dropped'] += 1
+                continue
+            det = dict(track.representative())
+            self._contours.append(det.pop('contour'))
+            self._sizes.append(det['size'])
+            detection = Detection(image=self.image, **det)
+            db.session.add(detection)
+            db.session.add(Track(detection=detection, image_id=self.image.id, first_frame=track.first_frame,
+                                 last_frame=track.last_frame, frame_count=len(track.frames),
+                                 path_length=path_length(track), points=track.encode_points()))
+            self.totals['particles'] += 1
+            self._batch += 1
+            if self._batch >= self.batch_size:
+                self._commit()
+
+    def _commit(self):
+        counters.adjust(sample=self.sample, detections=self._batch)
+        self.image.frame_count = self.totals['frames']
+        db.session.commit()
+        self._batch = 0
+
+    def _finish_image(self):
+        from app.services.derivatives import generate_derivatives
+        from app.services.geometry import encode_contours
+        from app.services.size_sketch import sketch_sizes
+
+        poster = storage.resolve(self._poster)
+        self.image.status = 'processed'
+        self.image.contours = encode_contours(self._contours)
+        self.image.size_sketch = sketch_sizes(self._sizes)
+        self.image.content_hash = generate_derivatives(poster, self.derivatives_root)
+        for column, value in perceptual.band_columns(perceptual.phash(poster)).items():
+            setattr(self.image, column, value)
+        self._commit()
@@ -0,0 +1,248 @@
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import stat as stat_module
+import struct
+import time
+from flask import current_app
+from app.services.importer import IMAGE_EXTENSIONS
+
+# Watching a folder for new images. Change notifications come from inotify
+# where the platform has it and from rescanning the folder otherwise; either
+# way a file is only handed on once its size and modification time have
+# stopped changing for a settle period, so half-written files are never read.
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class Inotify:
+    """Minimal inotify binding through libc, reporting names changed in one directory."""
+
+    def __init__(self, folder):
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            raise OSError('libc not found')
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError('inotify is not available')
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if libc.inotify_add_watch(self.fd, os.fsencode(folder), mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f'Cannot watch {folder}')
+
+    def wait(self, timeout):
+        """
+        Waits up to ``timeout`` seconds for changes.
+
+        Returns:
+            set: Changed file names, or None if events were lost and the
+                 folder has to be rescanned.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        names = set()
+        if not readable:
+            return names
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return names
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            if mask & IN_Q_OVERFLOW:
+                return None
+            names.add(os.fsdecode(data[offset:offset + length].rstrip(b'\0')))
+            offset += length
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Polling:
+    """Fallback for Inotify: reports every file on each rescan, ``interval`` seconds apart."""
+
+    def __init__(self, interval):
+        self.interval = interval
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        return None
+
+    def close(self):
+        pass
+
+
+class WatchState:
+    """
+    The files already handed on, persisted as a small JSON file.
+
+    Entries are keyed by file name and remember size and modification time,
+    so a file replaced under the same name is picked up again.
+    """
+
+    def __init__(self, path, sample_id):
+        self.path = path
+        self.sample_id = sample_id
+        self.files = {}
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        if state.get('sample_id') == sample_id:
+            self.files = state.get('files', {})
+
+    def seen(self, name, stat):
+        return self.files.get(name) == [stat.st_size, stat.st_mtime_ns]
+
+    def mark(self, name, stat):
+        self.files[name] = [stat.st_size, stat.st_mtime_ns]
+
+    def forget_missing(self, names):
+        for name in set(self.files) - set(names):
+            del self.files[name]
+
+    def save(self):
+        temp = self.path + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump({'sample_id': self.sample_id, 'files': self.files}, f)
+        os.replace(temp, self.path)
+
+
+class FolderWatcher:
+    """
+    Finds image files in ``folder`` once they are completely written.
+
+    Files recorded in ``state`` are skipped; everything else present at
+    start-up is picked up, so nothing written while the watcher was down is
+    missed.
+    """
+
+    def __init__(self, folder, state, settle=2.0, poll_interval=2.0, use_inotify=True):
+        self.folder = folder
+        self.state = state
+        self.settle = settle
+        self.source = None
+        if use_inotify:
+            try:
+                self.source = Inotify(folder)
+            except OSError:
+                self.source = None
+        self.inotify = self.source is not None
+        if self.source is None:
+            self.source = Polling(poll_interval)
+        # name -> (size, mtime_ns, time the file was last seen changing)
+        self._candidates = {}
+        # name -> stat of files handed on but not yet done
+        self._taken = {}
+        self._rescan()
+
+    def _stat(self, name):
+        try:
+            stat = os.stat(os.path.join(self.folder, name))
+        except OSError:
+            return None
+        return stat if stat_module.S_ISREG(stat.st_mode) else None
+
+    def _consider(self, names):
+        for name in names:
+            if (os.path.splitext(name)[1].lower() not in IMAGE_EXTENSIONS or name in self._candidates
+                    or name in self._taken):
+                continue
+            stat = self._stat(name)
+            if stat is not None and not self.state.seen(name, stat):
+                self._candidates[name] = (stat.st_size, stat.st_mtime_ns, time.monotonic())
+
+    def _rescan(self):
+        names = os.listdir(self.folder)
+        self.state.forget_missing(set(names) | set(self._taken))
+        self._consider(names)
+
+    def ready(self, timeout):
+        """
+        Waits up to ``timeout`` seconds for changes and returns the names of
+        files that have settled, oldest first.
+        """
+        if self._candidates:
+            timeout = min(timeout, self.settle / 2)
+        changed = self.source.wait(timeout)
+        if changed is None:
+            self._rescan()
+        else:
+            for name in changed & set(self._candidates):
+                # Still being written, restart its settle period
+                stat = self._stat(name)
+                if stat is not None:
+                    self._candidates[name] = (stat.st_size, stat.st_mtime_ns, time.monotonic())
+            self._consider(changed)
+
+        now = time.monotonic()
+        settled = []
+        for name, (size, mtime_ns, since) in list(self._candidates.items()):
+            stat = self._stat(name)
+            if stat is None:
+                del self._candidates[name]
+            elif (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+                self._candidates[name] = (stat.st_size, stat.st_mtime_ns, now)
+            elif now - since >= self.settle:
+                settled.append((since, name))
+        return [name for _, name in sorted(settled)]
+
+    def take(self, name):
+        """Hands on a settled file. Returns its path, or None if it vanished."""
+        self._candidates.pop(name, None)
+        stat = self._stat(name)
+        if stat is None:
+            return None
+        self._taken[name] = stat
+        return os.path.join(self.folder, name)
+
+    def done(self, name):
+        """Records a handed-on file in the state once its result is safely stored."""
+        stat = self._taken.pop(name, None)
+        if stat is not None:
+            self.state.mark(name, stat)
+            self.state.save()
+
+    def run(self, importer, sample_name, stop, timeout=0.5):
+        """
+        Feeds settled files to ``importer`` until ``stop()`` returns True.
+
+        Settled files wait in the folder while the importer has as many
+        analyses outstanding as it allows, so a burst of new files never
+        queues up more work than that in memory. The importer is expected
+        to call done once a file's images are committed; a file that cannot
+        be queued at all is done straight away, and never retried.
+        """
+        while not stop():
+            importer.collect()
+            for name in self.ready(timeout):
+                if importer.busy:
+                    break
+                path = self.take(name)
+                if path is None:
+                    continue
+                try:
+                    queued = importer.add(sample_name, path)
+                except Exception as exc:
+                    current_app.logger.error('Import of %s failed: %r', path, exc)
+                    queued = None
+                if not queued:
+                    # Already in the sample, nothing to import, or unreadable
+                    self.done(name)
+        importer.finish()
+
+    def close(self):
+        self.source.close()
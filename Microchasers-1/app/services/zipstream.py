@@ -0,0 +1,84 @@
+import os
+import time
+import zipfile
+
+# ZIP archives written while they are sent. zipfile is given a sink that
+# cannot seek, so every member is followed by a data descriptor instead of
+# having its header patched afterwards, and whatever has been written is
+# handed on after each chunk: no temporary file, and never more than one
+# chunk of the archive in memory.
+
+CHUNK_SIZE = 256 * 1024
+# Already compressed formats, stored as they are rather than deflated again
+STORED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.gif', '.zip', '.gz'}
+
+
+class _Sink:
+    """A write-only file object that collects what zipfile writes until drained."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _file_chunks(path, chunk_size):
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            yield chunk
+
+
+def stream_zip(members, chunk_size=CHUNK_SIZE):
+    """
+    Writes a ZIP archive on the fly.
+
+    Args:
+        members (iterable): (name in the archive, content) pairs, where the
+            content is a file path, bytes, or an iterable of bytes chunks
+            (e.g. encoded CSV rows), consumed only when the member is written.
+            Pairs whose content is None are skipped.
+
+    Yields:
+        bytes: The archive, piece by piece.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, mode='w') as archive:
+        for name, content in members:
+            if content is None:
+                continue
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            if os.path.splitext(name)[1].lower() in STORED_EXTENSIONS:
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+            if isinstance(content, (bytes, bytearray)):
+                info.file_size = len(content)
+                chunks = [content]
+            elif isinstance(content, (str, os.PathLike)):
+                info.file_size = os.path.getsize(content)
+                chunks = _file_chunks(content, chunk_size)
+            else:
+                chunks = content
+            info.external_attr = 0o644 << 16
+            # Members of unknown size get ZIP64 sizes, in case they pass 4 GiB
+            with archive.open(info, 'w', force_zip64=not info.file_size) as member:
+                for chunk in chunks:
+                    member.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    # The central directory
+    yield sink.drain()
@@ -0,0 +1,154 @@
+import bisect
+import threading
+import time
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from .database import db
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class EndpointStats:
+    __slots__ = ('count', 'errors', 'latency_sum', 'buckets', 'sql_count', 'sql_time', 'response_bytes')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.latency_sum = 0.0
+        # One counter per bucket plus the overflow (+Inf) bucket
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.response_bytes = 0
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'latency_avg_ms': round(self.latency_sum / self.count * 1000, 3) if self.count else 0,
+            # [upper bound in seconds, count] pairs, in bucket order
+            'latency_buckets': [[bound, count] for bound, count in zip(list(LATENCY_BUCKETS) + ['+Inf'], self.buckets)],
+            'sql_statements': self.sql_count,
+            'sql_statements_avg': round(self.sql_count / self.count, 2) if self.count else 0,
+            'sql_time_ms': round(self.sql_time * 1000, 3),
+            'response_bytes': self.response_bytes,
+        }
+
+
+class RequestMetrics:
+    """
+    Per-endpoint request statistics, aggregated in memory.
+
+    Each request costs one bisect and a few additions under a lock. Numbers
+    are per process: with several gunicorn workers every worker reports its
+    own share.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self.started = time.time()
+
+    def record(self, endpoint, status, latency, sql_count, sql_time, response_bytes):
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, latency)
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = EndpointStats()
+            stats.count += 1
+            if status >= 500:
+                stats.errors += 1
+            stats.latency_sum += latency
+            stats.buckets[bucket] += 1
+            stats.sql_count += sql_count
+            stats.sql_time += sql_time
+            stats.response_bytes += response_bytes
+
+    def snapshot(self):
+        with self._lock:
+            return {endpoint: stats.as_dict() for endpoint, stats in sorted(self._endpoints.items())}
+
+    def prometheus(self):
+        """Renders the statistics in the Prometheus text exposition format."""
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+            lines = [
+                '# HELP microchasers_request_duration_seconds Request latency by endpoint.',
+                '# TYPE microchasers_request_duration_seconds histogram',
+            ]
+            for endpoint, stats in endpoints:
+                cumulative = 0
+                for bound, count in zip(list(LATENCY_BUCKETS) + ['+Inf'], stats.buckets):
+                    cumulative += count
+                    lines.append(f'microchasers_request_duration_seconds_bucket'
+                                 f'{{endpoint="{endpoint}",le="{bound}"}} {cumulative}')
+                lines.append(f'microchasers_request_duration_seconds_sum{{endpoint="{endpoint}"}} {stats.latency_sum}')
+                lines.append(f'microchasers_request_duration_seconds_count{{endpoint="{endpoint}"}} {stats.count}')
+            for name, kind, help_text, attr in (
+                ('microchasers_request_errors_total', 'counter', 'Responses with a 5xx status.', 'errors'),
+                ('microchasers_sql_statements_total', 'counter', 'SQL statements executed.', 'sql_count'),
+                ('microchasers_sql_duration_seconds_total', 'counter', 'Time spent executing SQL.', 'sql_time'),
+                ('microchasers_response_bytes_total', 'counter', 'Response body bytes sent.', 'response_bytes'),
+            ):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                for endpoint, stats in endpoints:
+                    lines.append(f'{name}{{endpoint="{endpoint}"}} {getattr(stats, attr)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('trace_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['trace_query_start'].pop()
+    if has_request_context() and 'trace_start' in g:
+        g.trace_sql_count += 1
+        g.trace_sql_time += elapsed
+        if g.trace_statements is not None:
+            g.trace_statements.append((statement, elapsed))
+
+
+def init_app(app):
+    """
+    Records latency, SQL statement counts and time, and response sizes for
+    every request, keyed by endpoint. With SLOW_REQUEST_MS set, requests
+    slower than that are logged together with the SQL they ran.
+    """
+    metrics = RequestMetrics()
+    app.extensions['request_metrics'] = metrics
+    slow_ms = app.config.get('SLOW_REQUEST_MS')
+
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def start_trace():
+        g.trace_start = time.perf_counter()
+        g.trace_sql_count = 0
+        g.trace_sql_time = 0.0
+        g.trace_statements = [] if slow_ms else None
+
+    @app.after_request
+    def finish_trace(response):
+        if 'trace_start' not in g:
+            return response
+        latency = time.perf_counter() - g.trace_start
+        endpoint = request.endpoint or 'unmatched'
+        metrics.record(endpoint, response.status_code, latency, g.trace_sql_count,
+                       g.trace_sql_time, response.calculate_content_length() or 0)
+
+        if slow_ms and latency * 1000 >= slow_ms:
+            app.logger.warning('Slow request %s %s took %.1f ms with %d SQL statements',
+                               request.method, request.path, latency * 1000, g.trace_sql_count, extra={
+                                   'endpoint': endpoint,
+                                   'duration_ms': round(latency * 1000, 2),
+                                   'sql_time_ms': round(g.trace_sql_time * 1000, 2),
+                                   'sql': [{'statement': statement, 'ms': round(elapsed * 1000, 3)}
+                                           for statement, elapsed in g.trace_statements],
+                               })
+        return response
@@ -0,0 +1,227 @@
+import argparse
+import http.cookiejar
+import io
+import logging
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from collections import defaultdict
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Drives a throwaway instance of the app with synthetic users. Each virtual
+# user registers, logs in, creates a sample and then picks actions at random
+# with these weights, timing every request by endpoint.
+ACTIONS = {
+    'upload': 1,
+    'sample': 3,
+    'dashboard': 3,
+    'export_json': 2,
+    'export_csv': 2,
+}
+
+
+class InProcessClient:
+    """Calls the WSGI app directly through Flask's test client."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def get(self, path):
+        response = self.client.get(path)
+        return response.status_code, len(response.data)
+
+    def post(self, path, data, files=None):
+        data = dict(data)
+        for name, (filename, content) in (files or {}).items():
+            data[name] = (io.BytesIO(content), filename)
+        response = self.client.post(path, data=data, content_type='multipart/form-data')
+        return response.status_code, len(response.data)
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HTTPClient:
+    """Talks to a real server over HTTP with its own cookie jar, without following redirects."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+
+    def _open(self, request):
+        try:
+            with self.opener.open(request) as response:
+                return response.status, len(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, len(e.read())
+
+    def get(self, path):
+        return self._open(urllib.request.Request(self.base_url + path))
+
+    def post(self, path, data, files=None):
+        boundary = uuid.uuid4().hex
+        parts = []
+        for name, value in data.items():
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+        for name, (filename, content) in (files or {}).items():
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                         f'Content-Type: application/octet-stream\r\n\r\n'.encode() + content + b'\r\n')
+        parts.append(f'--{boundary}--\r\n'.encode())
+        request = urllib.request.Request(self.base_url + path, data=b''.join(parts), method='POST', headers={
+            'Content-Type': f'multipart/form-data; boundary={boundary}'})
+        return self._open(request)
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def time(self, name, call, *args, expect=(200, 302)):
+        start = time.perf_counter()
+        status, _ = call(*args)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.latencies[name].append(elapsed)
+            if status not in expect:
+                self.errors[name] += 1
+        return status
+
+
+def virtual_user(app, client, recorder, image, iterations, seed):
+    rng = random.Random(seed)
+    name = f'load{uuid.uuid4().hex[:8]}'
+    password = 'loadtest123'
+    recorder.time('register', client.post, '/auth/register', {
+        'username': name, 'email': f'{name}@gmail.com', 'password': password, 'password2': password})
+    recorder.time('login', client.post, '/auth/login', {'username': name, 'password': password})
+    recorder.time('create_sample', client.post, '/create_sample', {'name': f'{name} sample'})
+
+    from app.models import Sample, Image
+    with app.app_context():
+        sample_id = Sample.query.join(Sample.author).filter_by(username=name).first().id
+
+    def latest_image():
+        with app.app_context():
+            image_row = Image.query.filter_by(sample_id=sample_id).order_by(Image.id.desc()).first()
+            return image_row.id if image_row else None
+
+    # Every user starts with one image so that dashboards can be viewed
+    recorder.time('upload', client.post, f'/sample/{sample_id}', {}, {'image': ('load.png', image)})
+    image_id = latest_image()
+
+    names, weights = zip(*ACTIONS.items())
+    for _ in range(iterations):
+        action = rng.choices(names, weights)[0]
+        if action == 'upload':
+            recorder.time('upload', client.post, f'/sample/{sample_id}', {}, {'image': ('load.png', image)})
+        elif action == 'sample':
+            recorder.time('sample', client.get, f'/sample/{sample_id}')
+        elif action == 'dashboard' and image_id:
+            recorder.time('dashboard', client.get, f'/dashboard/{image_id}')
+        elif action == 'export_json':
+            recorder.time('export_json', client.get, f'/api/sample/{sample_id}/export/json')
+        elif action == 'export_csv':
+            recorder.time('export_csv', client.get, f'/api/sample/{sample_id}/export/csv')
+
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def report(recorder, elapsed):
+    total = sum(len(v) for v in recorder.latencies.values())
+    print(f'{total} requests in {elapsed:.2f} s, {total / elapsed:.1f} req/s overall\n')
+    print(f"{'endpoint':>14} {'count':>7} {'errors':>7} {'req/s':>8} {'mean ms':>9} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name in sorted(recorder.latencies):
+        ordered = sorted(recorder.latencies[name])
+        print(f'{name:>14} {len(ordered):7d} {recorder.errors[name]:7d} {len(ordered) / elapsed:8.1f} '
+              f'{statistics.mean(ordered) * 1000:9.1f} {percentile(ordered, 0.50) * 1000:9.1f} '
+              f'{percentile(ordered, 0.95) * 1000:9.1f} {percentile(ordered, 0.99) * 1000:9.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test uploads, dashboards and exports on a throwaway instance.')
+    parser.add_argument('-u', '--users', type=int, default=8, help='concurrent virtual users')
+    parser.add_argument('-n', '--iterations', type=int, default=25, help='actions per user after setup')
+    parser.add_argument('--http', action='store_true',
+                        help='serve on an ephemeral port and go through HTTP instead of calling the app in-process')
+    parser.add_argument('--image', default=os.path.join(APP_DIR, 'test_image.png'), help='image to upload')
+    parser.add_argument('--detection-processes', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    from app import create_app
+    from app.database import db
+    from app.logging_config import stop_listener
+    from app.services import counters
+
+    with open(args.image, 'rb') as f:
+        image = f.read()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        upload_prefix = f'uploads/loadtest-{uuid.uuid4().hex[:8]}'
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'load.db'),
+            'WTF_CSRF_ENABLED': False,
+            'UPLOAD_URL_PREFIX': upload_prefix,
+            'DERIVATIVES_FOLDER': os.path.join(workdir, 'derivatives'),
+            'LOG_FILE': os.path.join(workdir, 'load.log'),
+            'DETECTION_PROCESSES': args.detection_processes,
+        })
+        with app.app_context():
+            db.create_all()
+            counters.recount()
+            db.session.commit()
+
+        server = None
+        if args.http:
+            from werkzeug.serving import make_server
+            logging.getLogger('werkzeug').setLevel(logging.WARNING)  # no access line per request
+            server = make_server('127.0.0.1', 0, app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            base_url = f'http://127.0.0.1:{server.server_port}'
+            print(f'Serving on {base_url}')
+            make_client = lambda: HTTPClient(base_url)
+        else:
+            make_client = lambda: InProcessClient(app)
+
+        recorder = Recorder()
+        threads = [threading.Thread(target=virtual_user,
+                                    args=(app, make_client(), recorder, image, args.iterations, args.seed + n))
+                   for n in range(args.users)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+
+        if server is not None:
+            server.shutdown()
+        from app.services import detection_pool
+        detection_pool.shutdown()
+        stop_listener(app.extensions['log_listener'])
+        shutil.rmtree(os.path.join(app.static_folder, upload_prefix), ignore_errors=True)
+
+    print(f"{args.users} users x {args.iterations} actions, {'HTTP' if args.http else 'in-process'}, "
+          f'{args.detection_processes} detection process(es)')
+    report(recorder, elapsed)
+
+
+if __name__ == '__main__':
+    main()
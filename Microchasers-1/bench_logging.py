@@ -0,0 +1,96 @@
+import argparse
+import logging
+import os
+import queue
+import statistics
+import tempfile
+import threading
+import time
+from logging.handlers import QueueListener, RotatingFileHandler
+from app.logging_config import DeferredQueueHandler, JSONFormatter, TEXT_FORMAT
+
+# Measures how long request threads spend inside logging calls. A simulated
+# request logs one application line and one access line, like a real one.
+
+
+def sync_setup(log_dir):
+    """The previous setup: a file handler written from every request thread."""
+    handler = RotatingFileHandler(os.path.join(log_dir, 'sync.log'), maxBytes=10240, backupCount=10)
+    handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    return handler, None
+
+
+def queue_setup(log_dir):
+    handler = RotatingFileHandler(os.path.join(log_dir, 'queue.log'),
+                                  maxBytes=10 * 1024 * 1024, backupCount=10)
+    handler.setFormatter(JSONFormatter())
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, handler)
+    listener.start()
+    return DeferredQueueHandler(log_queue), listener
+
+
+def run(setup, threads, requests):
+    with tempfile.TemporaryDirectory() as log_dir:
+        handler, listener = setup(log_dir)
+        logger = logging.getLogger(f'bench.{setup.__name__}')
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        logger.addHandler(handler)
+
+        latencies = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(threads)
+
+        def worker(n):
+            local = []
+            barrier.wait()
+            for i in range(requests):
+                start = time.perf_counter()
+                logger.info('Processing sample %d image %d', n, i)
+                logger.info('GET /sample/%d 200', n, extra={
+                    'method': 'GET', 'path': f'/sample/{n}', 'status': 200,
+                    'duration_ms': 12.5, 'response_bytes': 4096})
+                local.append(time.perf_counter() - start)
+            with lock:
+                latencies.extend(local)
+
+        start = time.perf_counter()
+        pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        elapsed = time.perf_counter() - start
+        if listener is not None:
+            # Include the time for the listener to write everything out
+            listener.stop()
+        drained = time.perf_counter() - start
+        logger.removeHandler(handler)
+        handler.close()
+
+    latencies.sort()
+    return {
+        'mean_us': statistics.mean(latencies) * 1e6,
+        'p50_us': latencies[len(latencies) // 2] * 1e6,
+        'p99_us': latencies[int(len(latencies) * 0.99)] * 1e6,
+        'requests_per_s': len(latencies) / elapsed,
+        'drained_s': drained,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark per-request logging overhead.')
+    parser.add_argument('-t', '--threads', type=int, default=16)
+    parser.add_argument('-n', '--requests', type=int, default=2000, help='requests per thread')
+    args = parser.parse_args()
+
+    for setup in (sync_setup, queue_setup):
+        result = run(setup, args.threads, args.requests)
+        print(f"{setup.__name__:>11}: mean {result['mean_us']:7.1f} us, p50 {result['p50_us']:7.1f} us, "
+              f"p99 {result['p99_us']:8.1f} us per request, {result['requests_per_s']:9.0f} req/s, "
+              f"all written after {result['drained_s']:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
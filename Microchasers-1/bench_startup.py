@@ -0,0 +1,55 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Each run is a fresh interpreter, so nothing is warm in sys.modules.
+# "eager" loads the OpenCV stack up front the way the main blueprint used
+# to at import time; "lazy" is how create_app() starts today.
+SNIPPETS = {
+    'eager': "import app.services.image_processing; from app import create_app",
+    'lazy': "from app import create_app",
+}
+
+TIMER = """
+import sys, time
+sys.path.insert(0, {app_dir!r})
+start = time.perf_counter()
+{snippet}
+create_app()
+print(time.perf_counter() - start)
+"""
+
+
+def cold_start(mode, cwd):
+    code = TIMER.format(app_dir=APP_DIR, snippet=SNIPPETS[mode])
+    result = subprocess.run([sys.executable, '-c', code], cwd=cwd,
+                            capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark cold create_app() time.')
+    parser.add_argument('-n', '--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as cwd:
+        for _ in range(args.runs):
+            # Interleave the modes so disk cache effects hit both equally
+            for mode in SNIPPETS:
+                results.setdefault(mode, []).append(cold_start(mode, cwd))
+
+    for mode, times in results.items():
+        print(f"{mode:>5}: median {statistics.median(times) * 1000:7.1f} ms, "
+              f"min {min(times) * 1000:7.1f} ms over {len(times)} runs")
+    saved = statistics.median(results['eager']) - statistics.median(results['lazy'])
+    print(f"lazy CV imports save {saved * 1000:.1f} ms per cold start")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Times the read-path views against an existing database, typically one
+# filled with `flask generate-fixtures`. Each view is requested as the owner
+# of the data (and the admin views as the admin, if that account exists),
+# without going through the login form.
+
+
+def log_in(client, user_id):
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time each read-path view against a (large) database.')
+    parser.add_argument('--database', default='sqlite:///' + os.path.join(APP_DIR, 'instance', 'microchasers.db'),
+                        help='SQLAlchemy URL of the database to read')
+    parser.add_argument('--user', help='username to view as (default: the user with the most samples)')
+    parser.add_argument('-n', '--repeat', type=int, default=5, help='timed requests per view')
+    args = parser.parse_args()
+
+    from app import create_app
+    from app.auth.forms import ADMIN_CREDENTIALS
+    from app.database import db
+    from app.models import User, Sample, Image
+
+    with tempfile.TemporaryDirectory() as workdir:
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': args.database,
+            'LOG_FILE': os.path.join(workdir, 'bench.log'),
+        })
+        with app.app_context():
+            if args.user:
+                user = User.query.filter_by(username=args.user).first_or_404()
+            else:
+                user_id = (db.session.query(Sample.user_id).group_by(Sample.user_id)
+                           .order_by(db.func.count(Sample.id).desc()).limit(1).scalar())
+                user = db.session.get(User, user_id)
+            sample = user.samples.order_by(Sample.id).first()
+            image = sample.images.order_by(Image.id).first() if sample else None
+            admin = User.query.filter_by(username=ADMIN_CREDENTIALS['username']).first()
+            print(f'Viewing as {user.username}: sample {sample.id if sample else "-"}, '
+                  f'image {image.id if image else "-"}'
+                  f'{", " + str(image.detections.count()) + " detections" if image else ""}\n')
+
+        views = [('main.index', '/index', user), ('main.samples', '/samples', user)]
+        if sample:
+            views += [('main.sample', f'/sample/{sample.id}', user),
+                      ('api.export_sample_json', f'/api/sample/{sample.id}/export/json', user),
+                      ('api.export_sample_csv', f'/api/sample/{sample.id}/export/csv', user)]
+        if image:
+            views.append(('main.dashboard', f'/dashboard/{image.id}', user))
+        if admin:
+            views.append(('admin.index', '/admin/', admin))
+        else:
+            print('No admin account, skipping admin.index')
+
+        metrics = app.extensions['request_metrics']
+        print(f"{'view':>24} {'status':>6} {'bytes':>10} {'mean ms':>9} {'p50 ms':>9} {'max ms':>9} {'SQL/req':>8}")
+        for endpoint, path, viewer in views:
+            client = app.test_client()
+            log_in(client, viewer.id)
+            response = client.get(path)  # warm-up
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                response = client.get(path)
+                response.get_data()
+                timings.append(time.perf_counter() - start)
+            stats = metrics.snapshot().get(endpoint, {})
+            print(f'{endpoint:>24} {response.status_code:6d} {len(response.data):10d} '
+                  f'{statistics.mean(timings) * 1000:9.1f} {statistics.median(timings) * 1000:9.1f} '
+                  f'{max(timings) * 1000:9.1f} {stats.get("sql_statements_avg", 0):8.1f}')
+
+        from app.logging_config import stop_listener
+        stop_listener(app.extensions['log_listener'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+import os
+import shutil
+import uuid
+import pytest
+
+# Fixtures shared by the test modules: an application on a throwaway
+# database, with detection run inline and uploads kept under a prefix of
+# their own that is removed afterwards.
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'app_config(**settings): extra configuration for the app fixture')
+
+
+@pytest.fixture
+def app(request, tmp_path):
+    from app import create_app
+    from app.database import db
+    from app.logging_config import stop_listener
+    from app.services import counters
+
+    upload_prefix = f'uploads/test-{uuid.uuid4().hex[:8]}'
+    marker = request.node.get_closest_marker('app_config')
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tmp_path, 'test.db'),
+        'WTF_CSRF_ENABLED': False,
+        'UPLOAD_URL_PREFIX': upload_prefix,
+        'UPLOAD_TEMP_FOLDER': os.path.join(tmp_path, 'tmp'),
+        'DERIVATIVES_FOLDER': os.path.join(tmp_path, 'derivatives'),
+        'LOG_FILE': os.path.join(tmp_path, 'test.log'),
+        'DETECTION_PROCESSES': 0,
+        **(marker.kwargs if marker else {}),
+    })
+    with app.app_context():
+        db.create_all()
+        counters.recount()
+        db.session.commit()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+    stop_listener(app.extensions['log_listener'])
+    shutil.rmtree(os.path.join(app.static_folder, upload_prefix), ignore_errors=True)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def user(app):
+    """A user, committed, whose id can be passed to log_in."""
+    from app.database import db
+    from app.models import User
+    from app.services import counters
+
+    with app.app_context():
+        account = User(username=f'user-{uuid.uuid4().hex[:8]}', email=f'{uuid.uuid4().hex[:8]}@example.com')
+        account.set_password('secret')
+        db.session.add(account)
+        counters.adjust(users=1)
+        db.session.commit()
+        return account.id
+
+
+def log_in(client, user_id):
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
@@ -0,0 +1,81 @@
+"""
+Gunicorn settings for running MicroChasers in production:
+
+    python run.py --production
+    # or
+    gunicorn -c gunicorn.conf.py run:app
+
+Every setting can be overridden from the environment.
+"""
+import gc
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+# Flask-SocketIO runs in threading mode, which pairs with gthread workers.
+# Socket.IO clients of one worker can only be reached from another through
+# a message queue, so without SOCKETIO_MESSAGE_QUEUE a single worker is used.
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+if os.environ.get('GUNICORN_WORKERS'):
+    workers = int(os.environ['GUNICORN_WORKERS'])
+elif os.environ.get('SOCKETIO_MESSAGE_QUEUE'):
+    workers = min(multiprocessing.cpu_count(), 4)
+else:
+    workers = 1
+
+# Import the app once in the master and fork workers from it, so code and
+# startup data are shared copy-on-write instead of loaded per worker.
+preload_app = True
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers after a number of requests, and as soon as one grows past
+# the resident memory ceiling (checked after every request).
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = max_requests // 10
+WORKER_MAX_RSS_MB = int(os.environ.get('GUNICORN_WORKER_MAX_RSS_MB', 512))
+
+accesslog = '-'
+
+
+def _rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except OSError:
+        import resource
+        # Peak rather than current RSS where /proc isn't available (kB on Linux, bytes on macOS)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def when_ready(server):
+    # Move everything the preloaded app allocated into the permanent
+    # generation, so the collector in each worker never touches (and
+    # un-shares) those pages.
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Connections opened in the master must not be shared between processes
+    from app.database import db
+    app = server.app.wsgi()
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+
+def post_request(worker, req, environ, resp):
+    rss = _rss_mb()
+    if rss > WORKER_MAX_RSS_MB:
+        worker.log.info('Worker %s at %.0f MB RSS (limit %d MB), recycling',
+                        worker.pid, rss, WORKER_MAX_RSS_MB)
+        worker.alive = False
+
+
+def worker_exit(server, worker):
+    from app.services import detection_pool
+    detection_pool.shutdown()
@@ -0,0 +1,29 @@
+"""Add image processing status
+
+Revision ID: 3c1f8e2a9b47
+Revises: 114b1eba517d
+Create Date: 2026-10-19 09:12:04.518230
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c1f8e2a9b47'
+down_revision = '114b1eba517d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('image', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('status', sa.String(length=20), nullable=True))
+
+    # Every image stored before this revision was processed synchronously.
+    op.execute("UPDATE image SET status = 'processed'")
+
+
+def downgrade():
+    with op.batch_alter_table('image', schema=None) as batch_op:
+        batch_op.drop_column('status')
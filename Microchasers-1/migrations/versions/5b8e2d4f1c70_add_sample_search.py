@@ -0,0 +1,62 @@
+"""Add sample counts and name search
+
+Revision ID: 5b8e2d4f1c70
+Revises: a3f9d1c6e8b4
+Create Date: 2026-10-20 00:31:07.652914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b8e2d4f1c70'
+down_revision = 'a3f9d1c6e8b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('sample', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('image_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('detection_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.create_index('ix_sample_user_timestamp', ['user_id', 'timestamp'], unique=False)
+        batch_op.create_index('ix_sample_user_detection_count', ['user_id', 'detection_count'], unique=False)
+
+    # Count what is there already
+    op.execute('UPDATE sample SET '
+               'image_count = (SELECT count(*) FROM image WHERE image.sample_id = sample.id), '
+               'detection_count = (SELECT count(*) FROM detection JOIN image ON detection.image_id = image.id '
+               'WHERE image.sample_id = sample.id)')
+
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    # Trigram index of the sample names, an external-content table kept in
+    # step by triggers. The trigram tokenizer needs SQLite 3.34 or later;
+    # without it, name search scans with LIKE instead.
+    try:
+        op.execute("CREATE VIRTUAL TABLE sample_name_fts USING fts5("
+                   "name, content='sample', content_rowid='id', tokenize='trigram')")
+    except sa.exc.OperationalError:
+        return
+    op.execute("CREATE TRIGGER sample_name_fts_insert AFTER INSERT ON sample BEGIN "
+               "INSERT INTO sample_name_fts(rowid, name) VALUES (new.id, new.name); END")
+    op.execute("CREATE TRIGGER sample_name_fts_delete AFTER DELETE ON sample BEGIN "
+               "INSERT INTO sample_name_fts(sample_name_fts, rowid, name) VALUES ('delete', old.id, old.name); END")
+    op.execute("CREATE TRIGGER sample_name_fts_update AFTER UPDATE OF name ON sample BEGIN "
+               "INSERT INTO sample_name_fts(sample_name_fts, rowid, name) VALUES ('delete', old.id, old.name); "
+               "INSERT INTO sample_name_fts(rowid, name) VALUES (new.id, new.name); END")
+    op.execute("INSERT INTO sample_name_fts(sample_name_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        for trigger in ('insert', 'delete', 'update'):
+            op.execute(f'DROP TRIGGER IF EXISTS sample_name_fts_{trigger}')
+        op.execute('DROP TABLE IF EXISTS sample_name_fts')
+
+    with op.batch_alter_table('sample', schema=None) as batch_op:
+        batch_op.drop_index('ix_sample_user_detection_count')
+        batch_op.drop_index('ix_sample_user_timestamp')
+        batch_op.drop_column('detection_count')
+        batch_op.drop_column('image_count')
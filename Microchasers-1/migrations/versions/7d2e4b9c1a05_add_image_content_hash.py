@@ -0,0 +1,28 @@
+"""Add image content hash
+
+Revision ID: 7d2e4b9c1a05
+Revises: 3c1f8e2a9b47
+Create Date: 2026-10-19 11:40:27.093614
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2e4b9c1a05'
+down_revision = '3c1f8e2a9b47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('image', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('content_hash', sa.String(length=64), nullable=True))
+        batch_op.create_index(batch_op.f('ix_image_content_hash'), ['content_hash'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('image', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_image_content_hash'))
+        batch_op.drop_column('content_hash')
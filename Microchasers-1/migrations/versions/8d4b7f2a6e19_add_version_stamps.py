@@ -0,0 +1,32 @@
+"""Add sample and image version stamps
+
+Revision ID: 8d4b7f2a6e19
+Revises: c71e4a9f3d26
+Create Date: 2026-10-20 01:52:36.771204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d4b7f2a6e19'
+down_revision = 'c71e4a9f3d26'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('sample', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+    with op.batch_alter_table('image', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('image', schema=None) as batch_op:
+        batch_op.drop_column('version')
+
+    with op.batch_alter_table('sample', schema=None) as batch_op:
+        batch_op.drop_column('version')
@@ -0,0 +1,30 @@
+"""Add image stack page
+
+Revision ID: a3f9d1c6e8b4
+Revises: e6a1c94b7d25
+Create Date: 2026-10-19 23:48:20.417356
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3f9d1c6e8b4'
+down_revision = 'e6a1c94b7d25'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('image', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('stack_filepath', sa.String(length=200), nullable=True))
+        batch_op.add_column(sa.Column('stack_page', sa.Integer(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_image_stack_filepath'), ['stack_filepath'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('image', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_image_stack_filepath'))
+        batch_op.drop_column('stack_page')
+        batch_op.drop_column('stack_filepath')
@@ -0,0 +1,45 @@
+"""Add content-addressed file store
+
+Revision ID: a84f0d6c2e91
+Revises: 7d2e4b9c1a05
+Create Date: 2026-10-19 14:05:51.772310
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a84f0d6c2e91'
+down_revision = '7d2e4b9c1a05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('stored_file',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('path', sa.String(length=200), nullable=False),
+    sa.Column('digest', sa.String(length=64), nullable=False),
+    sa.Column('size', sa.Integer(), nullable=True),
+    sa.Column('refcount', sa.Integer(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('stored_file', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_stored_file_digest'), ['digest'], unique=False)
+        batch_op.create_index(batch_op.f('ix_stored_file_path'), ['path'], unique=True)
+
+    with op.batch_alter_table('image', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('original_filepath', sa.String(length=200), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('image', schema=None) as batch_op:
+        batch_op.drop_column('original_filepath')
+
+    with op.batch_alter_table('stored_file', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_stored_file_path'))
+        batch_op.drop_index(batch_op.f('ix_stored_file_digest'))
+
+    op.drop_table('stored_file')
@@ -0,0 +1,27 @@
+"""Clear difference hashes, which the DCT hash replaces
+
+Revision ID: b2c8e5f1a374
+Revises: 8d4b7f2a6e19
+Create Date: 2026-10-20 09:14:02.518336
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b2c8e5f1a374'
+down_revision = '8d4b7f2a6e19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The stored hashes are not comparable with the new ones, most of them
+    # are 0; `flask hash-images` computes the new hashes
+    op.execute(sa.text('UPDATE image SET phash = NULL, phash_band0 = NULL, phash_band1 = NULL, '
+                       'phash_band2 = NULL, phash_band3 = NULL'))
+
+
+def downgrade():
+    pass
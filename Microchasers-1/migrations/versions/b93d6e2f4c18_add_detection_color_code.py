@@ -0,0 +1,32 @@
+"""Add detection colour codes
+
+Revision ID: b93d6e2f4c18
+Revises: f7c2d58a1e34
+Create Date: 2026-10-19 21:08:52.417306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b93d6e2f4c18'
+down_revision = 'f7c2d58a1e34'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('detection', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('color_code', sa.SmallInteger(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_detection_color_code'), ['color_code'], unique=False)
+        batch_op.create_index('ix_detection_image_color', ['image_id', 'color_code'], unique=False)
+
+    # Existing detections are classified by d6f1a9c3e572
+
+
+def downgrade():
+    with op.batch_alter_table('detection', schema=None) as batch_op:
+        batch_op.drop_index('ix_detection_image_color')
+        batch_op.drop_index(batch_op.f('ix_detection_color_code'))
+        batch_op.drop_column('color_code')
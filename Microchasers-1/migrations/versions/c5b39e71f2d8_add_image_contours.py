@@ -0,0 +1,26 @@
+"""Add image contour geometry
+
+Revision ID: c5b39e71f2d8
+Revises: a84f0d6c2e91
+Create Date: 2026-10-19 16:22:48.301957
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5b39e71f2d8'
+down_revision = 'a84f0d6c2e91'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('image', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('contours', sa.LargeBinary(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('image', schema=None) as batch_op:
+        batch_op.drop_column('contours')
@@ -0,0 +1,48 @@
+"""Add particle tracks
+
+Revision ID: c71e4a9f3d26
+Revises: 5b8e2d4f1c70
+Create Date: 2026-10-20 01:14:52.308841
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c71e4a9f3d26'
+down_revision = '5b8e2d4f1c70'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('image', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('frame_count', sa.Integer(), nullable=True))
+
+    op.create_table('track',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('detection_id', sa.Integer(), nullable=True),
+    sa.Column('image_id', sa.Integer(), nullable=True),
+    sa.Column('first_frame', sa.Integer(), nullable=True),
+    sa.Column('last_frame', sa.Integer(), nullable=True),
+    sa.Column('frame_count', sa.Integer(), nullable=True),
+    sa.Column('path_length', sa.Float(), nullable=True),
+    sa.Column('points', sa.LargeBinary(), nullable=True),
+    sa.ForeignKeyConstraint(['detection_id'], ['detection.id'], ),
+    sa.ForeignKeyConstraint(['image_id'], ['image.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('track', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_track_detection_id'), ['detection_id'], unique=True)
+        batch_op.create_index(batch_op.f('ix_track_image_id'), ['image_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('track', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_track_image_id'))
+        batch_op.drop_index(batch_op.f('ix_track_detection_id'))
+
+    op.drop_table('track')
+    with op.batch_alter_table('image', schema=None) as batch_op:
+        batch_op.drop_column('frame_count')
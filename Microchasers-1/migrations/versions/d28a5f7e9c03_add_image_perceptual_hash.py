@@ -0,0 +1,46 @@
+"""Add image perceptual hash
+
+Revision ID: d28a5f7e9c03
+Revises: b93d6e2f4c18
+Create Date: 2026-10-19 22:31:05.884210
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd28a5f7e9c03'
+down_revision = 'b93d6e2f4c18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('image', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('phash', sa.BigInteger(), nullable=True))
+        batch_op.add_column(sa.Column('phash_band0', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('phash_band1', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('phash_band2', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('phash_band3', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('duplicate_of_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_image_duplicate_of_id_image', 'image', ['duplicate_of_id'], ['id'])
+        batch_op.create_index('ix_image_sample_phash_band0', ['sample_id', 'phash_band0'], unique=False)
+        batch_op.create_index('ix_image_sample_phash_band1', ['sample_id', 'phash_band1'], unique=False)
+        batch_op.create_index('ix_image_sample_phash_band2', ['sample_id', 'phash_band2'], unique=False)
+        batch_op.create_index('ix_image_sample_phash_band3', ['sample_id', 'phash_band3'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('image', schema=None) as batch_op:
+        batch_op.drop_index('ix_image_sample_phash_band3')
+        batch_op.drop_index('ix_image_sample_phash_band2')
+        batch_op.drop_index('ix_image_sample_phash_band1')
+        batch_op.drop_index('ix_image_sample_phash_band0')
+        batch_op.drop_constraint('fk_image_duplicate_of_id_image', type_='foreignkey')
+        batch_op.drop_column('duplicate_of_id')
+        batch_op.drop_column('phash_band3')
+        batch_op.drop_column('phash_band2')
+        batch_op.drop_column('phash_band1')
+        batch_op.drop_column('phash_band0')
+        batch_op.drop_column('phash')
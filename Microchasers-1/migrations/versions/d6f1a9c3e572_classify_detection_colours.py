@@ -0,0 +1,78 @@
+"""Classify detection colours with the corrected purple, pink and red hues
+
+Revision ID: d6f1a9c3e572
+Revises: b2c8e5f1a374
+Create Date: 2026-10-20 14:32:47.905113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd6f1a9c3e572'
+down_revision = 'b2c8e5f1a374'
+branch_labels = None
+depends_on = None
+
+# The palette classification as of this revision, copied here so that later
+# changes to app.services.palette never change what this migration wrote
+WHITE, GREY, BLACK, RED, ORANGE, YELLOW, GREEN, TEAL, BLUE, PURPLE, PINK, BROWN = range(12)
+HUES = ((15, RED), (40, ORANGE), (70, YELLOW), (160, GREEN), (195, TEAL), (255, BLUE), (320, PURPLE),
+        (355, PINK), (360, RED))
+BITS = 5
+
+
+def lookup_table():
+    import cv2
+    import numpy as np
+
+    levels = ((np.arange(1 << BITS) << (8 - BITS)) + (1 << (7 - BITS))) / 255
+    r, g, b = np.meshgrid(levels, levels, levels, indexing='ij')
+    rgb = np.stack([r, g, b], axis=-1).reshape(-1, 1, 3).astype(np.float32)
+    hsv = cv2.cvtColor(rgb, cv2.COLOR_RGB2HSV).reshape(-1, 3)
+    hue, saturation, value = hsv[:, 0], hsv[:, 1], hsv[:, 2]
+
+    codes = np.full(len(hsv), RED, dtype=np.uint8)
+    for bound, code in reversed(HUES):
+        codes[hue < bound] = code
+    codes[(hue >= 8) & (hue < 45) & (value < 0.6)] = BROWN
+    grey = saturation < 0.2
+    codes[grey] = GREY
+    codes[grey & (value > 0.8)] = WHITE
+    codes[(grey & (value < 0.25)) | (value < 0.15)] = BLACK
+    return codes.reshape((1 << BITS,) * 3)
+
+
+def classify_hex(table, colors):
+    return [int(table[int(color[1:3], 16) >> (8 - BITS), int(color[3:5], 16) >> (8 - BITS),
+                      int(color[5:7], 16) >> (8 - BITS)]) for color in colors]
+
+
+def upgrade():
+    # Every detection is (re)classified from its stored hex colour, in
+    # batches updated by primary key
+    table = lookup_table()
+    connection = op.get_bind()
+    detection = sa.table('detection', sa.column('id', sa.Integer), sa.column('color', sa.String),
+                         sa.column('color_code', sa.SmallInteger))
+    update = (detection.update().where(detection.c.id == sa.bindparam('detection_id'))
+              .values(color_code=sa.bindparam('code')))
+    last_id = 0
+    while True:
+        rows = connection.execute(sa.select(detection.c.id, detection.c.color).where(detection.c.id > last_id)
+                                  .order_by(detection.c.id).limit(10000)).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        rows = [(detection_id, color) for detection_id, color in rows
+                if color and len(color) == 7 and color.startswith('#')]
+        codes = classify_hex(table, [color for _, color in rows])
+        if rows:
+            connection.execute(update, [{'detection_id': detection_id, 'code': code}
+                                        for (detection_id, _), code in zip(rows, codes)])
+
+
+def downgrade():
+    # The codes stay, classified with the corrected hues
+    pass
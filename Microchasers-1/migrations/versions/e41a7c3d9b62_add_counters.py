@@ -0,0 +1,33 @@
+"""Add dashboard counters
+
+Revision ID: e41a7c3d9b62
+Revises: c5b39e71f2d8
+Create Date: 2026-10-19 18:05:12.417203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e41a7c3d9b62'
+down_revision = 'c5b39e71f2d8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('counter',
+    sa.Column('name', sa.String(length=32), nullable=False),
+    sa.Column('value', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    # Seed from the existing rows
+    quote = op.get_bind().dialect.identifier_preparer.quote
+    for name, table in (('users', 'user'), ('samples', 'sample'), ('images', 'image'),
+                        ('detections', 'detection')):
+        op.execute(f"INSERT INTO counter (name, value) SELECT '{name}', COUNT(*) FROM {quote(table)}")
+
+
+def downgrade():
+    op.drop_table('counter')
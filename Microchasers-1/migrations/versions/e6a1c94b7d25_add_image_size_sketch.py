@@ -0,0 +1,58 @@
+"""Add image size sketch
+
+Revision ID: e6a1c94b7d25
+Revises: d28a5f7e9c03
+Create Date: 2026-10-19 23:12:48.093517
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6a1c94b7d25'
+down_revision = 'd28a5f7e9c03'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('image', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('size_sketch', sa.LargeBinary(), nullable=True))
+
+    # Sketch the existing detections, streaming them in image order
+    from app.services.size_sketch import sketch_sizes
+
+    connection = op.get_bind()
+    image = sa.table('image', sa.column('id', sa.Integer), sa.column('status', sa.String),
+                     sa.column('size_sketch', sa.LargeBinary))
+    detection = sa.table('detection', sa.column('image_id', sa.Integer), sa.column('size', sa.Float))
+    update = (image.update().where(image.c.id == sa.bindparam('image_id'))
+              .values(size_sketch=sa.bindparam('sketch')))
+    rows = connection.execution_options(stream_results=True).execute(
+        sa.select(detection.c.image_id, detection.c.size)
+        .where(detection.c.image_id.isnot(None), detection.c.size.isnot(None))
+        .order_by(detection.c.image_id))
+    pending, current, sizes = [], None, []
+    for image_id, size in rows:
+        if image_id != current and sizes:
+            pending.append({'image_id': current, 'sketch': sketch_sizes(sizes)})
+            sizes = []
+            if len(pending) >= 1000:
+                connection.execute(update, pending)
+                pending = []
+        current = image_id
+        sizes.append(size)
+    if sizes:
+        pending.append({'image_id': current, 'sketch': sketch_sizes(sizes)})
+    if pending:
+        connection.execute(update, pending)
+
+    # Processed images without detections get an empty sketch
+    connection.execute(image.update().where(image.c.status == 'processed', image.c.size_sketch.is_(None))
+                       .values(size_sketch=sketch_sizes([])))
+
+
+def downgrade():
+    with op.batch_alter_table('image', schema=None) as batch_op:
+        batch_op.drop_column('size_sketch')
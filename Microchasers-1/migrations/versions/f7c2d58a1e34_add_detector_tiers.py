@@ -0,0 +1,32 @@
+"""Add detector tiers
+
+Revision ID: f7c2d58a1e34
+Revises: e41a7c3d9b62
+Create Date: 2026-10-19 19:42:37.160584
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f7c2d58a1e34'
+down_revision = 'e41a7c3d9b62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('sample', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('detector_tier', sa.String(length=20), server_default='standard', nullable=True))
+
+    with op.batch_alter_table('image', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('detector_tier', sa.String(length=20), server_default='standard', nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('image', schema=None) as batch_op:
+        batch_op.drop_column('detector_tier')
+
+    with op.batch_alter_table('sample', schema=None) as batch_op:
+        batch_op.drop_column('detector_tier')
@@ -1,6 +1,16 @@
+import os
+import sys
+
+if __name__ == "__main__" and '--production' in sys.argv:
+    # Hand over to gunicorn, which imports run:app itself (once, in its master)
+    here = os.path.dirname(os.path.abspath(__file__))
+    os.execv(sys.executable, [sys.executable, '-m', 'gunicorn', '--chdir', here,
+                              '-c', os.path.join(here, 'gunicorn.conf.py'), 'run:app'])
+
 from app import create_app
+from app.realtime import socketio
 
 app = create_app()
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    socketio.run(app, debug=True)
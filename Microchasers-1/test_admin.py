@@ -0,0 +1,138 @@
+import io
+import os
+import pytest
+from werkzeug.datastructures import FileStorage
+from conftest import log_in
+from app.database import db
+from app.models import User, Sample, Image, Detection, StoredFile
+from app.services import counters, storage
+
+# Dashboard counters follow every write, and clearing data deletes the
+# stored files and derivatives along with the rows that referenced them.
+
+
+@pytest.fixture
+def admin(app):
+    from app.auth.forms import ADMIN_CREDENTIALS
+
+    with app.app_context():
+        account = User(username=ADMIN_CREDENTIALS['username'], email=ADMIN_CREDENTIALS['email'])
+        db.session.add(account)
+        counters.adjust(users=1)
+        db.session.commit()
+        return account.id
+
+
+def add_image(user_id, data=b'pixels', content_hash='ab' * 32):
+    sample = Sample(name='flow cell', user_id=user_id)
+    db.session.add(sample)
+    counters.adjust(samples=1)
+    filepath = storage.save_upload(FileStorage(io.BytesIO(data), filename='frame.png'))
+    image = Image(filepath=filepath, original_filepath=filepath, sample=sample, status='processed',
+                  content_hash=content_hash)
+    db.session.add_all([image, Detection(image=image, x_coordinate=1, y_coordinate=2, size=3.0, shape='round',
+                                         color='red')])
+    counters.adjust(sample=sample, images=1, detections=1)
+    db.session.commit()
+    return sample, image
+
+
+def test_adjust_tracks_counts_and_recount_agrees(app, user):
+    with app.app_context():
+        sample, _ = add_image(user)
+        assert counters.snapshot() == {'users': 1, 'samples': 1, 'images': 1, 'detections': 1}
+        db.session.refresh(sample)
+        assert (sample.image_count, sample.detection_count) == (1, 1)
+
+        counters.adjust(sample=sample, detections=4)
+        db.session.rollback()
+        assert counters.snapshot()['detections'] == 1
+
+        db.session.execute(db.update(Sample).values(image_count=0, detection_count=0))
+        db.session.query(counters.Counter).delete()
+        assert counters.snapshot()['images'] == 0
+        assert counters.recount() == {'users': 1, 'samples': 1, 'images': 1, 'detections': 1}
+        counters.recount_samples()
+        db.session.commit()
+        db.session.refresh(sample)
+        assert (sample.image_count, sample.detection_count) == (1, 1)
+
+
+def test_missing_counter_is_rebuilt_on_adjust(app, user):
+    with app.app_context():
+        add_image(user)
+        db.session.query(counters.Counter).filter_by(name='images').delete()
+        db.session.commit()
+        Image.query.delete()
+        counters.adjust(images=-1)
+        db.session.commit()
+        assert counters.snapshot()['images'] == 0
+
+
+def test_clear_all_removes_files(app, client, user, admin):
+    with app.app_context():
+        _, image = add_image(user)
+        path = storage.resolve(image.filepath)
+        derivatives = os.path.join(app.config['DERIVATIVES_FOLDER'], 'ab', image.content_hash)
+        os.makedirs(derivatives)
+        open(os.path.join(derivatives, 'thumb.jpg'), 'wb').close()
+    assert os.path.exists(path)
+
+    log_in(client, admin)
+    assert client.post('/admin/clear/all').status_code == 302
+    assert not os.path.exists(path)
+    assert not os.path.exists(derivatives)
+    with app.app_context():
+        assert StoredFile.query.count() == 0
+        assert counters.snapshot() == {'users': 1, 'samples': 0, 'images': 0, 'detections': 0}
+
+
+def test_clear_db_command_removes_files(app, user):
+    with app.app_context():
+        _, image = add_image(user)
+        path = storage.resolve(image.filepath)
+    result = app.test_cli_runner().invoke(args=['clear-db'])
+    assert result.exit_code == 0, result.output
+    assert not os.path.exists(path)
+    with app.app_context():
+        assert StoredFile.query.count() == 0
+        assert counters.snapshot()['users'] == 0
+
+
+def derivatives_of(app, content_hash):
+    path = os.path.join(app.config['DERIVATIVES_FOLDER'], content_hash[:2], content_hash)
+    os.makedirs(path)
+    open(os.path.join(path, 'thumb.jpg'), 'wb').close()
+    return path
+
+
+def test_deleting_a_sample_removes_unshared_derivatives(app, client, user, admin):
+    with app.app_context():
+        sample, image = add_image(user, b'own pixels', content_hash='cd' * 32)
+        _, shared = add_image(user, b'shared pixels')
+        other_sample, _ = add_image(user, b'shared copy')
+        sample_id, other_id = sample.id, other_sample.id
+        path = storage.resolve(image.filepath)
+        own, common = derivatives_of(app, image.content_hash), derivatives_of(app, shared.content_hash)
+        db.session.delete(shared)  # leaves another image with the shared content
+        db.session.commit()
+
+    log_in(client, admin)
+    assert client.get(f'/admin/delete/sample/{sample_id}').status_code == 302
+    assert not os.path.exists(path)
+    assert not os.path.exists(own)
+    assert os.path.exists(common)
+    assert client.get(f'/admin/delete/sample/{other_id}').status_code == 302
+    assert not os.path.exists(common)
+
+
+def test_deleting_a_user_removes_derivatives(app, client, user, admin):
+    with app.app_context():
+        _, image = add_image(user)
+        _, second = add_image(user, b'more pixels')  # same content hash, deleted in the same request
+        derivatives = derivatives_of(app, image.content_hash)
+    log_in(client, admin)
+    assert client.get(f'/admin/delete/user/{user}').status_code == 302
+    assert not os.path.exists(derivatives)
+    with app.app_context():
+        assert StoredFile.query.count() == 0
@@ -0,0 +1,105 @@
+import io
+import struct
+import threading
+import time
+import cv2
+import numpy as np
+import pytest
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+from conftest import log_in
+from app.admission import AdmissionController, estimate_cost, image_dimensions
+
+# Admission control: analyses share a memory budget first come first
+# served, the queue is bounded in length and wait, users are limited to a
+# few uploads in flight, and refusals carry a Retry-After estimate.
+
+
+def encoded(ext, width, height):
+    return io.BytesIO(cv2.imencode(ext, np.zeros((height, width), np.uint8))[1].tobytes())
+
+
+@pytest.mark.parametrize('ext', ['.png', '.jpg', '.tif'])
+def test_dimensions_from_header(ext):
+    stream = encoded(ext, 640, 480)
+    assert image_dimensions(stream) == (640, 480)
+    assert stream.tell() == 0
+
+
+def test_unknown_header_falls_back():
+    assert image_dimensions(io.BytesIO(b'GIF89a' + b'\0' * 32)) is None
+    assert image_dimensions(io.BytesIO(b'\xff\xd8\xff\xe0' + struct.pack('>H', 200))) is None
+    assert estimate_cost(None, 'standard') == estimate_cost((4000, 3000), 'standard')
+    assert estimate_cost((100, 100), 'fast') < estimate_cost((100, 100), 'precise')
+
+
+def test_jobs_within_budget_run_together():
+    controller = AdmissionController(budget=100, queue_limit=2, queue_timeout=1)
+    first = controller.acquire(60)
+    second = controller.acquire(40)
+    assert controller.snapshot()['in_use_bytes'] == 100
+    controller.release(first)
+    controller.release(second)
+    assert controller.snapshot()['running'] == 0
+
+
+def test_oversized_job_runs_alone():
+    controller = AdmissionController(budget=100, queue_limit=2, queue_timeout=1)
+    assert controller.acquire(500) == 100
+
+
+def test_queued_job_is_admitted_on_release():
+    controller = AdmissionController(budget=100, queue_limit=2, queue_timeout=5)
+    held = controller.acquire(80)
+    admitted = []
+    waiter = threading.Thread(target=lambda: admitted.append(controller.acquire(50)))
+    waiter.start()
+    time.sleep(0.1)
+    assert controller.snapshot()['queue_depth'] == 1
+    assert not admitted
+    controller.release(held, seconds=2.0)
+    waiter.join(1)
+    assert admitted == [50]
+
+
+def test_full_queue_and_timeout_are_503_with_retry_after():
+    controller = AdmissionController(budget=100, queue_limit=0, queue_timeout=0.05)
+    controller.acquire(100)
+    with pytest.raises(ServiceUnavailable) as full:
+        controller.acquire(10)
+    assert 1 <= full.value.retry_after <= 60
+
+    controller.queue_limit = 1
+    with pytest.raises(ServiceUnavailable):
+        controller.acquire(10)
+    assert controller.snapshot()['rejected'] == {'queue_full': 1, 'timeout': 1}
+    assert controller.snapshot()['queue_depth'] == 0
+
+
+def test_user_limit_is_429():
+    controller = AdmissionController(budget=100, queue_limit=2, queue_timeout=1, user_limit=1)
+    controller.acquire(10, user=1)
+    with pytest.raises(TooManyRequests) as limited:
+        controller.acquire(10, user=1)
+    assert limited.value.retry_after >= 1
+    controller.acquire(10, user=2)
+    controller.release(10, user=1)
+    controller.acquire(10, user=1)
+
+
+def test_busy_server_answers_503_with_header(app, client, user):
+    from app.database import db
+    from app.models import Sample
+
+    with app.app_context():
+        sample = Sample(name='flow cell', user_id=user)
+        db.session.add(sample)
+        db.session.commit()
+        sample_id = sample.id
+    controller = app.extensions['admission']
+    controller.queue_limit = 0
+    controller.acquire(controller.budget)
+    log_in(client, user)
+    response = client.post(f'/sample/{sample_id}', data={'image': (encoded('.png', 64, 64), 'a.png')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 503
+    assert int(response.headers['Retry-After']) >= 1
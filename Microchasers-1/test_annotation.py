@@ -0,0 +1,132 @@
+import threading
+import time
+import cv2
+import numpy as np
+import pytest
+from conftest import log_in
+from app.database import db
+from app.media import routes as media_routes
+from app.models import Sample, Image, Detection, User
+from app.services import storage
+from app.services.annotation import AnnotationCache
+
+# Overlays are rendered on demand into a byte-bounded LRU cache, once per
+# key however many requests ask at the same time, and the route's ETag
+# follows the cache key, so it changes with the detections.
+
+
+def test_lru_is_bounded_in_bytes():
+    cache = AnnotationCache(max_bytes=100, workers=1)
+    for key in 'abc':
+        cache.get(key, lambda: b'x' * 40)
+    assert (cache.lookup('a'), cache.total_bytes) == (None, 80)
+    cache.lookup('b')  # now the most recently used
+    cache.get('d', lambda: b'x' * 40)
+    assert cache.lookup('c') is None and cache.lookup('b') is not None
+    assert cache.total_bytes == 80
+
+
+def test_oversized_and_failed_renders_are_not_kept():
+    cache = AnnotationCache(max_bytes=100, workers=1)
+    assert len(cache.get('big', lambda: b'x' * 101)) == 101
+    assert cache.get('unreadable', lambda: None) is None
+    def broken():
+        raise ValueError('bad')
+
+    with pytest.raises(ValueError):
+        cache.get('broken', broken)
+    time.sleep(0.05)
+    assert cache.total_bytes == 0
+    assert cache.get('broken', lambda: b'ok') == b'ok'
+
+
+def test_concurrent_requests_share_one_render():
+    cache = AnnotationCache(workers=2)
+    renders = []
+    release = threading.Event()
+
+    def render():
+        renders.append(1)
+        release.wait(5)
+        return b'overlay'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('k', render))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert results == [b'overlay'] * 4
+    assert len(renders) == 1
+
+
+@pytest.fixture
+def image_id(app, user):
+    with app.app_context():
+        frame = np.full((400, 600, 3), 40, np.uint8)
+        cv2.circle(frame, (300, 200), 20, (230, 230, 230), -1)
+        path = storage.temp_path('.png')
+        cv2.imwrite(path, frame)
+        filepath = storage.store_file(path)
+        sample = Sample(name='flow cell', user_id=user)
+        image = Image(filepath=filepath, original_filepath=filepath, sample=sample, status='processed')
+        db.session.add_all([sample, image, Detection(image=image, x_coordinate=300, y_coordinate=200, size=1256.0,
+                                                     shape='bead', color='#e6e6e6')])
+        db.session.commit()
+        return image.id
+
+
+@pytest.fixture
+def renders(monkeypatch):
+    counted = []
+    real = media_routes.render_annotated
+
+    def render(*args, **kwargs):
+        counted.append(kwargs['max_edge'])
+        return real(*args, **kwargs)
+
+    monkeypatch.setattr(media_routes, 'render_annotated', render)
+    return counted
+
+
+def test_overlay_is_rendered_once_and_revalidated(app, client, user, image_id, renders):
+    log_in(client, user)
+    first = client.get(f'/media/annotated/{image_id}/preview')
+    assert first.status_code == 200
+    assert first.mimetype.startswith('image/')
+    assert first.cache_control.private and first.cache_control.no_cache
+    etag, _ = first.get_etag()
+
+    assert client.get(f'/media/annotated/{image_id}/preview').data == first.data
+    revalidated = client.get(f'/media/annotated/{image_id}/preview', headers={'If-None-Match': f'"{etag}"'})
+    assert revalidated.status_code == 304
+    assert len(renders) == 1
+
+    full = client.get(f'/media/annotated/{image_id}/full')
+    assert full.get_etag()[0] != etag
+    assert len(renders) == 2
+
+
+def test_etag_changes_with_the_detections(app, client, user, image_id, renders):
+    log_in(client, user)
+    etag, _ = client.get(f'/media/annotated/{image_id}/preview').get_etag()
+    with app.app_context():
+        db.session.add(Detection(image_id=image_id, x_coordinate=50, y_coordinate=50, size=300.0, shape='fiber',
+                                 color='#1f3fbf'))
+        db.session.commit()
+    response = client.get(f'/media/annotated/{image_id}/preview', headers={'If-None-Match': f'"{etag}"'})
+    assert response.status_code == 200
+    assert response.get_etag()[0] != etag
+    assert len(renders) == 2
+
+
+def test_overlay_is_private(app, client, image_id):
+    with app.app_context():
+        other = User(username='other', email='other@example.com')
+        db.session.add(other)
+        db.session.commit()
+        other_id = other.id
+    log_in(client, other_id)
+    assert client.get(f'/media/annotated/{image_id}/preview').status_code == 403
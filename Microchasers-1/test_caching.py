@@ -0,0 +1,118 @@
+import pytest
+from conftest import log_in
+from app.caching import FragmentCache
+from app.database import db
+from app.models import Sample, Image, Detection, SensorReading
+
+# Cached fragments and ETags follow the version stamps: any write under a
+# sample must change them, and an unchanged sample must answer 304.
+
+
+@pytest.fixture
+def sample_id(app, user):
+    with app.app_context():
+        sample = Sample(name='flow cell', user_id=user)
+        image = Image(filepath='uploads/aa/bb/x.png', sample=sample, status='processed')
+        db.session.add_all([sample, image, Detection(image=image, x_coordinate=1, y_coordinate=2, size=3.0,
+                                                     shape='round', color='red')])
+        db.session.commit()
+        return sample.id
+
+
+def export(client, sample_id, etag=None):
+    headers = {'If-None-Match': etag} if etag else {}
+    return client.get(f'/api/sample/{sample_id}/export/json', headers=headers)
+
+
+def test_unchanged_export_is_not_modified(app, client, user, sample_id):
+    log_in(client, user)
+    first = export(client, sample_id)
+    assert first.status_code == 200
+    again = export(client, sample_id, first.headers['ETag'])
+    assert again.status_code == 304
+    assert again.headers['ETag'] == first.headers['ETag']
+
+
+def test_new_sensor_reading_changes_the_etag(app, client, user, sample_id):
+    log_in(client, user)
+    first = export(client, sample_id)
+    assert first.json['sensor_readings'] == []
+    with app.app_context():
+        db.session.add(SensorReading(sample_id=sample_id, temperature=21.5, ph=7.1))
+        db.session.commit()
+    after = export(client, sample_id, first.headers['ETag'])
+    assert after.status_code == 200
+    assert after.headers['ETag'] != first.headers['ETag']
+    assert [reading['temperature'] for reading in after.json['sensor_readings']] == [21.5]
+
+    with app.app_context():
+        db.session.delete(SensorReading.query.one())
+        db.session.commit()
+    removed = export(client, sample_id, after.headers['ETag'])
+    assert removed.status_code == 200
+    assert removed.json['sensor_readings'] == []
+
+
+def test_new_detection_changes_dashboard_and_export(app, client, user, sample_id):
+    log_in(client, user)
+    with app.app_context():
+        image_id = Image.query.one().id
+    dashboard = client.get(f'/dashboard/{image_id}')
+    exported = export(client, sample_id)
+    with app.app_context():
+        db.session.add(Detection(image_id=image_id, x_coordinate=5, y_coordinate=6, size=7.0, shape='fiber',
+                                 color='blue'))
+        db.session.commit()
+    assert client.get(f'/dashboard/{image_id}',
+                      headers={'If-None-Match': dashboard.headers['ETag']}).status_code == 200
+    after = export(client, sample_id, exported.headers['ETag'])
+    assert after.status_code == 200
+    assert len(after.json['images'][0]['detections']) == 2
+
+
+def test_etag_is_per_user(app, client, user, sample_id):
+    from app.models import User
+
+    log_in(client, user)
+    with app.app_context():
+        image_id = Image.query.one().id
+        other = User(username='other', email='other@example.com')
+        db.session.add(other)
+        db.session.commit()
+        other_id = other.id
+    etag = client.get(f'/dashboard/{image_id}').headers['ETag']
+    log_in(client, other_id)
+    # Not the owner: redirected, never a 304 for someone else's page
+    assert client.get(f'/dashboard/{image_id}', headers={'If-None-Match': etag}).status_code == 302
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = FragmentCache(max_bytes=80)
+    cache.set('a', b'x' * 10)
+    cache.set('b', b'y' * 10)
+    assert cache.get('a') == b'x' * 10
+    for n in range(7):
+        cache.set(('filler', n), b'z' * 10)
+    # 'a' was used since 'b' was stored, so 'b' went first
+    assert cache.get('b') is None
+    assert cache.get('a') == b'x' * 10
+    assert cache.bytes == 80
+    # Larger than an eighth of the budget: never held in memory
+    cache.set('big', b'q' * 11)
+    assert cache.get('big') is None
+
+
+def test_disk_cache_is_shared_and_pruned(tmp_path):
+    writer = FragmentCache(1024, directory=str(tmp_path), disk_max_bytes=300, namespace='v1')
+    reader = FragmentCache(1024, directory=str(tmp_path), disk_max_bytes=300, namespace='v1')
+    writer.set('page', b'rendered')
+    assert reader.get('page') == b'rendered'
+    assert reader.stats['disk_hits'] == 1
+    # Another deployment never sees the entries of this one
+    assert FragmentCache(1024, directory=str(tmp_path), namespace='v2').get('page') is None
+
+    for n in range(10):
+        writer.set(('filler', n), b'z' * 100)
+    writer.prune()
+    total = sum(path.stat().st_size for path in tmp_path.rglob('*') if path.is_file())
+    assert total <= 300
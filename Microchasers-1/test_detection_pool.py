@@ -0,0 +1,49 @@
+import os
+import signal
+import time
+import pytest
+from app.services import detection_pool
+from app.services.detection_pool import DetectionFailed, run_in_pool
+
+# The shared detection pool must survive its processes dying and must turn
+# slow analyses into failures rather than errors in the request.
+
+
+@pytest.fixture
+def pool_app(app):
+    app.config['DETECTION_PROCESSES'] = 1
+    with app.app_context():
+        yield app
+    detection_pool.shutdown()
+
+
+def test_pool_is_replaced_after_a_process_dies(pool_app):
+    assert run_in_pool(pow, 2, 10) == 1024
+    executor = detection_pool.get_executor()
+    for process in list(executor._processes.values()):
+        os.kill(process.pid, signal.SIGKILL)
+    time.sleep(0.2)
+    # The broken pool is discarded and the call retried on a new one
+    assert run_in_pool(pow, 2, 11) == 2048
+    assert detection_pool.get_executor() is not executor
+    assert run_in_pool(pow, 2, 12) == 4096
+
+
+def test_task_that_kills_its_process_fails_once(pool_app):
+    with pytest.raises(DetectionFailed):
+        run_in_pool(os._exit, 1)
+    assert run_in_pool(pow, 3, 2) == 9
+
+
+def test_timeout_is_a_failure(pool_app):
+    with pytest.raises(DetectionFailed):
+        run_in_pool(time.sleep, 5, timeout=0.2)
+
+
+def test_analysis_that_fails_in_the_pool_counts_as_failed(pool_app, monkeypatch, tmp_path):
+    def time_out(function, *args, timeout=None):
+        raise DetectionFailed('timed out')
+
+    monkeypatch.setattr(detection_pool, 'run_in_pool', time_out)
+    analysis = detection_pool.run_analysis(str(tmp_path / 'image.png'), timeout=1)
+    assert analysis['detections'] is None
@@ -121,9 +121,9 @@ def test_export_feature():
         csv_content = response_csv.content.decode('utf-8')
         csv_reader = csv.reader(io.StringIO(csv_content))
         header = next(csv_reader)
-        assert header == ['image_id', 'detection_id', 'x_coordinate', 'y_coordinate', 'confidence']
+        assert header == ['image_id', 'detection_id', 'x_coordinate', 'y_coordinate', 'size', 'shape', 'color']
         first_row = next(csv_reader)
-        assert len(first_row) == 5
+        assert len(first_row) == 7
         print("CSV export verified successfully.")
     except (StopIteration, AssertionError) as e:
         print(f"CSV data validation failed: {e}")
@@ -0,0 +1,37 @@
+import os
+from conftest import log_in
+from app.database import db
+from app.models import Image, StoredFile, User
+from app.services import counters, fixtures, storage
+
+# Generated fixtures look like uploaded data to every view: each image
+# shows a stored file with derivatives, and holds a reference on it.
+
+
+def test_fixture_images_are_served(app, client):
+    with app.app_context():
+        written = fixtures.generate(2, 2, 3, 5, 2)
+        assert (written['images'], written['detections']) == (12, 60)
+        filepaths = {filepath for (filepath,) in db.session.query(Image.filepath).distinct()}
+        assert len(filepaths) == 1
+        filepath = filepaths.pop()
+        assert os.path.exists(storage.resolve(filepath))
+        assert StoredFile.query.filter_by(path=filepath).one().refcount == 12
+        assert counters.snapshot()['images'] == 12
+        image = Image.query.first()
+        owner = image.sample.user_id
+        image_id, content_hash = image.id, image.content_hash
+
+        # A second run shares the stored placeholder
+        fixtures.generate(1, 1, 2, 1, 0)
+        assert StoredFile.query.count() == 1
+        assert StoredFile.query.one().refcount == 14
+        assert User.query.count() == 3
+
+    for size in ('thumb.jpg', 'preview.jpg', 'full.png'):
+        assert client.get(f'/media/{content_hash}/{size}').status_code == 200
+    log_in(client, owner)
+    response = client.get(f'/media/annotated/{image_id}/preview')
+    assert response.status_code == 200
+    assert response.data
+    assert client.get(f'/dashboard/{image_id}').status_code == 200
@@ -0,0 +1,70 @@
+import cv2
+import numpy as np
+import pytest
+from app.services.geometry import MAGIC, decode_contours, encode_contours, shape_metrics, split_contours
+
+# Stored contours round-trip exactly, and shapes measured from them match
+# what OpenCV measures on the original contours.
+
+
+def contours_of(image):
+    found, _ = cv2.findContours(image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return sorted(found, key=lambda c: tuple(c[0, 0]))
+
+
+@pytest.fixture
+def shapes():
+    image = np.zeros((400, 600), np.uint8)
+    cv2.circle(image, (80, 80), 40, 255, -1)
+    cv2.rectangle(image, (200, 50), (380, 90), 255, -1)
+    cv2.ellipse(image, (450, 250), (90, 30), 30, 0, 360, 255, -1)
+    cv2.fillPoly(image, [np.array([[50, 300], [150, 380], [20, 390]])], 255)
+    return contours_of(image)
+
+
+def test_round_trip(shapes):
+    points, offsets = decode_contours(encode_contours(shapes))
+    restored = split_contours(points, offsets)
+    assert len(restored) == len(shapes)
+    for original, decoded in zip(shapes, restored):
+        assert np.array_equal(original, decoded)
+
+
+def test_far_coordinates_and_empty_input():
+    far = [np.array([[0, 0], [100000, 5], [-3, 70000]])]
+    points, offsets = decode_contours(encode_contours(far))
+    assert np.array_equal(points, far[0])
+    assert list(offsets) == [0, 3]
+
+    points, offsets = decode_contours(encode_contours([]))
+    assert len(points) == 0 and list(offsets) == [0]
+    points, offsets = decode_contours(None)
+    assert len(points) == 0 and list(offsets) == [0]
+
+
+def test_compact():
+    # Neighbouring vertices take about one byte per coordinate
+    circle = contours_of(cv2.circle(np.zeros((200, 200), np.uint8), (100, 100), 60, 255, -1))
+    points = sum(len(c) for c in circle)
+    assert len(encode_contours(circle)) <= len(MAGIC) + 4 + 2 * points + 4
+
+
+def test_rejects_other_blobs():
+    with pytest.raises(ValueError):
+        decode_contours(b'nope')
+
+
+def test_metrics_match_opencv(shapes):
+    metrics = shape_metrics(*decode_contours(encode_contours(shapes)))
+    for i, contour in enumerate(shapes):
+        moments = cv2.moments(contour)
+        assert metrics['area'][i] == pytest.approx(cv2.contourArea(contour))
+        assert metrics['perimeter'][i] == pytest.approx(cv2.arcLength(contour, True))
+        assert metrics['centroid_x'][i] == pytest.approx(moments['m10'] / moments['m00'])
+        assert metrics['centroid_y'][i] == pytest.approx(moments['m01'] / moments['m00'])
+    # The rectangle is 181 x 41 pixels, corner to corner
+    rectangle = 2
+    assert metrics['feret_min'][rectangle] == pytest.approx(40, abs=0.5)
+    assert metrics['aspect_ratio'][rectangle] > 4
+    circle = 1
+    assert metrics['circularity'][circle] > 0.85
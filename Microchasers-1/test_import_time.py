@@ -0,0 +1,52 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+# Total import time allowed for a cold create_app(), in microseconds.
+# Flask, SQLAlchemy, Alembic and Socket.IO account for nearly all of it.
+IMPORT_BUDGET_US = 1500000
+
+# Modules that must only load when an image is actually analysed
+HEAVY_MODULES = ('cv2', 'numpy')
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def import_times():
+    """Runs create_app() in a fresh interpreter and parses its -X importtime report."""
+    code = f"import sys; sys.path.insert(0, {APP_DIR!r}); from app import create_app; create_app()"
+    # Run from a scratch directory so the startup log isn't written into the repo
+    with tempfile.TemporaryDirectory() as cwd:
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                                cwd=cwd, capture_output=True, text=True, check=True)
+    times = {}
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line.split(':', 1)[1].split('|')
+        # Nested imports are indented, top-level ones add up to the total
+        if not name.startswith('  '):
+            total += int(cumulative_us)
+        times[name.strip()] = int(cumulative_us)
+    return times, total
+
+
+def test_heavy_modules_not_imported():
+    times, _ = import_times()
+    loaded = [name for name in HEAVY_MODULES if name in times]
+    assert not loaded, f'create_app() imported {", ".join(loaded)}'
+
+
+def test_import_budget():
+    _, total = import_times()
+    assert total <= IMPORT_BUDGET_US, \
+        f"create_app() imports took {total / 1000:.0f} ms, budget is {IMPORT_BUDGET_US / 1000:.0f} ms"
+
+
+if __name__ == "__main__":
+    times, total = import_times()
+    print(f"imports: {total / 1000:.1f} ms (budget {IMPORT_BUDGET_US / 1000:.0f} ms)")
+    for name in HEAVY_MODULES:
+        print(f"{name}: {'imported' if name in times else 'not imported'}")
@@ -0,0 +1,88 @@
+import os
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+import cv2
+import numpy as np
+import pytest
+from app.database import db
+from app.models import User, Image
+from app.services.detection_pool import ProcessPool
+from app.services.importer import Importer
+
+# An import records every file: one whose analysis raises, or whose pool
+# process dies, becomes a failed image and the rest carry on.
+
+
+class Flaky:
+    """Runs tasks inline, raising instead for the files listed in ``errors``, once each."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        self.submitted = []
+
+    def submit(self, function, *args):
+        self.submitted.append(os.path.basename(args[0]))
+        future = Future()
+        error = self.errors.pop(os.path.basename(args[0]), None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(function(*args))
+        return future
+
+
+@pytest.fixture
+def folder(tmp_path):
+    for name in ('a.png', 'b.png', 'c.png'):
+        image = np.full((120, 160, 3), 40, np.uint8)
+        cv2.circle(image, (80, 60), 10, (230, 230, 230), -1)
+        cv2.putText(image, name, (5, 110), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (90, 90, 90), 1)
+        cv2.imwrite(str(tmp_path / name), image)
+    return tmp_path
+
+
+def run_import(app, user, folder, executor):
+    with app.app_context():
+        importer = Importer(executor, db.session.get(User, user), app.config['DERIVATIVES_FOLDER'], batch_size=2)
+        for name in ('a.png', 'b.png', 'c.png'):
+            importer.add('flow cell', str(folder / name))
+        totals, _ = importer.finish()
+        statuses = {os.path.basename(path): status for path, status in
+                    db.session.query(Image.original_filepath, Image.status)}
+        return totals, sorted(statuses.values())
+
+
+@pytest.mark.parametrize('error', [cv2.error('bad file'), MemoryError(), ValueError('bad file')])
+def test_failed_analysis_is_recorded_and_import_continues(app, user, folder, error):
+    totals, statuses = run_import(app, user, folder, Flaky({'b.png': error}))
+    assert (totals['imported'], totals['failed']) == (3, 1)
+    assert statuses == ['failed', 'processed', 'processed']
+
+
+def test_broken_pool_is_retried_once(app, user, folder):
+    executor = Flaky({'a.png': BrokenProcessPool()})
+    totals, statuses = run_import(app, user, folder, executor)
+    assert executor.submitted == ['a.png', 'b.png', 'c.png', 'a.png']
+    assert totals['failed'] == 0 and statuses == ['processed'] * 3
+
+
+def test_file_that_breaks_the_pool_twice_fails(app, user, folder):
+    class Broken(Flaky):
+        def submit(self, function, *args):
+            if os.path.basename(args[0]) == 'c.png':
+                self.errors['c.png'] = BrokenProcessPool()
+            return super().submit(function, *args)
+
+    totals, statuses = run_import(app, user, folder, Broken({}))
+    assert (totals['imported'], totals['failed']) == (3, 1)
+
+
+def test_process_pool_replaces_itself(app):
+    with app.app_context():
+        pool = ProcessPool(1)
+        try:
+            with pytest.raises(BrokenProcessPool):
+                pool.submit(os._exit, 1).result(30)
+            assert pool.submit(pow, 2, 10).result(30) == 1024
+        finally:
+            pool.shutdown()
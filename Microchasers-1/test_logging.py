@@ -0,0 +1,83 @@
+import json
+import logging
+import os
+from flask import Flask
+from flask.logging import default_handler
+from app import logging_config
+from app.logging_config import DeferredQueueHandler, stop_listener
+
+# Request threads only enqueue records: the queue is the one sink of the
+# app logger, and the listener writes the JSON lines to the log file.
+
+
+def make_app(tmp_path, name='logging_test'):
+    app = Flask(name)
+    app.config.update(LOG_FILE=str(tmp_path / 'app.log'), LOG_MAX_BYTES=1024 * 1024, LOG_BACKUP_COUNT=1,
+                      LOG_FORMAT='json', LOG_REQUESTS=True)
+    app.add_url_rule('/ping', 'ping', lambda: 'pong')
+    # As Flask sets it up when no other handler is configured
+    app.logger.addHandler(default_handler)
+    logging_config.init_app(app)
+    return app
+
+
+def test_queue_is_the_only_sink(tmp_path):
+    app = make_app(tmp_path)
+    try:
+        assert [type(handler) for handler in app.logger.handlers] == [DeferredQueueHandler]
+        assert not app.logger.propagate
+        # Set up again, e.g. by another app in the same process: still one queue
+        logging_config.init_app(app)
+        assert len(app.logger.handlers) == 1
+    finally:
+        stop_listener(app.extensions['log_listener'])
+
+
+def test_access_line_reaches_the_file_and_not_stderr(tmp_path, capfd):
+    app = make_app(tmp_path)
+    response = app.test_client().get('/ping', headers={'X-Request-ID': 'abc123'})
+    assert response.headers['X-Request-ID'] == 'abc123'
+    stop_listener(app.extensions['log_listener'])
+    assert 'GET /ping' not in capfd.readouterr().err
+
+    with open(app.config['LOG_FILE']) as f:
+        entries = [json.loads(line) for line in f]
+    access = [entry for entry in entries if entry.get('path') == '/ping']
+    assert len(access) == 1
+    assert access[0]['status'] == 200
+    assert access[0]['request_id'] == 'abc123'
+    assert access[0]['level'] == logging.getLevelName(logging.INFO)
+
+
+def test_fork_hook_is_installed_once(tmp_path, monkeypatch):
+    registered = []
+    monkeypatch.setattr(logging_config, '_hooks_installed', False)
+    monkeypatch.setattr(os, 'register_at_fork', lambda **hooks: registered.append(hooks))
+    monkeypatch.setattr(logging_config.atexit, 'register', lambda function: None)
+    apps = [make_app(tmp_path / name) for name in ('first', 'second')]
+    for app in apps:
+        stop_listener(app.extensions['log_listener'])
+    assert len(registered) == 1
+
+
+def test_running_listeners_restart_in_the_child(tmp_path):
+    # Apps of their own name, or the second would take over the first one's logger
+    running = make_app(tmp_path / 'running', 'logging_running')
+    stopped = make_app(tmp_path / 'stopped', 'logging_stopped')
+    listener = running.extensions['log_listener']
+    stop_listener(stopped.extensions['log_listener'])
+    stop_listener(stopped.extensions['log_listener'])
+    assert not stopped.extensions['log_listener'].running
+
+    parent_queue = listener.queue_handler.queue
+    # As the fork hook runs it in a forked child
+    logging_config._restart_in_child()
+    assert listener.queue_handler.queue is not parent_queue
+    assert not stopped.extensions['log_listener'].running
+    parent_queue.put_nowait(None)  # the parent's thread, which a real child wouldn't have
+
+    running.logger.info('from the child')
+    stop_listener(listener)
+    assert not listener.running
+    with open(running.config['LOG_FILE']) as f:
+        assert [json.loads(line)['message'] for line in f][-1] == 'from the child'
@@ -0,0 +1,46 @@
+import cv2
+import numpy as np
+import pytest
+from app.media.routes import CACHE_MAX_AGE
+from app.services.derivatives import DERIVATIVE_SIZES, generate_derivatives
+
+# Derivatives are served under their content digest: the URL of a given
+# file never changes, so it is cached for good and revalidates by ETag.
+
+
+@pytest.fixture
+def digest(app, tmp_path):
+    path = str(tmp_path / 'frame.png')
+    cv2.imwrite(path, np.random.default_rng(0).integers(0, 256, (900, 1200, 3), dtype=np.uint8))
+    return generate_derivatives(path, app.config['DERIVATIVES_FOLDER'])
+
+
+@pytest.mark.parametrize('filename', ['thumb.jpg', 'preview.jpg', 'full.png'])
+def test_derivative_is_cached_for_good(client, digest, filename):
+    response = client.get(f'/media/{digest}/{filename}')
+    assert response.status_code == 200
+    assert response.cache_control.public and response.cache_control.immutable
+    assert response.cache_control.max_age == CACHE_MAX_AGE
+    size = filename.split('.')[0]
+    assert response.get_etag() == (f'{digest}-{size}', False)
+
+
+def test_matching_etag_is_304(client, digest):
+    response = client.get(f'/media/{digest}/thumb.jpg', headers={'If-None-Match': f'"{digest}-thumb"'})
+    assert response.status_code == 304
+    assert response.data == b''
+    other = client.get(f'/media/{digest}/thumb.jpg', headers={'If-None-Match': f'"{digest}-preview"'})
+    assert other.status_code == 200
+
+
+def test_thumbnail_is_downscaled(client, digest):
+    data = client.get(f'/media/{digest}/thumb.jpg').data
+    thumb = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    assert max(thumb.shape[:2]) <= DERIVATIVE_SIZES['thumb']
+
+
+@pytest.mark.parametrize('path', ['{digest}/huge.jpg', '{short}/thumb.jpg', '{digest}/..%2f..%2fsecret.jpg',
+                                  '{other}/thumb.jpg'])
+def test_unknown_derivatives_are_404(client, digest, path):
+    url = '/media/' + path.format(digest=digest, short=digest[:10], other='0' * 64)
+    assert client.get(url).status_code == 404
@@ -0,0 +1,39 @@
+import importlib.util
+import glob
+import os
+import numpy as np
+import pytest
+from app.services import palette
+
+# Stored colour codes are frozen, so the classification is pinned here: the
+# named colours must keep their class, and the table the last colour
+# migration wrote with must stay the one the app classifies new detections with.
+
+ANCHORS = {
+    '#ffffff': palette.WHITE, '#808080': palette.GREY, '#000000': palette.BLACK,
+    '#ff0000': palette.RED, '#ffa500': palette.ORANGE, '#ffff00': palette.YELLOW,
+    '#008000': palette.GREEN, '#008080': palette.TEAL, '#0000ff': palette.BLUE,
+    '#800080': palette.PURPLE, '#ffc0cb': palette.PINK, '#ff69b4': palette.PINK,
+    '#8b4513': palette.BROWN, '#800000': palette.RED, '#4b0082': palette.PURPLE,
+}
+
+
+@pytest.mark.parametrize('color, code', ANCHORS.items())
+def test_named_colours(color, code):
+    assert palette.color_name(palette.classify_hex([color])[0]) == palette.color_name(code)
+
+
+def test_swatches_classify_as_their_class():
+    codes = palette.classify_hex([swatch for _, swatch in palette.PALETTE])
+    assert codes == list(range(len(palette.PALETTE)))
+
+
+def test_migration_table_matches_the_app():
+    path, = glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations', 'versions',
+                                   'd6f1a9c3e572_*.py'))
+    spec = importlib.util.spec_from_file_location('colour_migration', path)
+    migration = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migration)
+    assert np.array_equal(migration.lookup_table(), palette.lookup_table())
+    colors = [f'#{v:06x}' for v in np.random.default_rng(0).integers(0, 1 << 24, 2000)]
+    assert migration.classify_hex(migration.lookup_table(), colors) == palette.classify_hex(colors)
@@ -0,0 +1,84 @@
+import io
+import cv2
+import numpy as np
+from conftest import log_in
+from app.services import perceptual
+
+# Near-duplicate detection: distinct particle fields must never match,
+# while a re-encoded or re-exposed copy of the same field must.
+
+
+def particle_field(seed, particles, noise_seed=0):
+    """A dark frame with a few bright round particles and sensor noise, like a microscope capture."""
+    rng = np.random.default_rng(seed)
+    image = np.full((600, 800), 40, np.uint8)
+    for _ in range(particles):
+        center = (int(rng.integers(20, 780)), int(rng.integers(20, 580)))
+        cv2.circle(image, center, int(rng.integers(5, 14)), int(rng.integers(150, 255)), -1)
+    noise = np.random.default_rng(noise_seed).normal(0, 3, image.shape)
+    return np.clip(image + noise, 0, 255).astype(np.uint8)
+
+
+def write(tmp_path, name, image, ext='.png', params=()):
+    path = str(tmp_path / (name + ext))
+    cv2.imwrite(path, image, list(params))
+    return path
+
+
+def test_distinct_particle_fields_do_not_match(tmp_path):
+    hashes = [perceptual.phash(write(tmp_path, f'field{n}', particle_field(n, particles)))
+              for n, particles in enumerate([3, 4, 6, 7, 12])]
+    assert None not in hashes
+    assert all(perceptual.is_informative(value) for value in hashes)
+    for i, a in enumerate(hashes):
+        for b in hashes[i + 1:]:
+            assert perceptual.hamming(a, b) > 10
+
+
+def test_reencoded_copy_matches(tmp_path):
+    field = particle_field(1, 6, noise_seed=1)
+    original = perceptual.phash(write(tmp_path, 'original', field))
+    jpeg = perceptual.phash(write(tmp_path, 'copy', field, '.jpg', (cv2.IMWRITE_JPEG_QUALITY, 70)))
+    exposure = perceptual.phash(write(tmp_path, 'next', particle_field(1, 6, noise_seed=2)))
+    assert perceptual.hamming(original, jpeg) <= 3
+    assert perceptual.hamming(original, exposure) <= 3
+
+
+def test_flat_and_unreadable_images_have_no_hash(tmp_path):
+    assert perceptual.phash(write(tmp_path, 'flat', np.full((200, 200), 40, np.uint8))) is None
+    assert perceptual.phash(str(tmp_path / 'missing.png')) is None
+    assert not perceptual.is_informative(0)
+    assert not perceptual.is_informative(-1)
+
+
+def upload(client, sample_id, image, name):
+    ok, data = cv2.imencode('.png', image)
+    return client.post(f'/sample/{sample_id}', data={'image': (io.BytesIO(data.tobytes()), name)},
+                       content_type='multipart/form-data')
+
+
+def test_upload_of_distinct_field_is_analysed(app, client, user):
+    from app.database import db
+    from app.models import Sample, Image
+
+    with app.app_context():
+        sample = Sample(name='flow cell', user_id=user)
+        db.session.add(sample)
+        db.session.commit()
+        sample_id = sample.id
+    log_in(client, user)
+
+    assert upload(client, sample_id, particle_field(1, 6), 'a.png').status_code == 302
+    assert upload(client, sample_id, particle_field(2, 4), 'b.png').status_code == 302
+    assert upload(client, sample_id, particle_field(1, 6, noise_seed=5), 'c.png').status_code == 302
+
+    with app.app_context():
+        first, second, third = Image.query.order_by(Image.id).all()
+        assert first.status == second.status == 'processed'
+        assert second.duplicate_of_id is None
+        assert second.detections.count() != first.detections.count()
+        # The default policy only marks the copy, its detections are never swapped in
+        assert app.config['NEAR_DUPLICATE_POLICY'] == 'mark'
+        assert third.status == 'duplicate'
+        assert third.duplicate_of_id == first.id
+        assert third.detections.count() == 0
@@ -0,0 +1,49 @@
+import pytest
+from conftest import log_in
+from app.database import db
+from app.models import Sample, User
+
+# Joining a sample's room is only allowed for its owner; malformed joins
+# are refused quietly instead of raising in the socket handler.
+
+
+@pytest.fixture
+def socket(app, client, user):
+    from app.realtime import socketio
+
+    log_in(client, user)
+    socket = socketio.test_client(app, flask_test_client=client)
+    yield socket
+    socket.disconnect()
+
+
+def make_sample(app, user_id):
+    with app.app_context():
+        sample = Sample(name='flow cell', user_id=user_id)
+        db.session.add(sample)
+        db.session.commit()
+        return sample.id
+
+
+def test_owner_joins_own_sample(app, user, socket):
+    sample_id = make_sample(app, user)
+    assert socket.emit('join_sample', {'sample_id': sample_id}, callback=True) is True
+    assert socket.emit('join_sample', {'sample_id': str(sample_id)}, callback=True) is True
+
+
+def test_join_of_another_users_sample_is_refused(app, socket):
+    with app.app_context():
+        other = User(username='other', email='other@example.com')
+        db.session.add(other)
+        db.session.commit()
+        other_id = other.id
+    sample_id = make_sample(app, other_id)
+    assert socket.emit('join_sample', {'sample_id': sample_id}, callback=True) is False
+
+
+@pytest.mark.parametrize('data', [{}, {'sample_id': None}, {'sample_id': 'abc'}, {'sample_id': '-1'},
+                                  {'sample_id': 1.5}, {'sample_id': True}, {'sample_id': [1]}, 'sample', None])
+def test_malformed_join_is_refused(app, socket, data):
+    assert socket.emit('join_sample', data, callback=True) is False
+    socket.emit('leave_sample', data)
+    assert socket.is_connected()
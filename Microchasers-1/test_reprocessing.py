@@ -0,0 +1,107 @@
+import os
+from concurrent.futures import Future
+import cv2
+import numpy as np
+import pytest
+from app.database import db
+from app.models import Sample, Image, Detection
+from app.services import reprocessing, storage
+
+# Reprocessing re-detects on the unannotated original: for images stored
+# before originals were kept it is recovered from the '_processed' naming
+# convention, and images without one are counted as failed, untouched.
+
+
+class Inline:
+    def submit(self, function, *args):
+        future = Future()
+        future.set_result(function(*args))
+        return future
+
+
+def field(particles, overlay=False):
+    image = np.full((300, 400, 3), 40, np.uint8)
+    for n in range(particles):
+        cv2.circle(image, (40 + 70 * n, 150), 10, (230, 230, 230), -1)
+    if overlay:
+        # What the old upload path drew: outlines and labels around each particle
+        for n in range(particles):
+            cv2.rectangle(image, (20 + 70 * n, 120), (60 + 70 * n, 180), (0, 255, 0), 2)
+            cv2.putText(image, str(n), (20 + 70 * n, 110), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+    return image
+
+
+def write_flat(app, name, image):
+    filepath = f'{app.config["UPLOAD_URL_PREFIX"]}/{name}'
+    path = storage.resolve(filepath)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    cv2.imwrite(path, image)
+    return filepath
+
+
+@pytest.fixture
+def legacy(app, user):
+    """Two images stored the old way, one of which lost its original."""
+    with app.app_context():
+        sample = Sample(name='flow cell', user_id=user)
+        write_flat(app, 'kept.png', field(3))
+        recovered = Image(filepath=write_flat(app, 'kept_processed.png', field(3, overlay=True)),
+                          sample=sample, status='processed')
+        orphan = Image(filepath=write_flat(app, 'lost_processed.png', field(2, overlay=True)),
+                       sample=sample, status='processed')
+        db.session.add_all([sample, recovered, orphan,
+                            Detection(image=orphan, x_coordinate=1, y_coordinate=1, size=1.0, shape='round',
+                                      color='red')])
+        db.session.commit()
+        return recovered.id, orphan.id
+
+
+def test_original_is_recovered_and_orphans_fail(app, legacy, tmp_path):
+    recovered_id, orphan_id = legacy
+    with app.app_context():
+        totals = reprocessing.reprocess(Inline(), app.config['DERIVATIVES_FOLDER'], reprocessing.image_query(),
+                                        str(tmp_path / 'checkpoint.json'), {})
+        assert (totals['processed'], totals['failed']) == (1, 1)
+        # Measured on the original: the three particles, not the drawn outlines
+        assert db.session.get(Image, recovered_id).detections.count() == 3
+        orphan = db.session.get(Image, orphan_id)
+        assert orphan.detections.count() == 1
+        assert not os.path.exists(tmp_path / 'checkpoint.json')
+
+
+def test_analysis_source(app):
+    with app.app_context():
+        write_flat(app, 'a.png', field(1))
+        prefix = app.config['UPLOAD_URL_PREFIX']
+        assert storage.analysis_source('uploads/aa/bb/x.png', 'uploads/aa/bb/x.png') == 'uploads/aa/bb/x.png'
+        assert storage.analysis_source(None, f'{prefix}/a_processed.png') == f'{prefix}/a.png'
+        assert storage.analysis_source(None, f'{prefix}/b_processed.png') is None
+        assert storage.analysis_source(None, f'{prefix}/c.png') == f'{prefix}/c.png'
+
+
+def test_resumes_after_checkpoint(app, legacy, tmp_path):
+    recovered_id, orphan_id = legacy
+    checkpoint = str(tmp_path / 'checkpoint.json')
+    reprocessing.save_checkpoint(checkpoint, {'sample': 1}, recovered_id)
+    with app.app_context():
+        totals = reprocessing.reprocess(Inline(), app.config['DERIVATIVES_FOLDER'], reprocessing.image_query(),
+                                        checkpoint, {'sample': 1})
+        assert totals == {'processed': 0, 'failed': 1, 'resumed_after': recovered_id}
+        # A checkpoint of other filters is ignored
+        reprocessing.save_checkpoint(checkpoint, {'sample': 2}, orphan_id)
+        assert reprocessing.load_checkpoint(checkpoint, {'sample': 1}) == 0
+
+
+def test_analysis_that_raises_counts_as_failed(app, legacy, tmp_path):
+    class Raising(Inline):
+        def submit(self, function, *args):
+            future = Future()
+            future.set_exception(MemoryError())
+            return future
+
+    recovered_id, _ = legacy
+    with app.app_context():
+        totals = reprocessing.reprocess(Raising(), app.config['DERIVATIVES_FOLDER'], reprocessing.image_query(),
+                                        str(tmp_path / 'checkpoint.json'), {})
+        assert (totals['processed'], totals['failed']) == (0, 2)
+        assert db.session.get(Image, recovered_id).status == 'processed'
@@ -0,0 +1,81 @@
+from datetime import date, datetime
+import pytest
+import sqlalchemy as sa
+from app.database import db
+from app.models import Sample
+from app.services import sample_search
+
+# Name search finds substrings case-insensitively, through the trigram index
+# where migration 5b8e2d4f1c70 created it and with LIKE otherwise; quotes,
+# '%' and '_' in the search text are matched literally either way.
+
+NAMES = ['River 100% filtered', 'river_sediment', 'Say "hello" sample', 'Beach sand', 'Rhine', 'ab']
+
+# The index and triggers as migration 5b8e2d4f1c70 creates them
+FTS_DDL = [
+    "CREATE VIRTUAL TABLE sample_name_fts USING fts5(name, content='sample', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER sample_name_fts_insert AFTER INSERT ON sample BEGIN "
+    "INSERT INTO sample_name_fts(rowid, name) VALUES (new.id, new.name); END",
+    "CREATE TRIGGER sample_name_fts_delete AFTER DELETE ON sample BEGIN "
+    "INSERT INTO sample_name_fts(sample_name_fts, rowid, name) VALUES ('delete', old.id, old.name); END",
+    "CREATE TRIGGER sample_name_fts_update AFTER UPDATE OF name ON sample BEGIN "
+    "INSERT INTO sample_name_fts(sample_name_fts, rowid, name) VALUES ('delete', old.id, old.name); "
+    "INSERT INTO sample_name_fts(rowid, name) VALUES (new.id, new.name); END",
+]
+
+
+@pytest.fixture(params=['fts', 'like'])
+def owner(request, app, user):
+    from app.models import User
+
+    with app.app_context():
+        if request.param == 'fts':
+            for statement in FTS_DDL:
+                db.session.execute(sa.text(statement))
+        for n, name in enumerate(NAMES):
+            db.session.add(Sample(name=name, user_id=user, detection_count=10 * n,
+                                  timestamp=datetime(2026, 3, 1 + n, 12)))
+        # Someone else's sample never shows up
+        other = User(username='other', email='other@example.com')
+        db.session.add_all([other, Sample(name='river other', author=other)])
+        db.session.commit()
+        assert sample_search.has_fts() == (request.param == 'fts')
+        yield db.session.get(User, user)
+
+
+def names(owner, **filters):
+    return sorted(sample.name for sample in sample_search.search_samples(owner, **filters))
+
+
+def test_substring_is_case_insensitive(owner):
+    assert names(owner, text='RIVER') == ['River 100% filtered', 'river_sediment']
+    assert names(owner, text='sedim') == ['river_sediment']
+    assert names(owner, text='xyz') == []
+
+
+def test_special_characters_are_literal(owner):
+    assert names(owner, text='100%') == ['River 100% filtered']
+    assert names(owner, text='%') == ['River 100% filtered']
+    assert names(owner, text='r_s') == ['river_sediment']
+    assert names(owner, text='"hello"') == ['Say "hello" sample']
+    assert names(owner, text='"') == ['Say "hello" sample']
+    assert names(owner, text='hello" OR "beach') == []
+
+
+def test_short_terms_and_renames(owner):
+    assert names(owner, text='ab') == ['ab']
+    sample = Sample.query.filter_by(name='Rhine').one()
+    sample.name = 'Danube'
+    db.session.commit()
+    assert names(owner, text='rhine') == []
+    assert names(owner, text='danub') == ['Danube']
+    db.session.delete(sample)
+    db.session.commit()
+    assert names(owner, text='danub') == []
+
+
+def test_dates_and_particle_counts(owner):
+    assert names(owner, start=date(2026, 3, 2), end=date(2026, 3, 3)) == ['Say "hello" sample', 'river_sediment']
+    assert names(owner, min_particles=30, max_particles=40) == ['Beach sand', 'Rhine']
+    newest = sample_search.search_samples(owner, text='river').first()
+    assert newest.name == 'river_sediment'
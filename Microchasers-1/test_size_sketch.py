@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from app.services.size_sketch import SizeSketch, merge_encoded, sketch_sizes
+
+# Size sketches answer percentiles to within one bin of the exact value and
+# merge by adding counts, so merging per-image sketches equals sketching
+# all sizes at once.
+
+BIN_RATIO = 2 ** (1 / 16)
+
+
+def sizes(seed, n):
+    return np.random.default_rng(seed).lognormal(4, 1, n)
+
+
+def test_quantiles_within_one_bin():
+    values = sizes(0, 5000)
+    sketch = SizeSketch.from_sizes(values)
+    for q in (0.1, 0.5, 0.9, 0.99):
+        exact = np.quantile(values, q)
+        assert exact / BIN_RATIO <= sketch.quantile(q) <= exact * BIN_RATIO
+    assert sketch.quantile(0) >= values.min()
+    assert sketch.quantile(1) == pytest.approx(values.max())
+
+
+def test_encode_round_trip_and_summary():
+    values = sizes(1, 300)
+    blob = sketch_sizes(values)
+    decoded = SizeSketch.decode(blob)
+    assert decoded.count == 300
+    assert decoded.mean == pytest.approx(values.mean())
+    assert (decoded.min, decoded.max) == (values.min(), values.max())
+    assert np.array_equal(decoded.counts, SizeSketch.from_sizes(values).counts)
+    count, mean, smallest, largest = SizeSketch.summary(blob)
+    assert (count, smallest, largest) == (300, values.min(), values.max())
+    assert mean == pytest.approx(values.mean())
+
+
+def test_empty_sketch():
+    blob = sketch_sizes([])
+    assert SizeSketch.summary(blob) == (0, None, None, None)
+    assert SizeSketch.decode(blob).quantile(0.5) is None
+    assert SizeSketch.decode(blob).histogram() == []
+
+
+def test_merge_encoded_equals_sketch_of_all_sizes():
+    parts = [sizes(seed, n) for seed, n in ((2, 100), (3, 0), (4, 2500), (5, 1))]
+    merged = merge_encoded([sketch_sizes(part) for part in parts] + [None, b''])
+    whole = SizeSketch.from_sizes(np.concatenate(parts))
+    assert np.array_equal(merged.counts, whole.counts)
+    assert merged.count == whole.count
+    assert merged.sum == pytest.approx(whole.sum)
+    assert (merged.min, merged.max) == (whole.min, whole.max)
+    decoded = SizeSketch.decode(sketch_sizes(parts[0])).merge(SizeSketch.decode(sketch_sizes(parts[2])))
+    assert decoded.quantile(0.5) == pytest.approx(
+        SizeSketch.from_sizes(np.concatenate([parts[0], parts[2]])).quantile(0.5))
+
+
+def test_unknown_version_is_rejected():
+    blob = bytearray(sketch_sizes([1.0, 2.0]))
+    blob[0] = 99
+    with pytest.raises(ValueError):
+        SizeSketch.decode(bytes(blob))
+    with pytest.raises(ValueError):
+        merge_encoded([bytes(blob)])
+
+
+def test_histogram_covers_all_particles():
+    values = sizes(6, 1000)
+    histogram = SizeSketch.from_sizes(values).histogram(bins_per_octave=2)
+    assert sum(count for _, _, count in histogram) == 1000
+    assert histogram[0][0] <= values.min() and histogram[-1][1] >= values.max()
+    with pytest.raises(ValueError):
+        SizeSketch.from_sizes(values).histogram(bins_per_octave=3)
@@ -0,0 +1,114 @@
+import errno
+import io
+import os
+import pytest
+from werkzeug.datastructures import FileStorage
+from app.database import db
+from app.models import StoredFile
+from app.services import storage
+
+# The content-addressed store: identical content is kept once with a
+# reference count, files are deleted only once their last reference is
+# committed away, and uploads in progress are never under the static folder.
+
+
+@pytest.fixture
+def ctx(app):
+    with app.app_context():
+        yield app
+
+
+def upload(data, name='frame.png'):
+    return storage.save_upload(FileStorage(io.BytesIO(data), filename=name))
+
+
+def refcount(filepath):
+    stored = StoredFile.query.filter_by(path=filepath).first()
+    return stored.refcount if stored else 0
+
+
+def test_temp_files_are_not_served(ctx):
+    path = os.path.realpath(storage.temp_path('.png'))
+    assert not path.startswith(os.path.realpath(ctx.static_folder) + os.sep)
+
+
+def test_identical_uploads_share_one_file(ctx):
+    first = upload(b'same bytes', 'a.PNG')
+    second = upload(b'same bytes', 'b.png')
+    db.session.commit()
+    assert first == second
+    assert first.endswith('.png')
+    assert refcount(first) == 2
+    assert os.listdir(ctx.config['UPLOAD_TEMP_FOLDER']) == []
+    assert upload(b'other bytes') != first
+
+
+def test_file_is_unlinked_after_last_release_commits(ctx):
+    filepath = upload(b'content')
+    storage.retain(filepath)
+    db.session.commit()
+    assert refcount(filepath) == 2
+
+    storage.release(filepath)
+    db.session.commit()
+    assert os.path.exists(storage.resolve(filepath))
+
+    storage.release(filepath)
+    assert os.path.exists(storage.resolve(filepath))  # not before the commit
+    db.session.commit()
+    assert not os.path.exists(storage.resolve(filepath))
+    assert refcount(filepath) == 0
+
+
+def test_rolled_back_release_keeps_the_file(ctx):
+    filepath = upload(b'content')
+    db.session.commit()
+    storage.release(filepath)
+    db.session.rollback()
+    db.session.commit()
+    assert os.path.exists(storage.resolve(filepath))
+    assert refcount(filepath) == 1
+
+
+def test_move_across_filesystems_copies(ctx, monkeypatch, tmp_path):
+    source = tmp_path / 'incoming.png'
+    source.write_bytes(b'pixels')
+    real_replace = os.replace
+
+    def replace(src, dst):
+        if src == str(source):
+            raise OSError(errno.EXDEV, 'Invalid cross-device link')
+        return real_replace(src, dst)
+
+    monkeypatch.setattr(os, 'replace', replace)
+    filepath = storage.store_file(str(source))
+    db.session.commit()
+    with open(storage.resolve(filepath), 'rb') as f:
+        assert f.read() == b'pixels'
+    assert not source.exists()
+    assert [name for name in os.listdir(os.path.dirname(storage.resolve(filepath))) if name.endswith('.tmp')] == []
+
+
+def test_copy_leaves_the_source(ctx, tmp_path):
+    source = tmp_path / 'video.mp4'
+    source.write_bytes(b'frames')
+    filepath = storage.store_file(str(source), move=False)
+    db.session.commit()
+    assert source.exists()
+    assert os.path.exists(storage.resolve(filepath))
+
+
+def test_references_are_counted_in_sql(ctx):
+    # Both references are taken in one transaction, without flushing an ORM row in between
+    first = upload(b'content')
+    second = upload(b'content')
+    assert first == second
+    assert db.session.execute(db.select(StoredFile.refcount).filter_by(path=first)).scalar_one() == 2
+    db.session.commit()
+
+    storage.release(first)
+    storage.release(first)
+    storage.release('uploads/never/stored.png')
+    db.session.commit()
+    assert StoredFile.query.count() == 0
+    assert not os.path.exists(storage.resolve(first))
@@ -0,0 +1,114 @@
+import os
+import cv2
+import numpy as np
+import pytest
+from app.services import tier_comparison
+from app.services.image_processing import detect_microplastics
+from app.services.tier_comparison import compare_tiers, match_detections
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+FEATURES = ('x_coordinate', 'y_coordinate', 'size', 'shape', 'color')
+
+# The standard tier must keep giving what the detector gave before tiers
+# existed; fast and precise are measured against it.
+
+
+def pre_tier_detections(image_path):
+    """The detector as it was before tiers, less its annotation, as the reference."""
+    image = cv2.imread(image_path, cv2.IMREAD_COLOR)
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    mask = np.zeros(image.shape[:2], dtype=np.uint8)
+    for lower, upper in [((0, 0, 150), (180, 30, 255)), ((0, 50, 50), (180, 255, 255))]:
+        mask = cv2.bitwise_or(mask, cv2.inRange(hsv, np.array(lower), np.array(upper)))
+    kernel = np.ones((3, 3), np.uint8)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    detections = []
+    for contour in contours:
+        area = cv2.contourArea(contour)
+        if area < 50 or area > 10000:
+            continue
+        hull_area = cv2.contourArea(cv2.convexHull(contour))
+        if hull_area == 0 or area / hull_area < 0.1:
+            continue
+        moments = cv2.moments(contour)
+        if moments['m00'] == 0:
+            continue
+        perimeter = cv2.arcLength(contour, True)
+        if perimeter == 0:
+            continue
+        circularity = 4 * np.pi * (area / (perimeter * perimeter))
+        _, _, w, h = cv2.boundingRect(contour)
+        shape = 'fragment'
+        if circularity > 0.8:
+            shape = 'bead'
+        elif w / h > 3 or w / h < 0.3:
+            shape = 'fiber'
+        particle = np.zeros(image.shape[:2], dtype='uint8')
+        cv2.drawContours(particle, [contour], -1, 255, -1)
+        b, g, r, _ = cv2.mean(image, mask=particle)
+        detections.append({'x_coordinate': int(moments['m10'] / moments['m00']),
+                           'y_coordinate': int(moments['m01'] / moments['m00']),
+                           'size': area, 'shape': shape, 'color': '#%02x%02x%02x' % (int(r), int(g), int(b))})
+    return detections
+
+
+@pytest.fixture(scope='module')
+def field(tmp_path_factory):
+    """Beads, fibres and fragments of random colours on a noisy background."""
+    rng = np.random.default_rng(3)
+    image = (np.full((600, 800, 3), 30) + rng.integers(0, 20, (600, 800, 3))).astype(np.uint8)
+    for i in range(60):
+        x, y = int(rng.integers(20, 780)), int(rng.integers(20, 580))
+        colour = tuple(int(v) for v in rng.integers(60, 256, 3))
+        if i % 3 == 0:
+            cv2.circle(image, (x, y), int(rng.integers(5, 20)), colour, -1)
+        elif i % 3 == 1:
+            end = (x + int(rng.integers(-60, 60)), y + int(rng.integers(-60, 60)))
+            cv2.line(image, (x, y), end, colour, int(rng.integers(2, 5)))
+        else:
+            corners = [[x, y], [x + int(rng.integers(8, 30)), y + 5], [x + 10, y + int(rng.integers(8, 30))]]
+            cv2.fillPoly(image, [np.array(corners)], colour)
+    path = str(tmp_path_factory.mktemp('tiers') / 'field.png')
+    cv2.imwrite(path, image)
+    return path
+
+
+@pytest.mark.parametrize('name', ['test_image.png', 'app/static/uploads/sample.jpg',
+                                  'app/static/uploads/test_image.png', 'field'])
+def test_standard_matches_pre_tier_detector(name, field):
+    path = field if name == 'field' else os.path.join(APP_DIR, name)
+    detections = detect_microplastics(path, 'standard')
+    assert [{key: d[key] for key in FEATURES} for d in detections] == pre_tier_detections(path)
+
+
+def test_other_tiers_agree_with_standard(field):
+    report = compare_tiers([field], repeat=1)
+    assert report['images'] == 1
+    assert report['standard']['f1'] == 1.0 and report['standard']['size_error'] == 0.0
+    for tier in ('fast', 'precise'):
+        assert report[tier]['recall'] > 0.8 and report[tier]['precision'] > 0.8
+        assert report[tier]['failed'] == 0
+
+
+def test_image_another_tier_cannot_read_is_left_out(field, monkeypatch):
+    def detect(path, tier):
+        return None if tier == 'fast' else detect_microplastics(path, tier)
+
+    monkeypatch.setattr(tier_comparison, 'detect_microplastics', detect)
+    report = compare_tiers([field, field], repeat=1)
+    assert report['images'] == 2
+    assert (report['fast']['failed'], report['fast']['detections']) == (2, 0)
+    assert report['precise']['failed'] == 0 and report['precise']['detections'] > 0
+
+
+def test_match_detections_pairs_closest_first():
+    def points(*xys):
+        return [{'x_coordinate': x, 'y_coordinate': y} for x, y in xys]
+
+    reference = points((0, 0), (10, 0), (100, 100))
+    candidate = points((9, 0), (1, 0), (50, 50))
+    assert sorted(match_detections(reference, candidate, tolerance=5)) == [(0, 1), (1, 0)]
+    assert match_detections(reference, [], tolerance=5) == []
@@ -0,0 +1,98 @@
+import io
+import struct
+import cv2
+import numpy as np
+import pytest
+from app.services import tiff_stack
+
+# Stack pages are parsed from the directory chain and memory-mapped when
+# stored uncompressed, decoded through OpenCV otherwise, and normalised to
+# 8-bit BGR per page.
+
+
+def stack(tmp_path, pages, compression=1):
+    path = str(tmp_path / 'stack.tif')
+    assert cv2.imwritemulti(path, pages, [cv2.IMWRITE_TIFF_COMPRESSION, compression])
+    return path
+
+
+def big_endian(pixels, loop=False):
+    """A one-page big-endian TIFF of 16-bit greyscale, written by hand."""
+    height, width = pixels.shape
+    data = pixels.astype('>u2').tobytes()
+    entries = [(tiff_stack.IMAGE_WIDTH, 3, width), (tiff_stack.IMAGE_LENGTH, 3, height),
+               (tiff_stack.BITS_PER_SAMPLE, 3, 16), (tiff_stack.COMPRESSION, 3, 1),
+               (tiff_stack.PHOTOMETRIC, 3, 1), (tiff_stack.STRIP_OFFSETS, 4, 8),
+               (tiff_stack.STRIP_BYTE_COUNTS, 4, len(data))]
+    ifd = 8 + len(data)
+    directory = struct.pack('>H', len(entries))
+    for tag, kind, value in entries:
+        packed = struct.pack('>H', value) + b'\0\0' if kind == 3 else struct.pack('>I', value)
+        directory += struct.pack('>HHI', tag, kind, 1) + packed
+    # A chain pointing back at itself must not loop forever
+    directory += struct.pack('>I', ifd if loop else 0)
+    return b'MM' + struct.pack('>HI', 42, ifd) + data + directory
+
+
+def test_uncompressed_pages_are_mapped(tmp_path):
+    pages = [np.full((30, 40), 1000 * n, np.uint16) for n in range(3)]
+    path = stack(tmp_path, pages)
+    listed = tiff_stack.list_pages(path)
+    assert [(page.index, page.width, page.height, page.dtype) for page in listed] == \
+        [(n, 40, 30, '<u2') for n in range(3)]
+    assert all(page.mappable for page in listed)
+    second = tiff_stack.read_page(path, listed[1])
+    assert isinstance(second, np.memmap)
+    assert np.array_equal(second, pages[1])
+
+
+def test_compressed_pages_are_decoded(tmp_path):
+    pages = [np.random.default_rng(n).integers(0, 4096, (30, 40), dtype=np.uint16) for n in range(2)]
+    path = stack(tmp_path, pages, compression=5)
+    listed = tiff_stack.list_pages(path)
+    assert not any(page.mappable for page in listed)
+    assert np.array_equal(tiff_stack.read_page(path, listed[1]), pages[1])
+    assert np.array_equal(tiff_stack.read_page(path, 0), pages[0])
+
+
+def test_colour_page_is_bgr(tmp_path):
+    colour = np.random.default_rng(0).integers(0, 256, (20, 30, 3), dtype=np.uint8)
+    path = stack(tmp_path, [colour])
+    page, = tiff_stack.list_pages(path)
+    assert page.mappable
+    assert np.array_equal(tiff_stack.read_page(path, page), colour)
+
+
+def test_big_endian_and_looping_chain(tmp_path):
+    pixels = np.arange(12, dtype=np.uint16).reshape(3, 4) * 1000
+    path = tmp_path / 'be.tif'
+    path.write_bytes(big_endian(pixels, loop=True))
+    page, = tiff_stack.list_pages(str(path))
+    assert page.dtype == '>u2' and page.mappable
+    assert np.array_equal(tiff_stack.read_page(str(path), page), pixels)
+
+
+def test_first_page_dimensions():
+    stream = io.BytesIO(big_endian(np.zeros((5, 7), np.uint16)))
+    assert tiff_stack.first_page_dimensions(stream) == (7, 5)
+    assert stream.tell() == 0
+    assert tiff_stack.first_page_dimensions(io.BytesIO(b'II*\0\xff\xff\xff\xff')) is None
+    assert tiff_stack.first_page_dimensions(io.BytesIO(b'\x89PNG\r\n\x1a\n')) is None
+    assert tiff_stack.read_pages(io.BytesIO(b'MM\0\x2b\0\0\0\x08')) is None
+
+
+@pytest.mark.parametrize('dtype', [np.uint16, np.float32])
+def test_to_8bit_stretches_each_page(dtype):
+    dim = np.linspace(100, 200, 64 * 64).reshape(64, 64).astype(dtype)
+    image = tiff_stack.to_8bit(dim)
+    assert image.dtype == np.uint8 and image.shape == (64, 64, 3)
+    assert image.min() <= 1 and image.max() >= 254
+    flat = tiff_stack.to_8bit(np.full((8, 8), 7, dtype))
+    assert flat.shape == (8, 8, 3)
+
+
+def test_to_8bit_keeps_8bit_and_drops_alpha():
+    grey = np.random.default_rng(1).integers(0, 256, (10, 10), dtype=np.uint8)
+    assert np.array_equal(tiff_stack.to_8bit(grey)[..., 0], grey)
+    bgra = np.zeros((10, 10, 4), np.uint8)
+    assert tiff_stack.to_8bit(bgra).shape == (10, 10, 3)
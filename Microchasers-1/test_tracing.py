@@ -0,0 +1,93 @@
+import logging
+import pytest
+from conftest import log_in
+from app.database import db
+from app.models import User
+from app.tracing import LATENCY_BUCKETS, RequestMetrics
+
+# Every request is recorded per endpoint: latency in histogram buckets, the
+# SQL it ran and the bytes it sent, readable as JSON or as Prometheus text.
+
+
+def test_record_and_snapshot():
+    metrics = RequestMetrics()
+    metrics.record('main.index', 200, 0.003, 4, 0.001, 1000)
+    metrics.record('main.index', 500, 0.2, 2, 0.002, 10)
+    metrics.record('main.index', 200, 60.0, 0, 0.0, 0)
+    stats = metrics.snapshot()['main.index']
+    assert (stats['count'], stats['errors']) == (3, 1)
+    assert stats['sql_statements'] == 6 and stats['sql_statements_avg'] == 2.0
+    assert stats['sql_time_ms'] == 3.0
+    assert stats['response_bytes'] == 1010
+    assert stats['latency_avg_ms'] == pytest.approx((0.003 + 0.2 + 60.0) / 3 * 1000)
+    buckets = dict((bound, count) for bound, count in stats['latency_buckets'])
+    assert (buckets[0.005], buckets[0.25], buckets['+Inf']) == (1, 1, 1)
+    assert sum(buckets.values()) == 3
+    # A latency on a bound falls in that bucket, as Prometheus' 'le' says
+    metrics.record('other', 200, LATENCY_BUCKETS[0], 0, 0.0, 0)
+    assert metrics.snapshot()['other']['latency_buckets'][0] == [LATENCY_BUCKETS[0], 1]
+
+
+def test_prometheus_text():
+    metrics = RequestMetrics()
+    metrics.record('api.sizes', 200, 0.03, 3, 0.004, 512)
+    metrics.record('api.sizes', 503, 0.7, 1, 0.001, 20)
+    lines = metrics.prometheus().splitlines()
+    assert '# TYPE microchasers_request_duration_seconds histogram' in lines
+    buckets = [line for line in lines if line.startswith('microchasers_request_duration_seconds_bucket')]
+    assert len(buckets) == len(LATENCY_BUCKETS) + 1
+    # Buckets are cumulative and end with every request
+    counts = [int(line.rsplit(' ', 1)[1]) for line in buckets]
+    assert counts == sorted(counts) and counts[-1] == 2
+    assert 'microchasers_request_duration_seconds_bucket{endpoint="api.sizes",le="0.05"} 1' in lines
+    assert 'microchasers_request_duration_seconds_count{endpoint="api.sizes"} 2' in lines
+    assert 'microchasers_request_errors_total{endpoint="api.sizes"} 1' in lines
+    assert 'microchasers_sql_statements_total{endpoint="api.sizes"} 4' in lines
+    assert 'microchasers_response_bytes_total{endpoint="api.sizes"} 532' in lines
+
+
+@pytest.fixture
+def admin(app):
+    from app.auth.forms import ADMIN_CREDENTIALS
+
+    with app.app_context():
+        account = User(username=ADMIN_CREDENTIALS['username'], email=ADMIN_CREDENTIALS['email'])
+        db.session.add(account)
+        db.session.commit()
+        return account.id
+
+
+def test_requests_are_traced(app, client, user, admin):
+    log_in(client, user)
+    for _ in range(3):
+        response = client.get('/samples')
+        assert response.status_code == 200
+    client.get('/no/such/page')
+
+    log_in(client, admin)
+    stats = client.get('/admin/metrics').get_json()['endpoints']
+    samples = stats['main.samples']
+    assert samples['count'] == 3 and samples['errors'] == 0
+    assert samples['sql_statements'] >= 3
+    assert samples['response_bytes'] == 3 * len(response.data)
+    assert stats['unmatched']['count'] == 1
+
+    text = client.get('/admin/metrics?format=prometheus')
+    assert text.mimetype == 'text/plain'
+    assert 'microchasers_request_duration_seconds_count{endpoint="main.samples"} 3' in text.get_data(as_text=True)
+
+
+@pytest.mark.app_config(SLOW_REQUEST_MS=0.001)
+def test_slow_requests_are_logged_with_their_sql(app, client, user):
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    app.logger.addHandler(handler)
+    try:
+        log_in(client, user)
+        client.get('/samples')
+    finally:
+        app.logger.removeHandler(handler)
+    slow, = [record for record in records if record.getMessage().startswith('Slow request GET /samples')]
+    assert slow.endpoint == 'main.samples'
+    assert slow.sql and all('statement' in entry and 'ms' in entry for entry in slow.sql)
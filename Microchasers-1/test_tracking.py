@@ -0,0 +1,107 @@
+from concurrent.futures import Future
+import cv2
+import numpy as np
+import pytest
+from app.services.tracking import SpatialHashTracker, ParticleTrack, decode_points, path_length
+
+# Linking detections across frames: each particle keeps one track through
+# motion and short gaps, and nearby particles never swap or merge.
+
+
+def det(x, y, size=10.0):
+    return {'x_coordinate': float(x), 'y_coordinate': float(y), 'size': size}
+
+
+def run(tracker, frames):
+    finished = []
+    for frame, detections in frames:
+        finished += tracker.update(frame, detections)
+    return finished + tracker.finish()
+
+
+def test_moving_particles_keep_their_tracks():
+    frames = [(n, [det(10 + 5 * n, 50), det(200 - 5 * n, 60)]) for n in range(10)]
+    tracks = run(SpatialHashTracker(max_distance=8), frames)
+    assert len(tracks) == 2
+    for track in tracks:
+        assert len(track.frames) == 10
+        xs = [d['x_coordinate'] for d in track.detections]
+        assert xs == sorted(xs) or xs == sorted(xs, reverse=True)
+
+
+def test_track_survives_gap_up_to_max_gap():
+    # Missed in frames 4 and 5
+    frames = [(n, [det(10 + 3 * n, 50)] if n not in (4, 5) else []) for n in range(10)]
+    tracks = run(SpatialHashTracker(max_distance=8, max_gap=2), frames)
+    assert len(tracks) == 1
+    tracks = run(SpatialHashTracker(max_distance=8, max_gap=1), frames)
+    assert len(tracks) == 2
+
+
+def test_tracks_finish_once_unseen_for_longer_than_gap():
+    tracker = SpatialHashTracker(max_distance=8, max_gap=2)
+    assert tracker.update(0, [det(10, 10)]) == []
+    assert tracker.update(1, []) == []
+    assert tracker.update(2, []) == []
+    finished = tracker.update(3, [])
+    assert len(finished) == 1 and finished[0].frames == [0]
+    assert tracker.finish() == []
+
+
+def test_far_detections_start_new_tracks():
+    tracks = run(SpatialHashTracker(max_distance=5), [(0, [det(10, 10)]), (1, [det(30, 10)])])
+    assert len(tracks) == 2
+
+
+def test_nearest_pairs_are_taken_first():
+    # Two particles close together: each continues with its own nearest detection
+    frames = [(0, [det(100, 100), det(108, 100)]), (1, [det(109, 100), det(101, 100)])]
+    tracks = sorted(run(SpatialHashTracker(max_distance=10), frames), key=lambda t: t.detections[0]['x_coordinate'])
+    assert [d['x_coordinate'] for d in tracks[0].detections] == [100, 101]
+    assert [d['x_coordinate'] for d in tracks[1].detections] == [108, 109]
+
+
+def test_points_round_trip_and_path_length():
+    track = ParticleTrack(3, det(0, 0, 4.0))
+    track.extend(4, det(3, 4, 6.0))
+    track.extend(6, det(3, 10, 5.0))
+    points = decode_points(track.encode_points())
+    assert list(points['frame']) == [3, 4, 6]
+    assert list(points['x']) == [0, 3, 3]
+    assert list(points['size']) == [4, 6, 5]
+    assert path_length(track) == pytest.approx(11.0)
+    assert track.representative()['size'] == 5.0
+    assert len(decode_points(None)) == 0
+
+
+class InlineFrames:
+    def submit(self, function, *args):
+        future = Future()
+        future.set_result(function(*args))
+        return future
+
+
+def test_gap_is_counted_in_analysed_frames(app, user, tmp_path):
+    from app.database import db
+    from app.models import Sample, Track
+    from app.services.video import VideoIngest
+
+    frames = tmp_path / 'frames'
+    frames.mkdir()
+    for n in range(12):
+        image = np.full((200, 300), 30, np.uint8)
+        # One particle drifting right, missed in frame 6, which is analysed with step 3
+        if n != 6:
+            cv2.circle(image, (40 + 2 * n, 100), 10, 230, -1)
+        cv2.imwrite(str(frames / f'{n:03d}.png'), image)
+
+    with app.app_context():
+        sample = Sample(name='flow cell', user_id=user)
+        db.session.add(sample)
+        db.session.commit()
+        ingest = VideoIngest(InlineFrames(), sample, app.config['DERIVATIVES_FOLDER'], step=3, in_flight=1)
+        totals = ingest.run(str(frames))
+        assert totals['frames'] == 4
+        assert totals['particles'] == 1
+        track = Track.query.one()
+        assert (track.first_frame, track.last_frame, track.frame_count) == (0, 9, 3)
@@ -0,0 +1,104 @@
+import io
+from concurrent.futures import Future
+import cv2
+import numpy as np
+import pytest
+from conftest import log_in
+from app.database import db
+from app.models import Sample, Image
+
+# An image must never be left 'processing' when its analysis goes wrong:
+# the upload is recorded as failed and the user is told so.
+
+
+def make_sample(app, user):
+    with app.app_context():
+        sample = Sample(name='flow cell', user_id=user)
+        db.session.add(sample)
+        db.session.commit()
+        return sample.id
+
+
+def png_bytes(seed=0):
+    rng = np.random.default_rng(seed)
+    image = np.full((300, 400), 40, np.uint8)
+    for _ in range(5):
+        cv2.circle(image, (int(rng.integers(20, 380)), int(rng.integers(20, 280))), 8, 220, -1)
+    return cv2.imencode('.png', image)[1].tobytes()
+
+
+def upload(client, sample_id, data, name='frame.png'):
+    return client.post(f'/sample/{sample_id}', data={'image': (io.BytesIO(data), name)},
+                       content_type='multipart/form-data', follow_redirects=True)
+
+
+def test_upload_is_processed(app, client, user):
+    sample_id = make_sample(app, user)
+    log_in(client, user)
+    response = upload(client, sample_id, png_bytes())
+    assert b'processed successfully' in response.data
+    with app.app_context():
+        image = Image.query.one()
+        assert image.status == 'processed'
+        assert image.detections.count() > 0
+
+
+@pytest.mark.parametrize('error', [RuntimeError('pool broke'), TimeoutError()])
+def test_upload_whose_analysis_raises_is_failed(app, client, user, monkeypatch, error):
+    from app.main import routes
+
+    def fail(*args, **kwargs):
+        raise error
+
+    monkeypatch.setattr(routes, 'run_analysis', fail)
+    sample_id = make_sample(app, user)
+    log_in(client, user)
+    response = upload(client, sample_id, png_bytes())
+    assert response.status_code == 200
+    assert b'could not be analysed' in response.data
+    with app.app_context():
+        image = Image.query.one()
+        assert image.status == 'failed'
+        assert db.session.get(Sample, sample_id).image_count == 1
+
+
+def test_unreadable_upload_is_failed(app, client, user):
+    sample_id = make_sample(app, user)
+    log_in(client, user)
+    response = upload(client, sample_id, b'not an image at all')
+    assert b'could not be analysed' in response.data
+    with app.app_context():
+        assert Image.query.one().status == 'failed'
+
+
+class FailingExecutor:
+    """Runs frames inline, and raises on the ``fail_at``-th one, like a pool process dying."""
+
+    def __init__(self, fail_at):
+        self.fail_at = fail_at
+        self.submitted = 0
+
+    def submit(self, function, *args):
+        self.submitted += 1
+        if self.submitted == self.fail_at:
+            raise RuntimeError('pool broke')
+        future = Future()
+        future.set_result(function(*args))
+        return future
+
+
+def test_video_ingest_that_raises_is_failed(app, user, tmp_path):
+    from app.services.video import VideoIngest
+
+    frames = tmp_path / 'frames'
+    frames.mkdir()
+    for n in range(6):
+        (frames / f'{n:03d}.png').write_bytes(png_bytes())
+    sample_id = make_sample(app, user)
+    with app.app_context():
+        ingest = VideoIngest(FailingExecutor(fail_at=4), db.session.get(Sample, sample_id),
+                             app.config['DERIVATIVES_FOLDER'], in_flight=1)
+        with pytest.raises(RuntimeError):
+            ingest.run(str(frames))
+        db.session.expire_all()
+        assert Image.query.one().status == 'failed'
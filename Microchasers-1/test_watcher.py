@@ -0,0 +1,116 @@
+import os
+import cv2
+import numpy as np
+import pytest
+from app.database import db
+from app.models import Sample, Image
+from app.services import importer as importer_module
+from app.services.importer import Importer
+from app.services.watcher import FolderWatcher, WatchState
+
+# The folder watcher hands every file on exactly once: files that fail are
+# recorded rather than retried on every start, and a stack only counts as
+# done once all its pages are stored, so an interrupted one is completed.
+
+
+class Inline:
+    def __init__(self):
+        self.submitted = 0
+
+    def submit(self, function, *args):
+        from concurrent.futures import Future
+
+        self.submitted += 1
+        future = Future()
+        future.set_result(function(*args))
+        return future
+
+
+def write_image(path, shade=230):
+    image = np.full((80, 100, 3), 40, np.uint8)
+    cv2.circle(image, (50, 40), 8, (shade, shade, shade), -1)
+    cv2.imwrite(str(path), image)
+
+
+def write_stack(path, pages):
+    frames = [np.full((40, 50), 1000 * (n + 1), np.uint16) for n in range(pages)]
+    assert cv2.imwritemulti(str(path), frames)
+
+
+@pytest.fixture
+def sample_id(app, user):
+    with app.app_context():
+        sample = Sample(name='flow cell', user_id=user)
+        db.session.add(sample)
+        db.session.commit()
+        return sample.id
+
+
+def watch(app, sample_id, folder, rounds=3, executor=None):
+    """Runs a watcher on ``folder`` for a few rounds, as the watch-folder command does."""
+    with app.app_context():
+        sample = db.session.get(Sample, sample_id)
+        state = WatchState(str(folder / '.state.json'), sample_id)
+        watcher = FolderWatcher(str(folder), state, settle=0, poll_interval=0.01, use_inotify=False)
+        importer = Importer(executor or Inline(), sample.author, app.config['DERIVATIVES_FOLDER'], batch_size=1,
+                            in_flight=1, on_done=lambda path: watcher.done(os.path.basename(path)))
+        importer.attach(sample)
+        left = [rounds]
+
+        def stop():
+            left[0] -= 1
+            return left[0] < 0
+
+        watcher.run(importer, sample.name, stop, timeout=0.01)
+        watcher.close()
+        return importer.totals, sorted(state.files)
+
+
+def test_unreadable_file_is_done_and_watching_continues(app, sample_id, tmp_path, monkeypatch):
+    write_image(tmp_path / 'a.png')
+    (tmp_path / 'b.png').write_bytes(b'not really')
+    write_image(tmp_path / 'c.png', shade=200)
+    digest = importer_module.file_digest
+
+    def failing_digest(path):
+        if path.endswith('b.png'):
+            raise OSError('read error')
+        return digest(path)
+
+    monkeypatch.setattr(importer_module, 'file_digest', failing_digest)
+    totals, done = watch(app, sample_id, tmp_path)
+    assert totals['imported'] == 2
+    assert done == ['a.png', 'b.png', 'c.png']
+    # Nothing is taken again on the next start
+    totals, _ = watch(app, sample_id, tmp_path)
+    assert totals['imported'] == 0
+
+
+def test_empty_stack_is_done(app, sample_id, tmp_path):
+    (tmp_path / 'empty.tif').write_bytes(b'II*\0\0\0\0\0')
+    totals, done = watch(app, sample_id, tmp_path)
+    assert (totals['imported'], totals['failed']) == (0, 1)
+    assert done == ['empty.tif']
+
+
+def test_stack_is_done_after_its_last_page(app, sample_id, tmp_path):
+    write_stack(tmp_path / 'stack.tif', 3)
+    done = []
+    with app.app_context():
+        sample = db.session.get(Sample, sample_id)
+        importer = Importer(Inline(), sample.author, app.config['DERIVATIVES_FOLDER'], batch_size=1,
+                            in_flight=1, on_done=done.append)
+        importer.attach(sample)
+        assert importer.add_stack(sample.name, str(tmp_path / 'stack.tif'))
+        # Two pages are committed, the third is still in flight: then the watcher stops dead
+        assert Image.query.count() == 2 and done == []
+
+        resumed = Importer(Inline(), sample.author, app.config['DERIVATIVES_FOLDER'], batch_size=1,
+                           in_flight=1, on_done=done.append)
+        resumed.attach(sample)
+        assert resumed.add_stack(sample.name, str(tmp_path / 'stack.tif'))
+        totals, _ = resumed.finish()
+        assert totals['imported'] == 1
+        assert done == [str(tmp_path / 'stack.tif')]
+        assert sorted(page for (page,) in db.session.query(Image.stack_page)) == [0, 1, 2]
+        assert resumed.add_stack(sample.name, str(tmp_path / 'stack.tif')) is False
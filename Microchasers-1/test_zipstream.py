@@ -0,0 +1,83 @@
+import csv
+import io
+import os
+import zipfile
+import cv2
+import numpy as np
+from conftest import log_in
+from app.database import db
+from app.models import Sample, Image, Detection, SensorReading
+from app.services import storage
+from app.services.zipstream import stream_zip
+
+# Archives are produced piece by piece without seeking, and whatever
+# zipfile makes of the pieces is a complete, valid archive.
+
+
+def read_archive(pieces):
+    return zipfile.ZipFile(io.BytesIO(b''.join(pieces)))
+
+
+def test_members_of_every_kind(tmp_path):
+    path = tmp_path / 'frame.png'
+    path.write_bytes(os.urandom(3000))
+    rows = (f'{n},{n * n}\n'.encode() for n in range(5000))
+    pieces = list(stream_zip([('frame.png', str(path)), ('notes.txt', b'hello'), ('missing.png', None),
+                              ('rows.csv', rows)], chunk_size=1024))
+    assert len(pieces) > 3
+    archive = read_archive(pieces)
+    assert archive.testzip() is None
+    assert archive.namelist() == ['frame.png', 'notes.txt', 'rows.csv']
+    assert archive.read('frame.png') == path.read_bytes()
+    assert archive.read('notes.txt') == b'hello'
+    assert archive.read('rows.csv').splitlines()[-1] == b'4999,24990001'
+    # Already compressed images are stored, everything else deflated
+    assert archive.getinfo('frame.png').compress_type == zipfile.ZIP_STORED
+    assert archive.getinfo('rows.csv').compress_type == zipfile.ZIP_DEFLATED
+
+
+def test_content_is_consumed_lazily():
+    consumed = []
+
+    def chunks(name):
+        consumed.append(name)
+        yield name.encode()
+
+    pieces = stream_zip((name, chunks(name)) for name in ('a.txt', 'b.txt'))
+    first = next(pieces)
+    assert consumed == ['a.txt']
+    archive = read_archive([first] + list(pieces))
+    assert consumed == ['a.txt', 'b.txt']
+    assert archive.read('b.txt') == b'b.txt'
+
+
+def test_empty_archive():
+    assert read_archive(stream_zip([])).namelist() == []
+
+
+def test_sample_export(app, client, user):
+    with app.app_context():
+        sample = Sample(name='flow cell', user_id=user)
+        path = storage.resolve(f'{app.config["UPLOAD_URL_PREFIX"]}/old_processed.png')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        cv2.imwrite(path, np.zeros((8, 8), np.uint8))
+        image = Image(filepath=f'{app.config["UPLOAD_URL_PREFIX"]}/old_processed.png', sample=sample,
+                      status='processed')
+        db.session.add_all([sample, image, SensorReading(temperature=21.5, ph=7.1, sample=sample)] +
+                           [Detection(image=image, x_coordinate=n, y_coordinate=n, size=1.0, shape='round',
+                                      color='red') for n in range(3)])
+        db.session.commit()
+        sample_id, image_id = sample.id, image.id
+
+    log_in(client, user)
+    response = client.get(f'/api/sample/{sample_id}/export/zip')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/zip'
+    archive = zipfile.ZipFile(io.BytesIO(response.data))
+    assert archive.namelist() == [f'processed/{image_id}.png', 'detections.csv', 'readings.csv']
+    with open(path, 'rb') as f:
+        assert archive.read(f'processed/{image_id}.png') == f.read()
+    detections = list(csv.reader(io.StringIO(archive.read('detections.csv').decode())))
+    assert len(detections) == 4 and detections[1][0] == str(image_id)
+    readings = list(csv.reader(io.StringIO(archive.read('readings.csv').decode())))
+    assert readings[1][1:3] == ['21.5', '7.1']